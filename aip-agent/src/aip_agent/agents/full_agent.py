@@ -44,6 +44,7 @@ class FullAgentWrapper:
         runtime: Optional[GrpcWorkerAgentRuntime] = None,
         server_names: List[str] = None,
         functions: List[Callable] = None,
+        recall_dir: Optional[str] = None,
         **agent_kwargs
     ) -> None:
         """Initialize FullAgent
@@ -53,6 +54,8 @@ class FullAgentWrapper:
             name: Agent name
             host_address: gRPC host address
             description: Agent description
+            recall_dir: If set, conversation messages are embedded into a vector
+                index in this directory, so queries can recall older relevant turns
             agent_kwargs: Additional arguments to pass to the agent class
         """
         self._agent_cls = agent_cls
@@ -61,6 +64,7 @@ class FullAgentWrapper:
         self._description = description
         self._server_names = server_names
         self._functions = functions
+        self._recall_dir = recall_dir
         self._agent_kwargs = agent_kwargs
         
         if runtime:
@@ -144,7 +148,8 @@ class FullAgentWrapper:
             membase_account=membase_account, 
             auto_upload_to_hub=True, 
             preload_from_hub=False,
-            default_conversation_id=default_conversation_id  
+            default_conversation_id=default_conversation_id,
+            recall_dir=self._recall_dir
         )
         self._memory.load_from_hub(default_conversation_id)
         
@@ -217,19 +222,28 @@ class FullAgentWrapper:
                             system_prompt: Optional[str] = None,
                             recent_n_messages: int = 16,
                             use_tool_call: bool = True,
+                            recall_n_messages: int = 0,
+                            max_history_tokens: Optional[int] = None,
+                            history_strategy: str = "recent",
                             ) -> str:
-        """Process user queries and generate responses"""
+        """Process user queries and generate responses
+
+        With recall_dir set, up to recall_n_messages older messages relevant
+        to the query are added before the recent ones. With max_history_tokens
+        set, the history is instead selected to fit that many tokens, using
+        history_strategy ("recent", "summary" or "relevance").
+        """
         if not self._initialized:
             raise RuntimeError("Agent not initialized")
         
         memory = self._memory.get_memory(conversation_id)
-        self._memory.load_from_hub(conversation_id) 
+        await self._memory.load_from_hub_async(conversation_id)
 
         # query starts with @xxx, it is a command to the xxx agent
         # "@agent_text, query" or "@agent_text query"
         query = query.strip()
         if query.startswith("@"):
-            memory.add(Message(content=query, name=self._name, role="user"))
+            await memory.add_async(Message(content=query, name=self._name, role="user"))
 
             # Remove @ symbol first
             query_without_at = query[1:]
@@ -267,14 +281,31 @@ class FullAgentWrapper:
                 response = await self.send_message(agent_name, "ask", new_query)
                 if response.startswith("Error:"):
                     return response
-                memory.add(Message(content=response, name=self._name, role="assistant"))
+                await memory.add_async(Message(content=response, name=self._name, role="assistant"))
                 return response
             except Exception as e:
                 print(f"Error in process_query: {e}")
                 return f"Error: {e}"
 
-        if use_history:
+        if use_history and max_history_tokens is not None:
+            msgs = await asyncio.to_thread(
+                self._memory.build_context,
+                max_history_tokens,
+                conversation_id,
+                history_strategy,
+                query,
+            )
+        elif use_history:
             msgs = memory.get(recent_n=recent_n_messages)
+            if recall_n_messages > 0 and self._recall_dir:
+                recent_ids = {msg.id for msg in msgs}
+                recalled = await asyncio.to_thread(memory.recall, query, recall_n_messages)
+                # older turns first, in conversation order
+                recalled = sorted(
+                    (msg for msg in recalled if msg.id not in recent_ids),
+                    key=lambda msg: msg.timestamp,
+                )
+                msgs = recalled + msgs
         else:
             msgs = []
 
@@ -287,7 +318,7 @@ class FullAgentWrapper:
                 mps.append(ChatCompletionAssistantMessageParam(content=msg.content, role=msg.role))
         mps.append(ChatCompletionUserMessageParam(content=query, role="user"))
         
-        memory.add(Message(content=query, name=self._name, role="user"))
+        await memory.add_async(Message(content=query, name=self._name, role="user"))
         response = await self._llm.generate_str(
             mps,
             request_params=RequestParams(
@@ -298,7 +329,7 @@ class FullAgentWrapper:
         )
         if response.startswith("Error:"):
             return response
-        memory.add(Message(content=response, name=self._name, role="assistant"))
+        await memory.add_async(Message(content=response, name=self._name, role="assistant"))
         return response
 
     async def send_message(self, target_id: str, action: str, message: str):
@@ -1,5 +1,8 @@
 from fastapi import APIRouter, HTTPException, status, BackgroundTasks
-from typing import List, Union, Optional
+from fastapi.responses import StreamingResponse
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Union, Optional
+import json
 from membase.knowledge.document import Document
 from membase.knowledge.chroma import ChromaKnowledgeBase
 from models.knowledge import (
@@ -43,6 +46,36 @@ def document_to_response(doc: Document) -> DocumentResponse:
     )
 
 
+EXPORT_PAGE_SIZE = 512
+
+
+def stream_documents(kb: ChromaKnowledgeBase, page_size: int = EXPORT_PAGE_SIZE) -> Iterator[bytes]:
+    """Yield all documents as NDJSON, reading the collection page by page."""
+    page = []
+    for doc in kb.iter_documents(batch_size=page_size):
+        page.append(json.dumps(doc.to_dict(), ensure_ascii=False, default=str) + "\n")
+        if len(page) == page_size:
+            yield "".join(page).encode("utf-8")
+            page = []
+    if page:
+        yield "".join(page).encode("utf-8")
+
+
+def document_matches(
+    doc: Document,
+    metadata_filter: Optional[Dict[str, Any]],
+    content_filter: Optional[str]
+) -> bool:
+    """Whether a document has all the metadata values and contains the text, ignoring case."""
+    if metadata_filter:
+        for key, value in metadata_filter.items():
+            if key not in doc.metadata or doc.metadata[key] != value:
+                return False
+    if content_filter and content_filter.lower() not in doc.content.lower():
+        return False
+    return True
+
+
 @router.post("/documents", response_model=AddDocumentsResponse)
 async def add_documents(
     request: AddDocumentsRequest,
@@ -74,15 +107,19 @@ async def add_documents(
             docs_to_add.append(doc)
         
         # Add documents to knowledge base
-        kb.add_documents(docs_to_add, strict=request.strict)
+        stats = kb.add_documents(docs_to_add, strict=request.strict)
+        skipped = stats["existing"] + stats["duplicates"]
         
         # Convert to response format
         doc_responses = [document_to_response(doc) for doc in docs_to_add]
         
+        message = f"Successfully added {stats['added']} documents"
+        if skipped:
+            message += f", skipped {skipped} already present"
         return AddDocumentsResponse(
             success=True,
-            message=f"Successfully added {len(docs_to_add)} documents",
-            documents_added=len(docs_to_add),
+            message=message,
+            documents_added=stats["added"],
             documents=doc_responses
         )
         
@@ -130,6 +167,24 @@ async def list_documents(
         )
 
 
+@router.get("/documents/export")
+async def export_documents(
+    kb: ChromaKnowledgeBase = knowledge_dep,
+    _auth=auth_dep
+):
+    """
+    Export all documents as NDJSON, one JSON object per line.
+    
+    The collection is read and sent page by page, so the export runs in
+    bounded memory whatever the size of the knowledge base.
+    """
+    return StreamingResponse(
+        stream_documents(kb),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="documents.ndjson"'}
+    )
+
+
 @router.get("/documents/search", response_model=QueryDocumentsResponse)
 async def search_documents(
     query: Optional[str] = None,
@@ -151,7 +206,6 @@ async def search_documents(
         # Parse metadata filter if provided as JSON string
         metadata_dict = None
         if metadata_filter:
-            import json
             try:
                 metadata_dict = json.loads(metadata_filter)
             except json.JSONDecodeError:
@@ -162,28 +216,15 @@ async def search_documents(
         
         # If no query provided, return all documents (like listing)
         if query is None or query.strip() == "":
-            documents = kb.get_all_documents(offset=0, limit=top_k)
-            
-            # Apply filters if provided
             if metadata_dict or content_filter:
-                filtered_docs = []
-                for doc in documents:
-                    # Check metadata filter
-                    if metadata_dict:
-                        match = True
-                        for key, value in metadata_dict.items():
-                            if key not in doc.metadata or doc.metadata[key] != value:
-                                match = False
-                                break
-                        if not match:
-                            continue
-                    
-                    # Check content filter
-                    if content_filter and content_filter.lower() not in doc.content.lower():
-                        continue
-                        
-                    filtered_docs.append(doc)
-                documents = filtered_docs
+                # scan page by page until top_k documents match
+                matching = (
+                    doc for doc in kb.iter_documents()
+                    if document_matches(doc, metadata_dict, content_filter)
+                )
+                documents = list(islice(matching, top_k))
+            else:
+                documents = kb.get_all_documents(offset=0, limit=top_k)
             
             # Convert to query results with 1.0 similarity score
             query_results = []
@@ -1,6 +1,9 @@
-from fastapi import APIRouter, HTTPException, status
-from typing import List, Optional, Union
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from typing import Iterator, List, Literal, Optional, Union
 from datetime import datetime
+import asyncio
+import json
 from membase.memory.message import Message
 from membase.memory.multi_memory import MultiMemory
 from models.memory import (
@@ -10,7 +13,8 @@ from models.memory import (
     AddMessageRequest,
     GetMessagesRequest,
     MessagesResponse,
-    MessageResponse
+    MessageResponse,
+    MemoryStatsResponse
 )
 from core.dependencies import memory_dep, auth_dep
 
@@ -37,6 +41,35 @@ def message_to_response(msg: Message) -> MessageResponse:
     )
 
 
+def message_to_dict(msg: Message) -> dict:
+    """Convert a Message object to a JSON-ready dict, for streamed responses."""
+    return {
+        "id": msg.id,
+        "name": msg.name,
+        "content": msg.content,
+        "role": msg.role,
+        "url": msg.url,
+        "metadata": msg.metadata,
+        "timestamp": msg.timestamp,
+    }
+
+
+# messages read per page when streaming a conversation
+STREAM_PAGE_SIZE = 256
+
+
+def stream_messages(memory: MultiMemory, conversation_id: str, offset: int, limit: Optional[int]) -> Iterator[bytes]:
+    """Yield messages as NDJSON, reading the conversation page by page."""
+    end = None if limit is None else offset + limit
+    while end is None or offset < end:
+        page_size = STREAM_PAGE_SIZE if end is None else min(STREAM_PAGE_SIZE, end - offset)
+        page = memory.get_range(conversation_id, offset=offset, limit=page_size)
+        if not page:
+            break
+        yield "".join(json.dumps(message_to_dict(msg), ensure_ascii=False) + "\n" for msg in page).encode("utf-8")
+        offset += len(page)
+
+
 @router.post("/conversations", response_model=ConversationResponse)
 async def create_conversation(
     request: ConversationCreate,
@@ -58,16 +91,15 @@ async def create_conversation(
             conversation_id = memory.default_conversation_id
         else:
             # Check if conversation already exists
-            existing_conversations = memory.get_all_conversations()
-            if conversation_id in existing_conversations:
+            if memory.has_conversation(conversation_id):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=f"Conversation {conversation_id} already exists"
                 )
             
             # Create the conversation by simply getting it
-            # get_memory() will create a new BufferedMemory instance if it doesn't exist
-            memory.get_memory(conversation_id)
+            # get_memory_async() will create a new BufferedMemory instance if it doesn't exist
+            await memory.get_memory_async(conversation_id)
         
         return ConversationResponse(
             conversation_id=conversation_id,
@@ -87,30 +119,33 @@ async def create_conversation(
 
 @router.get("/conversations", response_model=ConversationListResponse)
 async def list_conversations(
+    offset: int = Query(0, ge=0, description="Number of conversations to skip"),
+    limit: Optional[int] = Query(None, ge=1, description="Max number of conversations to return"),
+    sort: Literal["updated_at", "created_at", "message_count", "conversation_id"] = Query("updated_at", description="Sort field"),
+    order: Literal["asc", "desc"] = Query("desc", description="Sort order"),
     memory: MultiMemory = memory_dep,
     _auth=auth_dep
 ):
     """
-    List all conversations.
+    List conversations.
     
-    Returns a list of all conversation IDs with their message counts.
+    Returns a page of conversations with their message counts, first and
+    last message timestamps and last message ID. total_count is the number
+    of conversations before paging. No message is read, nor any hibernated
+    conversation loaded.
     """
     try:
-        conversation_ids = memory.get_all_conversations()
-        conversations = []
-        
-        for conv_id in conversation_ids:
-            messages = memory.get(conv_id)
-            conversations.append(
-                ConversationResponse(
-                    conversation_id=conv_id,
-                    message_count=len(messages) if messages else 0
-                )
-            )
+        total, infos = memory.list_conversation_infos(
+            offset=offset,
+            limit=limit,
+            sort_by=sort,
+            descending=order == "desc",
+        )
         
         return ConversationListResponse(
-            conversations=conversations,
-            total_count=len(conversations)
+            conversations=[ConversationResponse(**info) for info in infos],
+            total_count=total,
+            offset=offset
         )
         
     except Exception as e:
@@ -120,33 +155,82 @@ async def list_conversations(
         )
 
 
+@router.get("/stats", response_model=MemoryStatsResponse)
+async def get_memory_stats(
+    memory: MultiMemory = memory_dep,
+    _auth=auth_dep
+):
+    """
+    Get counters of the resident and hibernated conversations.
+    """
+    try:
+        return MemoryStatsResponse(**memory.memory_stats())
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error getting memory stats: {str(e)}"
+        )
+
+
 @router.get("/conversations/{conversation_id}", response_model=MessagesResponse)
 async def get_conversation_messages(
     conversation_id: str,
     recent_n: Optional[int] = None,
+    offset: Optional[int] = Query(None, ge=0, description="Index of the first message to return"),
+    limit: Optional[int] = Query(None, ge=1, description="Max number of messages to return"),
+    cursor: Optional[str] = Query(None, description="next_cursor of a previous page"),
+    response_format: Literal["json", "ndjson"] = Query("json", alias="format", description="ndjson streams one message per line"),
     memory: MultiMemory = memory_dep,
     _auth=auth_dep
 ):
     """
     Get messages from a specific conversation.
     
-    Optionally limit to the most recent N messages.
+    Optionally limit to the most recent N messages, or page through the
+    conversation with offset/limit or the cursor of the previous page.
+    With format=ndjson the messages are streamed one JSON object per line.
     """
     try:
-        messages = memory.get(conversation_id, recent_n=recent_n)
-        
-        if messages is None:
+        if cursor is not None:
+            try:
+                offset = int(cursor)
+            except ValueError:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Invalid cursor {cursor}"
+                )
+        paginated = offset is not None or limit is not None
+        if paginated and recent_n is not None:
             raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Conversation {conversation_id} not found"
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="recent_n cannot be combined with offset, limit or cursor"
             )
-        
+        offset = offset or 0
+        # load or rehydrate the conversation first, off the event loop, so size() counts its messages
+        buffered_memory = await memory.get_memory_async(conversation_id)
+        total = buffered_memory.size()
+        if recent_n is not None:
+            offset = max(0, total - recent_n)
+
+        if response_format == "ndjson":
+            return StreamingResponse(
+                stream_messages(memory, conversation_id, offset, limit),
+                media_type="application/x-ndjson"
+            )
+
+        messages = buffered_memory.get_range(offset=offset, limit=limit)
         message_responses = [message_to_response(msg) for msg in messages]
         
+        next_cursor = None
+        if limit is not None and offset + len(messages) < total:
+            next_cursor = str(offset + len(messages))
+        
         return MessagesResponse(
             conversation_id=conversation_id,
             messages=message_responses,
-            total_count=len(message_responses)
+            total_count=total,
+            offset=offset if paginated else None,
+            next_cursor=next_cursor
         )
         
     except HTTPException:
@@ -162,13 +246,15 @@ async def get_conversation_messages(
 async def add_messages(
     conversation_id: str,
     request: AddMessageRequest,
+    inserted_only: bool = Query(False, description="Return only the inserted messages instead of the whole conversation"),
     memory: MultiMemory = memory_dep,
     _auth=auth_dep
 ):
     """
     Add one or more messages to a conversation.
     
-    Creates the conversation if it doesn't exist.
+    Creates the conversation if it doesn't exist. Returns the whole
+    conversation, or only the inserted messages with inserted_only=true.
     """
     try:
         # Convert request messages to Message objects
@@ -195,16 +281,19 @@ async def add_messages(
             messages_to_add.append(msg)
         
         # Add messages to the conversation
-        memory.add(messages_to_add, conversation_id=conversation_id)
+        await memory.add_async(messages_to_add, conversation_id=conversation_id)
         
-        # Get all messages from the conversation
-        all_messages = memory.get(conversation_id)
-        message_responses = [message_to_response(msg) for msg in all_messages]
+        if inserted_only:
+            message_responses = [message_to_response(msg) for msg in messages_to_add]
+        else:
+            # Get all messages from the conversation
+            all_messages = (await memory.get_memory_async(conversation_id)).get()
+            message_responses = [message_to_response(msg) for msg in all_messages]
         
         return MessagesResponse(
             conversation_id=conversation_id,
             messages=message_responses,
-            total_count=len(message_responses)
+            total_count=memory.size(conversation_id)
         )
         
     except Exception as e:
@@ -227,14 +316,14 @@ async def clear_conversation(
     """
     try:
         # Check if conversation exists
-        if conversation_id not in memory.get_all_conversations():
+        if not memory.has_conversation(conversation_id):
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Conversation {conversation_id} not found"
             )
         
         # Clear the conversation
-        buffered_memory = memory._get_or_create_buffered_memory(conversation_id)
+        buffered_memory = await memory.get_memory_async(conversation_id)
         buffered_memory.clear()
         
         return {
@@ -266,14 +355,14 @@ async def delete_message(
     """
     try:
         # Get the specific conversation's BufferedMemory
-        buffered_memory = memory._get_or_create_buffered_memory(conversation_id)
+        buffered_memory = await memory.get_memory_async(conversation_id)
         
         # Check if index is valid
-        messages = buffered_memory.get()
-        if index < 0 or index >= len(messages):
+        message_count = buffered_memory.size()
+        if index < 0 or index >= message_count:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Invalid index {index}. Conversation has {len(messages)} messages"
+                detail=f"Invalid index {index}. Conversation has {message_count} messages"
             )
         
         # Delete the message
@@ -294,6 +383,49 @@ async def delete_message(
         )
 
 
+@router.get("/conversations/{conversation_id}/recall", response_model=MessagesResponse)
+async def recall_messages(
+    conversation_id: str,
+    query: str = Query(..., min_length=1, description="Text to match"),
+    k: int = Query(5, ge=1, le=100, description="Max number of messages to return"),
+    memory: MultiMemory = memory_dep,
+    _auth=auth_dep
+):
+    """
+    Get the messages of a conversation most relevant to a query, most relevant first.
+    
+    Requires MEMORY_RECALL_DIR to be set.
+    """
+    try:
+        if not memory.has_conversation(conversation_id):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Conversation {conversation_id} not found"
+            )
+        
+        # embedding the query is CPU bound
+        messages = await asyncio.to_thread(memory.recall, query, k, conversation_id)
+        
+        return MessagesResponse(
+            conversation_id=conversation_id,
+            messages=[message_to_response(msg) for msg in messages],
+            total_count=memory.size(conversation_id)
+        )
+        
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error recalling messages: {str(e)}"
+        )
+
+
 @router.post("/conversations/{conversation_id}/upload", status_code=status.HTTP_202_ACCEPTED)
 async def upload_conversation_to_hub(
     conversation_id: str,
@@ -308,7 +440,7 @@ async def upload_conversation_to_hub(
     """
     try:
         # Check if conversation exists
-        if conversation_id not in memory.get_all_conversations():
+        if not memory.has_conversation(conversation_id):
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Conversation {conversation_id} not found"
@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import List, Optional
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
@@ -19,8 +19,27 @@ class Settings(BaseSettings):
     api_prefix: str = os.getenv("API_PREFIX", "/api/v1")
     api_key: Optional[str] = os.getenv("API_KEY", None)
     
+    # Memory configuration
+    memory_preload_from_hub: bool = os.getenv("MEMORY_PRELOAD_FROM_HUB", "true").lower() == "true"
+    memory_lazy_load: bool = os.getenv("MEMORY_LAZY_LOAD", "false").lower() == "true"
+    memory_preload_workers: int = int(os.getenv("MEMORY_PRELOAD_WORKERS", "8"))
+    memory_storage_dir: Optional[str] = os.getenv("MEMORY_STORAGE_DIR", None)
+    memory_max_resident: Optional[int] = int(os.getenv("MEMORY_MAX_RESIDENT")) if os.getenv("MEMORY_MAX_RESIDENT") else None
+    memory_max_resident_messages: Optional[int] = int(os.getenv("MEMORY_MAX_RESIDENT_MESSAGES")) if os.getenv("MEMORY_MAX_RESIDENT_MESSAGES") else None
+    memory_idle_ttl: Optional[float] = float(os.getenv("MEMORY_IDLE_TTL")) if os.getenv("MEMORY_IDLE_TTL") else None
+    memory_hibernate_to: str = os.getenv("MEMORY_HIBERNATE_TO", "disk")
+    memory_hibernate_dir: Optional[str] = os.getenv("MEMORY_HIBERNATE_DIR", None)
+    memory_recall_dir: Optional[str] = os.getenv("MEMORY_RECALL_DIR", None)
+    memory_cold_dir: Optional[str] = os.getenv("MEMORY_COLD_DIR", None)
+    memory_compact_interval: float = float(os.getenv("MEMORY_COMPACT_INTERVAL", "300"))
+    memory_compact_keep_recent: int = int(os.getenv("MEMORY_COMPACT_KEEP_RECENT", "256"))
+    memory_compact_batch: int = int(os.getenv("MEMORY_COMPACT_BATCH", "256"))
+    memory_compact_prefixes: List[str] = [p.strip() for p in os.getenv("MEMORY_COMPACT_PREFIXES", "").split(",") if p.strip()]
+    
     # ChromaDB configuration
     chroma_persist_dir: str = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
+    chroma_embedding_cache: Optional[str] = os.getenv("CHROMA_EMBEDDING_CACHE", None)
+    chroma_embedding_workers: int = int(os.getenv("CHROMA_EMBEDDING_WORKERS", "1"))
     
     # Logging
     log_level: str = os.getenv("LOG_LEVEL", "INFO")
@@ -1,6 +1,7 @@
 from typing import Optional
 from fastapi import Depends, HTTPException, Header, status
 from membase.memory.multi_memory import MultiMemory
+from membase.memory.compaction import Compactor
 from membase.knowledge.chroma import ChromaKnowledgeBase
 try:
     from membase.chain.chain import membase_chain
@@ -13,6 +14,7 @@ from core.config import settings
 # Singleton instances
 _multi_memory: Optional[MultiMemory] = None
 _knowledge_base: Optional[ChromaKnowledgeBase] = None
+_compactor: Optional[Compactor] = None
 
 
 def get_multi_memory() -> MultiMemory:
@@ -22,11 +24,36 @@ def get_multi_memory() -> MultiMemory:
         _multi_memory = MultiMemory(
             membase_account=settings.membase_account,
             auto_upload_to_hub=True,
-            preload_from_hub=True
+            preload_from_hub=settings.memory_preload_from_hub,
+            lazy_load=settings.memory_lazy_load,
+            preload_workers=settings.memory_preload_workers,
+            storage_dir=settings.memory_storage_dir,
+            max_resident=settings.memory_max_resident,
+            max_resident_messages=settings.memory_max_resident_messages,
+            idle_ttl=settings.memory_idle_ttl,
+            hibernate_to=settings.memory_hibernate_to,
+            hibernate_dir=settings.memory_hibernate_dir,
+            recall_dir=settings.memory_recall_dir,
         )
     return _multi_memory
 
 
+def get_compactor() -> Optional[Compactor]:
+    """Get or create the Compactor singleton instance, None without
+    MEMORY_COLD_DIR and MEMORY_COMPACT_PREFIXES."""
+    global _compactor
+    if _compactor is None and settings.memory_cold_dir and settings.memory_compact_prefixes:
+        # only the conversations opted in by prefix, downsampling drops messages from reads
+        _compactor = Compactor(
+            get_multi_memory(),
+            settings.memory_cold_dir,
+            keep_recent=settings.memory_compact_keep_recent,
+            batch_size=settings.memory_compact_batch,
+            prefixes=settings.memory_compact_prefixes,
+        )
+    return _compactor
+
+
 def get_knowledge_base() -> ChromaKnowledgeBase:
     """Get or create ChromaKnowledgeBase singleton instance."""
     global _knowledge_base
@@ -34,7 +61,9 @@ def get_knowledge_base() -> ChromaKnowledgeBase:
         _knowledge_base = ChromaKnowledgeBase(
             persist_directory=settings.chroma_persist_dir,
             membase_account=settings.membase_account,
-            auto_upload_to_hub=True
+            auto_upload_to_hub=True,
+            embedding_cache=settings.chroma_embedding_cache,
+            embedding_workers=settings.chroma_embedding_workers,
         )
     return _knowledge_base
 
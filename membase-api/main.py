@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, status
 from fastapi.middleware.cors import CORSMiddleware
@@ -13,7 +14,10 @@ try:
 except ImportError:
     pass
 
+from membase.storage.hub import hub_client
+
 from core.config import settings
+from core.dependencies import get_multi_memory, get_compactor
 from api import agents, tasks, memory, knowledge, route
 
 # Configure logging
@@ -23,6 +27,30 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def evict_idle_conversations(interval: float):
+    """Hibernate idle conversations even when no request touches memory."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            evicted = await asyncio.to_thread(get_multi_memory().evict_idle)
+            if evicted:
+                logger.info(f"Hibernated {evicted} idle conversations")
+        except Exception as e:
+            logger.error(f"Error evicting idle conversations: {e}")
+
+
+async def compact_conversations(interval: float):
+    """Roll old messages into cold storage in the background."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            compacted = await asyncio.to_thread(get_compactor().compact_all)
+            if compacted:
+                logger.info(f"Compacted {sum(compacted.values())} messages of {len(compacted)} conversations")
+        except Exception as e:
+            logger.error(f"Error compacting conversations: {e}")
+
+
 # Define lifespan context manager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -38,9 +66,25 @@ async def lifespan(app: FastAPI):
     if not settings.membase_secret_key or settings.membase_secret_key == "0x0000000000000000000000000000000000000000000000000000000000000000":
         logger.warning("MEMBASE_SECRET_KEY not configured or using default value")
     
+    eviction_task = None
+    if settings.memory_idle_ttl:
+        eviction_task = asyncio.create_task(evict_idle_conversations(max(1.0, settings.memory_idle_ttl / 2)))
+    
+    compaction_task = None
+    if settings.memory_cold_dir and not settings.memory_compact_prefixes:
+        logger.warning("MEMORY_COLD_DIR is set without MEMORY_COMPACT_PREFIXES, no conversation is compacted")
+    if get_compactor() is not None:
+        compaction_task = asyncio.create_task(compact_conversations(max(1.0, settings.memory_compact_interval)))
+    
     yield
     
     # Shutdown
+    if eviction_task is not None:
+        eviction_task.cancel()
+    if compaction_task is not None:
+        compaction_task.cancel()
+        if get_compactor() is not None:
+            get_compactor().close()
     logger.info(f"Shutting down {settings.app_name}")
 
 # Create FastAPI app
@@ -70,7 +114,9 @@ async def health_check():
     return {
         "status": "healthy",
         "app": settings.app_name,
-        "version": settings.app_version
+        "version": settings.app_version,
+        # "open" while hub requests fail fast and reads are served from cache
+        "hub": hub_client.breaker.state,
     }
 
 # Root endpoint
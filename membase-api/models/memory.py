@@ -44,14 +44,16 @@ class ConversationCreate(BaseModel):
 
 class ConversationResponse(BaseModel):
     conversation_id: str
-    message_count: int
-    created_at: Optional[datetime] = None
-    updated_at: Optional[datetime] = None
+    message_count: Optional[int] = Field(None, description="None for a hub conversation not loaded yet")
+    created_at: Optional[datetime] = Field(None, description="Timestamp of the first message")
+    updated_at: Optional[datetime] = Field(None, description="Timestamp of the last message")
+    last_message_id: Optional[str] = None
 
 
 class ConversationListResponse(BaseModel):
     conversations: List[ConversationResponse]
     total_count: int
+    offset: int = 0
 
 
 class AddMessageRequest(BaseModel):
@@ -83,7 +85,9 @@ class GetMessagesRequest(BaseModel):
 class MessagesResponse(BaseModel):
     conversation_id: str
     messages: List[MessageResponse]
-    total_count: int
+    total_count: int = Field(..., description="Number of messages in the conversation")
+    offset: Optional[int] = Field(None, description="Index of the first returned message, for paginated reads")
+    next_cursor: Optional[str] = Field(None, description="Cursor of the next page, None on the last page")
 
 
 class DeleteMessageResponse(BaseModel):
@@ -126,4 +130,13 @@ class ImportRequest(BaseModel):
 class ImportResponse(BaseModel):
     success: bool
     message: str
-    messages_imported: int
\ No newline at end of file
+    messages_imported: int
+
+
+class MemoryStatsResponse(BaseModel):
+    resident_conversations: int
+    resident_messages: int
+    hibernated_conversations: int
+    hibernated_messages: int
+    evictions: int
+    rehydrations: int
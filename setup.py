@@ -17,8 +17,21 @@ setup(
     python_requires=">=3.10",
     install_requires=[
         "chromadb>=0.6.3",
+        "httpx>=0.27.0",
         "loguru>=0.7.3",
         "requests>=2.32.3",
         "web3>=7.8.0",
     ],
+    extras_require={
+        "fast": [
+            "msgpack>=1.0",
+            "orjson>=3.9",
+        ],
+        "tokens": [
+            "tiktoken>=0.9.0",
+        ],
+        "zstd": [
+            "zstandard>=0.22",
+        ],
+    },
 ) 
\ No newline at end of file
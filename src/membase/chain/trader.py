@@ -10,13 +10,14 @@ from web3 import Web3
 from membase.chain.beeper import BeeperClient
 from membase.memory.memory import Message
 from membase.memory.multi_memory import MultiMemory
+from membase.memory.compaction import Compactor, downsample
 
 
 import logging
 logger = logging.getLogger(__name__)
 
 class TraderClient(BeeperClient):
-    def __init__(self, config: dict, wallet_address: str, private_key: str, token_address: str, membase_id: Optional[str] = None):
+    def __init__(self, config: dict, wallet_address: str, private_key: str, token_address: str, membase_id: Optional[str] = None, cold_dir: Optional[str] = None):
         super().__init__(config, wallet_address, private_key)
 
         self.token_address = Web3.to_checksum_address(token_address)
@@ -51,8 +52,20 @@ class TraderClient(BeeperClient):
         self.liquidity_memory = self.memory.get_memory(self.liquidity_prefix)
         self.wallet_memory = self.memory.get_memory(self.wallet_prefix)
 
+        # monitoring snapshots grow forever, keep the recent ones and a
+        # downsampled history in RAM, the rest in cold storage
+        self.compactor = None
+        if cold_dir:
+            self.compactor = Compactor(
+                self.memory,
+                cold_dir,
+                policy=downsample(every=16),
+                keep_recent=128,
+                conversations=[self.liquidity_prefix, self.wallet_prefix],
+            )
+
         # the first one
-        first_record = self.wallet_memory.get(filter_func=lambda i, _: i == 0)
+        first_record = self.wallet_memory.query(limit=1)
         if first_record and len(first_record) > 0:
             self.init_wallet_info = json.loads(first_record[0].content)
         else:
@@ -330,6 +343,8 @@ class TraderClient(BeeperClient):
                 try:
                     self.get_wallet_info()
                     self.get_liquidity_info()
+                    if self.compactor is not None:
+                        self.compactor.compact_all()
                     time.sleep(interval)
                 except Exception as e:
                     logger.error(f"Error in monitoring: {str(e)}")
@@ -6,7 +6,8 @@ ChromaDB-based implementation of KnowledgeBase
 import hashlib
 import os
 import json
-from typing import Optional, List, Dict, Any, Union
+import time
+from typing import Optional, List, Dict, Any, Iterator, Union
 import chromadb
 from chromadb.config import Settings
 from chromadb.utils import embedding_functions
@@ -16,10 +17,23 @@ from membase.storage.hub import hub_client
 
 from .knowledge import KnowledgeBase
 from .document import Document
+from .embedding import EmbeddingCache, EmbeddingPipeline
 
 import logging
 logger = logging.getLogger(__name__)
 
+# documents checked and written per round-trip to Chroma while ingesting
+_INGEST_BATCH_SIZE = 512
+
+# a stored document closer than this to a new one makes it a duplicate in strict mode
+_DUPLICATE_DISTANCE = 0.2
+
+# seconds the cached document count is trusted before asking Chroma again
+_COUNT_TTL = 5.0
+
+# documents read per round-trip to Chroma while iterating over the collection
+_PAGE_SIZE = 512
+
 class ChromaKnowledgeBase(KnowledgeBase):
     """ChromaDB-based implementation of KnowledgeBase."""
     
@@ -30,6 +44,10 @@ class ChromaKnowledgeBase(KnowledgeBase):
         embedding_function: Optional[Any] = None,
         membase_account: str = "default",
         auto_upload_to_hub: bool = False,
+        embedding_cache: Optional[str] = None,
+        embedding_workers: int = 1,
+        embedding_batch_size: int = 64,
+        count_ttl: float = _COUNT_TTL,
         **kwargs: Any,
     ):
         """
@@ -41,6 +59,13 @@ class ChromaKnowledgeBase(KnowledgeBase):
             embedding_function: Custom embedding function to use
             membase_account: Default account name for hub upload
             auto_upload_to_hub: Whether to automatically upload documents to hub
+            embedding_cache: SQLite file memoizing embeddings by content and model,
+                so re-ingested texts and repeated queries are not embedded again
+            embedding_workers: Batches of texts embedded in parallel
+            embedding_batch_size: Texts per call of the embedding function
+            count_ttl: Seconds `count` trusts its cached value before reading
+                it from Chroma again, bounding how stale it is after writes
+                made by other processes or instances
             **kwargs: Additional arguments for ChromaDB client
         """
         self._persist_directory = persist_directory
@@ -68,6 +93,20 @@ class ChromaKnowledgeBase(KnowledgeBase):
             self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
         else:
             self.embedding_function = embedding_function
+
+        # document count, kept up to date by the methods changing the collection
+        # and read again from Chroma once count_ttl has passed since _counted_at
+        self._count: Optional[int] = None
+        self._count_ttl = count_ttl
+        self._counted_at = 0.0
+
+        # texts are embedded here and handed to Chroma as vectors
+        self._embedder = EmbeddingPipeline(
+            self.embedding_function,
+            cache=EmbeddingCache(embedding_cache) if embedding_cache else None,
+            batch_size=embedding_batch_size,
+            max_workers=embedding_workers,
+        )
             
         # Get or create collection with HNSW configuration
         self.collection = self.client.get_or_create_collection(
@@ -84,67 +123,128 @@ class ChromaKnowledgeBase(KnowledgeBase):
         self,
         documents: Union[Document, List[Document]],
         strict: bool = False,
-    ) -> None:
+        batch_size: Optional[int] = None,
+    ) -> Dict[str, Any]:
         """
         Add documents to the knowledge base.
+
+        Documents are ingested in batches: each batch is checked for
+        existing ids with one `get`, for near duplicates with one `query`
+        in strict mode, and written with one `add`. Documents whose id is
+        already in the collection, or repeated in the call, are skipped.
         
         Args:
             documents: Single document or list of documents to add
             strict: Whether to strictly check for duplicate documents
+            batch_size: Documents per batch, `_INGEST_BATCH_SIZE` if None
+
+        Returns:
+            Ingest statistics: documents received, added, skipped as
+            existing or as near duplicates, seconds spent and documents
+            added per second
         """
         if isinstance(documents, Document):
             documents = [documents]
-            
-        # Prepare data
-        ids = []
-        texts = []
-        metadatas = []
-        
+        started = time.perf_counter()
+        batch_size = min(batch_size or _INGEST_BATCH_SIZE, self.client.get_max_batch_size())
+
+        # Generate unique IDs if not provided, in one pass
+        unique = {}
         for doc in documents:
-            # Generate unique ID if not provided
             if doc.doc_id is None:
                 doc.doc_id = hashlib.sha256(doc.content.encode()).hexdigest()
-            
-            existing_doc = self.collection.get(ids=[doc.doc_id])
-            if len(existing_doc["ids"]) > 0:
-                logger.info(f"Document {doc.doc_id} already exists in the collection")
+            unique.setdefault(doc.doc_id, doc)
+        existing = len(documents) - len(unique)
+        duplicates = 0
+        added = 0
+
+        pending = list(unique.values())
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+
+            found = self._existing_ids([doc.doc_id for doc in batch])
+            if found:
+                for doc_id in found:
+                    logger.info(f"Document {doc_id} already exists in the collection")
+                existing += len(found)
+                batch = [doc for doc in batch if doc.doc_id not in found]
+
+            if not batch:
                 continue
+            embeddings = self.embed([doc.content for doc in batch])
 
             if strict:
-                is_duplicate = self.evaluate_document(doc.content)
-                if is_duplicate:
-                    logger.info(f"Document {doc.doc_id} is a duplicate content")
+                near = self._near_duplicates(embeddings)
+                for doc, is_duplicate in zip(batch, near):
+                    if is_duplicate:
+                        logger.info(f"Document {doc.doc_id} is a duplicate content")
+                duplicates += sum(near)
+                batch = [doc for doc, is_duplicate in zip(batch, near) if not is_duplicate]
+                embeddings = [e for e, is_duplicate in zip(embeddings, near) if not is_duplicate]
+                if not batch:
                     continue
 
-            # Ensure metadata is a non-empty dict
-            if not doc.metadata:
-                doc.metadata = {"source": "default"}
-            
-            # add collection name to metadata
-            doc.metadata["collection"] = self._collection_name
-            
-            ids.append(doc.doc_id)
-            texts.append(doc.content)
-            metadatas.append(doc.metadata)
-        
-        if len(ids) > 0:
+            for doc in batch:
+                # Ensure metadata is a non-empty dict
+                if not doc.metadata:
+                    doc.metadata = {"source": "default"}
+                # add collection name to metadata
+                doc.metadata["collection"] = self._collection_name
+
             # Add to ChromaDB
             self.collection.add(
-                ids=ids,
-                documents=texts,
-                metadatas=metadatas
+                ids=[doc.doc_id for doc in batch],
+                embeddings=embeddings,
+                documents=[doc.content for doc in batch],
+                metadatas=[doc.metadata for doc in batch],
             )
-    
-        # Upload to hub if requested
+            added += len(batch)
+            if self._count is not None:
+                self._count += len(batch)
+
+        # Upload to hub if requested; the upload ledger skips unchanged documents
         if self._auto_upload_to_hub:
             for doc in documents:
-                # doc as content in upload_hub
-                # doc serialized as json string in upload_hub
-                hub_client.upload_hub(
-                    owner=self._membase_account,
-                    filename=doc.doc_id,
-                    msg=json.dumps(doc.to_dict())
-                )
+                self._upload_to_hub(doc)
+
+        seconds = time.perf_counter() - started
+        stats = {
+            "received": len(documents),
+            "added": added,
+            "existing": existing,
+            "duplicates": duplicates,
+            "seconds": seconds,
+            "docs_per_second": added / seconds if seconds > 0 else 0.0,
+        }
+        logger.debug(f"Ingested into {self._collection_name}: {stats}")
+        return stats
+
+    def _upload_to_hub(self, doc: Document) -> None:
+        """Upload a document, deduplicated by the ledger on its stored fields.
+
+        The ledger digest covers the id, the content and the metadata as
+        stored in the collection, not the timestamps `to_dict` carries, so
+        submitting the same document again is skipped.
+        """
+        metadata = {**(doc.metadata or {"source": "default"}), "collection": self._collection_name}
+        # doc serialized as json string in upload_hub
+        hub_client.upload_hub(
+            owner=self._membase_account,
+            filename=doc.doc_id,
+            msg=json.dumps(doc.to_dict()),
+            dedupe_key={"doc_id": doc.doc_id, "content": doc.content, "metadata": metadata},
+        )
+
+    def _near_duplicates(self, embeddings: List[np.ndarray]) -> List[bool]:
+        """Whether each embedding is within `_DUPLICATE_DISTANCE` of a stored document, in one query."""
+        if self.collection.count() == 0:
+            return [False] * len(embeddings)
+        results = self.collection.query(query_embeddings=embeddings, n_results=1, include=["distances"])
+        return [bool(distances) and distances[0] < _DUPLICATE_DISTANCE for distances in results["distances"]]
+
+    def embed(self, texts: List[str]) -> List[np.ndarray]:
+        """Embed texts with the collection's embedding function, through the embedding cache."""
+        return self._embedder.embed(texts)
 
     def update_documents(
         self,
@@ -184,24 +284,19 @@ class ChromaKnowledgeBase(KnowledgeBase):
             metadatas.append(doc.metadata)
             
             if self._auto_upload_to_hub:
-                # doc as content in upload_hub
-                # doc serialized as json string in upload_hub
-                hub_client.upload_hub(
-                    owner=self._membase_account,
-                    filename=doc.doc_id,
-                    msg=json.dumps(doc.to_dict())
-                )
+                self._upload_to_hub(doc)
         
         try:
             # Update in ChromaDB
             self.collection.update(
                 ids=ids,
+                embeddings=self.embed(texts),
                 documents=texts,
                 metadatas=metadatas
             )
         except ValueError as e:
             # Check which IDs don't exist
-            existing_ids = set(self.collection.get()["ids"])
+            existing_ids = self._existing_ids(ids)
             non_existent_ids = [id for id in ids if id not in existing_ids]
             if non_existent_ids:
                 raise KeyError(f"Documents with IDs {non_existent_ids} do not exist in the collection")
@@ -221,6 +316,8 @@ class ChromaKnowledgeBase(KnowledgeBase):
             document_ids = [document_ids]
             
         self.collection.delete(ids=document_ids)
+        # some of the ids may not have existed, count again when asked
+        self.invalidate_stats()
     
     def exists(self, document_ids: Union[str, List[str]]) -> Union[bool, List[bool]]:
         """
@@ -236,8 +333,8 @@ class ChromaKnowledgeBase(KnowledgeBase):
         if isinstance(document_ids, str):
             document_ids = [document_ids]
             
-        # Get all existing IDs from the collection
-        existing_ids = set(self.collection.get()["ids"])
+        # Look up only the given IDs, without fetching documents or embeddings
+        existing_ids = self._existing_ids(document_ids)
         
         # Check existence for each ID
         if len(document_ids) == 1:
@@ -245,6 +342,32 @@ class ChromaKnowledgeBase(KnowledgeBase):
         else:
             return [id in existing_ids for id in document_ids]
     
+    def _existing_ids(self, document_ids: List[str]) -> set:
+        """The ids among `document_ids` present in the collection."""
+        batch_size = self.client.get_max_batch_size()
+        found = set()
+        for start in range(0, len(document_ids), batch_size):
+            chunk = document_ids[start:start + batch_size]
+            found.update(self.collection.get(ids=chunk, include=[])["ids"])
+        return found
+
+    def count(self) -> int:
+        """Number of documents in the collection.
+
+        The value is cached and kept up to date by this instance's writes.
+        Writes from other processes or instances on the same directory are
+        seen once the cache is older than `count_ttl` seconds, which bounds
+        how stale the result can be.
+        """
+        if self._count is None or time.monotonic() - self._counted_at >= self._count_ttl:
+            self._count = self.collection.count()
+            self._counted_at = time.monotonic()
+        return self._count
+
+    def invalidate_stats(self) -> None:
+        """Drop the cached count, e.g. after writing to `collection` directly."""
+        self._count = None
+
     def retrieve(
         self,
         query: str,
@@ -271,7 +394,7 @@ class ChromaKnowledgeBase(KnowledgeBase):
         """
         # Prepare query parameters
         query_params = {
-            "query_texts": [query],
+            "query_embeddings": self.embed([query]),
             "n_results": top_k,
             "include": ["documents", "metadatas", "distances"],
             **kwargs
@@ -356,41 +479,69 @@ class ChromaKnowledgeBase(KnowledgeBase):
             name=self._collection_name,
             embedding_function=self.embedding_function
         )
+        self._count = 0
     
     def get_all_documents(
         self,
         offset: int = 0,
-        limit: Optional[int] = None
+        limit: Optional[int] = None,
+        include: Optional[List[str]] = None,
     ) -> List[Document]:
         """
-        Get all documents from the knowledge base.
-        
+        Get a page of the documents of the knowledge base, in insertion order.
+
+        Only the requested page is read from Chroma.
+
         Args:
             offset: Number of documents to skip
-            limit: Maximum number of documents to return
-            
+            limit: Maximum number of documents to return, all if None
+            include: Fields read from Chroma, `["documents", "metadatas"]` if None;
+                without "documents" the content is left empty
+
         Returns:
-            List of all documents
+            List of documents
         """
-        collection_info = self.collection.get()
+        if limit is not None and limit <= 0:
+            return []
+        include = ["documents", "metadatas"] if include is None else include
+        result = self.collection.get(offset=max(0, offset), limit=limit, include=include)
+
         documents = []
-        
-        total_docs = len(collection_info["ids"])
-        if offset >= total_docs:
-            return documents
-            
-        end_idx = total_docs if limit is None else min(offset + limit, total_docs)
-        
-        for i in range(offset, end_idx):
-            doc = Document(
-                content=collection_info["documents"][i],
-                metadata=collection_info["metadatas"][i],
-                doc_id=collection_info["ids"][i]
-            )
-            documents.append(doc)
-            
+        for i, doc_id in enumerate(result["ids"]):
+            documents.append(Document(
+                content=result["documents"][i] if "documents" in include else "",
+                metadata=(result["metadatas"][i] if "metadatas" in include else None) or {},
+                doc_id=doc_id
+            ))
         return documents
 
+    def iter_documents(
+        self,
+        batch_size: Optional[int] = None,
+        include: Optional[List[str]] = None,
+    ) -> Iterator[Document]:
+        """
+        Iterate over all documents, reading them from Chroma page by page
+        so only one page is held in memory.
+
+        Documents added or deleted meanwhile may be missed or seen twice.
+
+        Args:
+            batch_size: Documents read per page, `_PAGE_SIZE` if None
+            include: Fields read from Chroma, see `get_all_documents`
+
+        Yields:
+            The documents, in insertion order
+        """
+        batch_size = batch_size or _PAGE_SIZE
+        offset = 0
+        while True:
+            page = self.get_all_documents(offset=offset, limit=batch_size, include=include)
+            yield from page
+            if len(page) < batch_size:
+                return
+            offset += len(page)
+
     def get_stats(self) -> Dict[str, Any]:
         """
         Get statistics about the knowledge base.
@@ -398,8 +549,7 @@ class ChromaKnowledgeBase(KnowledgeBase):
         Returns:
             Dictionary containing various statistics
         """
-        collection_info = self.collection.get()
-        doc_count = len(collection_info["ids"])
+        doc_count = self.count()
         return {
             "documents": doc_count,  # Field expected by API
             "chunks": doc_count,  # Same as documents for ChromaDB
@@ -481,6 +631,6 @@ class ChromaKnowledgeBase(KnowledgeBase):
 
         # check if the document is duplicate
         for doc in docs:
-            if doc.metadata["score"] < 0.2:
+            if doc.metadata["score"] < _DUPLICATE_DISTANCE:
                 return True
         return False
\ No newline at end of file
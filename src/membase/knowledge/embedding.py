@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Embedding stage of knowledge ingestion: batched, parallel and memoized
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def model_name(embedding_function: Any) -> str:
+    """
+    Cache namespace of an embedding function: its Chroma name, or class
+    name, plus a hash of its config so e.g. two OpenAI models differ.
+    """
+    try:
+        name = embedding_function.name()
+    except Exception:
+        name = f"{type(embedding_function).__module__}.{type(embedding_function).__qualname__}"
+    try:
+        config = embedding_function.get_config()
+    except Exception:
+        config = None
+    if not isinstance(config, dict) or not config:
+        return name
+    config = json.dumps(config, sort_keys=True, default=str)
+    return f"{name}:{hashlib.sha256(config.encode('utf-8')).hexdigest()[:16]}"
+
+
+class EmbeddingCache:
+    """
+    Embedding vectors stored in SQLite, keyed by model name and content
+    hash, so identical texts are embedded once across re-ingests,
+    `clear()` and restarts. Vectors are stored as float32.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path (str): SQLite file path of the cache
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, digest))"
+        )
+
+    def get_many(self, model: str, digests: Iterable[str]) -> Dict[str, np.ndarray]:
+        """The cached vectors among `digests`."""
+        digests = list(digests)
+        found = {}
+        with self._lock:
+            # stay under SQLite's limit of bound parameters
+            for start in range(0, len(digests), 500):
+                chunk = digests[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN ({','.join('?' * len(chunk))})",
+                    [model, *chunk],
+                ).fetchall()
+                for digest, vector in rows:
+                    found[digest] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, vectors: Iterable[Tuple[str, np.ndarray]]) -> None:
+        rows = [(model, digest, np.asarray(vector, dtype=np.float32).tobytes()) for digest, vector in vectors]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, digest, vector) VALUES (?, ?, ?)", rows
+            )
+            self._conn.execute("COMMIT")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class EmbeddingPipeline:
+    """
+    Embeds texts through an embedding function in batches, spread over a
+    thread or process pool, skipping the texts found in an optional
+    `EmbeddingCache` and the repeats within a call.
+    """
+
+    def __init__(
+        self,
+        embedding_function: Any,
+        cache: Optional[EmbeddingCache] = None,
+        model: Optional[str] = None,
+        batch_size: int = 64,
+        max_workers: int = 1,
+        use_processes: bool = False,
+    ) -> None:
+        """
+        Args:
+            embedding_function: Chroma-style callable mapping a list of texts to vectors
+            cache (Optional[EmbeddingCache]): Where vectors are memoized
+            model (Optional[str]): Cache namespace, derived from the function if None
+            batch_size (int): Texts per call of the embedding function
+            max_workers (int): Batches embedded in parallel
+            use_processes (bool): Use a process pool instead of threads, for
+                embedding functions holding the GIL; the function must be picklable
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.embedding_function = embedding_function
+        self.cache = cache
+        self.model = model or model_name(embedding_function)
+        self.batch_size = batch_size
+        self.max_workers = max(1, max_workers)
+        self.use_processes = use_processes
+        self.hits = 0
+        self.misses = 0
+        self._executor: Optional[concurrent.futures.Executor] = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> concurrent.futures.Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.use_processes:
+                    self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+                else:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="embedding",
+                    )
+            return self._executor
+
+    def _embed_batches(self, batches: List[List[str]]) -> List[Any]:
+        if self.max_workers == 1 or len(batches) == 1:
+            return [self.embedding_function(batch) for batch in batches]
+        return list(self._pool().map(self.embedding_function, batches))
+
+    def embed(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """
+        Vectors of the texts, in order.
+
+        Args:
+            texts (Sequence[str]): The texts to embed
+
+        Returns:
+            List[np.ndarray]: One float32 vector per text
+        """
+        digests = [_digest(text) for text in texts]
+        vectors: Dict[str, np.ndarray] = {}
+        if self.cache is not None and digests:
+            vectors = self.cache.get_many(self.model, set(digests))
+
+        missing: Dict[str, str] = {}
+        for digest, text in zip(digests, texts):
+            if digest not in vectors:
+                missing.setdefault(digest, text)
+        if missing:
+            items = list(missing.items())
+            batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+            results = self._embed_batches([[text for _, text in batch] for batch in batches])
+            fresh = {}
+            for batch, embeddings in zip(batches, results):
+                for (digest, _), embedding in zip(batch, embeddings):
+                    fresh[digest] = np.asarray(embedding, dtype=np.float32)
+            if self.cache is not None:
+                self.cache.put_many(self.model, fresh.items())
+            vectors.update(fresh)
+
+        self.hits += len(digests) - len(missing)
+        self.misses += len(missing)
+        return [vectors[digest] for digest in digests]
+
+    def close(self) -> None:
+        """Stop the worker pool and close the cache."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        if self.cache is not None:
+            self.cache.close()
@@ -17,12 +17,17 @@ class KnowledgeBase(ABC):
     def add_documents(
         self,
         documents: Union[Document, List[Document]],
-    ) -> None:
+    ) -> Dict[str, Any]:
         """
         Add documents to the knowledge base.
         
         Args:
             documents: Single document or list of documents to add
+
+        Returns:
+            Ingest statistics: documents received, added, skipped as
+            existing or as near duplicates, seconds spent and documents
+            added per second
         """
 
     @abstractmethod
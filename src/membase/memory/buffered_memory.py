@@ -3,38 +3,70 @@
 Memory module for conversation
 """
 
+import asyncio
 import json
 import logging
 import os
 import uuid
-from typing import Iterable, Sequence, Optional, Union, Callable
+from contextlib import contextmanager
+from functools import partial
+from typing import Iterator,  Any, Dict, Iterable, Sequence, Optional, Union, Callable, List, Tuple
 
 from loguru import logger
 
 from .memory import MemoryBase
-from .serialize import serialize, deserialize
+from .serialize import serialize, deserialize, get_codec, codec_for_path
 from .message import Message
+from .index import MessageIndex, TimeBound
+from .lock import RWLock
+from .recall import RecallIndex
 
 from membase.storage.hub import hub_client
+from membase.storage.async_hub import async_hub_client
 
 class BufferedMemory(MemoryBase):
     """
     In-memory memory module, not writing to hard disk
+
+    Safe to share between threads: reads run concurrently, while adds,
+    deletes and loads hold an exclusive lock, so a message and its map
+    and index entries are added atomically.
     """
 
     def __init__(
         self,
         conversation_id: Optional[str] = None,
         membase_account: str = "default",
-        auto_upload_to_hub: bool = False
+        auto_upload_to_hub: bool = False,
+        index_metadata_keys: Optional[Sequence[str]] = None,
+        recall_index: Optional[RecallIndex] = None,
     ) -> None:
         """
         Buffered memory module for conversation.
+
+        Args:
+            conversation_id (Optional[str]): The conversation ID
+            membase_account (str): The membase account name
+            auto_upload_to_hub (bool): Whether to automatically upload to hub
+            index_metadata_keys (Optional[Sequence[str]]): Metadata keys
+                that `query` can filter on
+            recall_index (Optional[RecallIndex]): Vector index the added
+                messages are embedded into, enabling `recall`
         """
         super().__init__()
 
         self._messages = []
         self._message_map = {} 
+        self._index = MessageIndex(index_metadata_keys or ())
+        self._lock = RWLock()
+        # conversation metadata, see info()
+        self._created_at: Optional[str] = None
+        self._updated_at: Optional[str] = None
+        self._last_message_id: Optional[str] = None
+        self._info_stale = False
+        # messages compacted away, see replace_range; hub indexes stay
+        # contiguous with the messages uploaded before
+        self._hub_offset = 0
 
         # conversation_id is none or empty, generate a new uuid
         if not conversation_id:
@@ -44,6 +76,10 @@ class BufferedMemory(MemoryBase):
 
         self._membase_account = membase_account
         self._auto_upload_to_hub = auto_upload_to_hub
+        self._recall_index = recall_index
+        # called with the change of size() after each write, see MultiMemory
+        self._size_observer: Optional[Callable[[int], None]] = None
+        self._size_depth = 0
     
     def add(
         self,
@@ -65,45 +101,144 @@ class BufferedMemory(MemoryBase):
             memories (`Union[Sequence[Message], Message, None]`):
                 Memories to be added.
         """
+        self._publish(self._append(memories), upload_to_hub)
+
+    def _publish(self, added: List[Tuple[str, Message]], upload_to_hub: bool = True) -> None:
+        """Index and upload messages just appended, outside the lock."""
+        self._index_recall(added)
+
+        # Upload to hub if needed
+        if self._auto_upload_to_hub and upload_to_hub:
+            for memory_id, memory_unit in added:
+                msg = serialize(memory_unit)
+                logging.debug(f"Upload memory: {self._membase_account} {memory_id}")
+                hub_client.upload_hub(
+                    self._membase_account, memory_id, msg, on_ack=partial(self._on_hub, memory_id, memory_unit)
+                )
+
+    async def add_async(
+        self,
+        memories: Union[Sequence[Message], Message, None],
+    ) -> None:
+        """
+        Awaitable variant of `add`, uploading through the async hub client
+        """
+        await self.add_with_upload_async(memories, True)
+
+    async def add_with_upload_async(
+        self,
+        memories: Union[Sequence[Message], Message, None],
+        upload_to_hub: bool = True,
+    ) -> None:
+        """
+        Awaitable variant of `add_with_upload`. The messages are added
+        right away and their uploads handed, in order, to the background
+        upload workers, so they are spooled and retried like any other
+        upload without blocking the event loop.
+        """
+        await self._publish_async(self._append(memories), upload_to_hub)
+
+    async def _publish_async(self, added: List[Tuple[str, Message]], upload_to_hub: bool = True) -> None:
+        """Awaitable variant of `_publish`."""
+        if self._recall_index is not None and added:
+            # embedding is CPU bound, keep it off the event loop
+            await asyncio.to_thread(self._index_recall, added)
+
+        if self._auto_upload_to_hub and upload_to_hub:
+            for memory_id, memory_unit in added:
+                await async_hub_client.upload_hub(
+                    self._membase_account, memory_id, serialize(memory_unit), wait=False,
+                    on_ack=partial(self._on_hub, memory_id, memory_unit),
+                )
+
+    def _on_hub(self, memory_id: str, memory_unit: Message) -> None:
+        """Called, from any thread, once a message is known to be stored on
+        hub as `memory_id`: its upload was acknowledged or it was loaded from there."""
+
+    @contextmanager
+    def _tracking_size(self) -> Iterator[None]:
+        """Report the change of size() made inside to the size observer.
+        Caller holds the write lock; nested uses report once."""
+        before = self.size() if self._size_depth == 0 else 0
+        self._size_depth += 1
+        try:
+            yield
+        finally:
+            self._size_depth -= 1
+            if self._size_depth == 0 and self._size_observer is not None:
+                delta = self.size() - before
+                if delta:
+                    self._size_observer(delta)
+
+    def _index_recall(self, added: List[Tuple[str, Message]]) -> None:
+        """Embed newly added messages into the recall index, if any."""
+        if self._recall_index is not None and added:
+            self._recall_index.add(self._conversation_id, [m for _, m in added])
+
+    def _append(
+        self,
+        memories: Union[Sequence[Message], Message, None],
+    ) -> List[Tuple[str, Message]]:
+        """
+        Validate and append messages, skipping duplicates.
+
+        Returns:
+            The (hub memory id, message) pairs that were added
+        """
         if memories is None:
-            return
+            return []
 
         if not isinstance(memories, Sequence):
             record_memories = [memories]
         else:
             record_memories = memories
 
-        # Assert the message types and check for duplicates using dict
-        for memory_unit in record_memories:
-            if not isinstance(memory_unit, Message):
-                raise ValueError(
-                    f"Cannot add {type(memory_unit)} to memory, "
-                    f"must be a Message object.",
-                )
+        added = []
+        with self._lock.write(), self._tracking_size():
+            # Assert the message types and check for duplicates using dict
+            for memory_unit in record_memories:
+                if not isinstance(memory_unit, Message):
+                    raise ValueError(
+                        f"Cannot add {type(memory_unit)} to memory, "
+                        f"must be a Message object.",
+                    )
             
-            # Skip if message already exists
-            if hasattr(memory_unit, "id") and memory_unit.id in self._message_map:
-                logging.warn("duplicate memory_unit:", memory_unit.id)
-                continue
-
-            # Add metadata
-            if isinstance(memory_unit.metadata, dict):
-                memory_unit.metadata["conversation"] = self._conversation_id
-            elif isinstance(memory_unit.metadata, str):
-                memory_unit.metadata = {'metadata': memory_unit.metadata, 'conversation': self._conversation_id}
-            else:
-                memory_unit.metadata = {'conversation': self._conversation_id}
+                # Skip if message already exists
+                if hasattr(memory_unit, "id") and self._contains(memory_unit.id):
+                    logging.warning(f"duplicate memory_unit: {memory_unit.id}")
+                    continue
+
+                # Add metadata
+                if isinstance(memory_unit.metadata, dict):
+                    memory_unit.metadata["conversation"] = self._conversation_id
+                elif isinstance(memory_unit.metadata, str):
+                    memory_unit.metadata = {'metadata': memory_unit.metadata, 'conversation': self._conversation_id}
+                else:
+                    memory_unit.metadata = {'conversation': self._conversation_id}
             
-            # Add to memory and update map
-            self._messages.append(memory_unit)
-            self._message_map[memory_unit.id] = len(self._messages) - 1
-
-            # Upload to hub if needed
-            if self._auto_upload_to_hub and upload_to_hub:
-                msg = serialize(memory_unit)
-                memory_id = self._conversation_id + "_" + str(len(self._messages)-1)
-                logging.debug(f"Upload memory: {self._membase_account} {memory_id}")
-                hub_client.upload_hub(self._membase_account, memory_id, msg)
+                # Add to memory and update map
+                index = self._append_message(memory_unit)
+
+                memory_id = self._conversation_id + "_" + str(self._hub_offset + index)
+                added.append((memory_id, memory_unit))
+
+                if self._created_at is None and not self._info_stale:
+                    self._created_at = memory_unit.timestamp
+                self._updated_at = memory_unit.timestamp
+                self._last_message_id = memory_unit.id
+        return added
+
+    def _contains(self, message_id: str) -> bool:
+        """Whether a message with this id is already in memory."""
+        return message_id in self._message_map
+
+    def _append_message(self, memory_unit: Message) -> int:
+        """Store one validated message and return its index."""
+        self._messages.append(memory_unit)
+        index = len(self._messages) - 1
+        self._message_map[memory_unit.id] = index
+        self._index.add(index, memory_unit)
+        return index
 
     def delete(self, index: Union[Iterable, int]) -> None:
         """
@@ -113,41 +248,46 @@ class BufferedMemory(MemoryBase):
             index (Union[Iterable, int]):
                 indices of the memory fragments to delete
         """
-        if self.size() == 0:
-            logger.warning(
-                "The memory is empty, and the delete operation is "
-                "skipping.",
-            )
-            return
+        with self._lock.write(), self._tracking_size():
+            if self.size() == 0:
+                logger.warning(
+                    "The memory is empty, and the delete operation is "
+                    "skipping.",
+                )
+                return
 
-        if isinstance(index, int):
-            index = [index]
+            if isinstance(index, int):
+                index = [index]
 
-        if isinstance(index, list):
-            index = set(index)
+            if isinstance(index, list):
+                index = set(index)
 
-            invalid_index = [_ for _ in index if _ >= self.size() or _ < 0]
-            if len(invalid_index) > 0:
-                logger.warning(
-                    f"Skip delete operation for the invalid "
-                    f"index {invalid_index}",
-                )
+                invalid_index = [_ for _ in index if _ >= self.size() or _ < 0]
+                if len(invalid_index) > 0:
+                    logger.warning(
+                        f"Skip delete operation for the invalid "
+                        f"index {invalid_index}",
+                    )
 
-            # Update message map before deleting messages
-            new_messages = []
-            new_message_map = {}
-            for i, msg in enumerate(self._messages):
-                if i not in index:
-                    new_messages.append(msg)
-                    if hasattr(msg, "id"):
-                        new_message_map[msg.id] = len(new_messages) - 1
-
-            self._messages = new_messages
-            self._message_map = new_message_map
-        else:
-            raise NotImplementedError(
-                "index type only supports {None, int, list}",
-            )
+                # Update message map before deleting messages
+                new_messages = []
+                new_message_map = {}
+                for i, msg in enumerate(self._messages):
+                    if i not in index:
+                        new_messages.append(msg)
+                        if hasattr(msg, "id"):
+                            new_message_map[msg.id] = len(new_messages) - 1
+
+                self._messages = new_messages
+                self._message_map = new_message_map
+                self._index.clear()
+                for i, msg in enumerate(new_messages):
+                    self._index.add(i, msg)
+                self._info_stale = True
+            else:
+                raise NotImplementedError(
+                    "index type only supports {None, int, list}",
+                )
 
     def get(
         self,
@@ -164,13 +304,14 @@ class BufferedMemory(MemoryBase):
                 The function to filter memories, which take the index and
                 memory unit as input, and return a boolean value.
         """
-        # extract the recent `recent_n` entries in memories
-        if recent_n is None:
-            memories = self._messages
-        else:
-            if recent_n > self.size():
-                recent_n = self.size()
-            memories = self._messages[-recent_n:]
+        # extract the recent `recent_n` entries in memories, as a snapshot
+        with self._lock.read():
+            if recent_n is None:
+                memories = list(self._messages)
+            else:
+                if recent_n > len(self._messages):
+                    recent_n = len(self._messages)
+                memories = self._messages[-recent_n:]
 
         # filter the memories
         if filter_func is not None:
@@ -178,10 +319,193 @@ class BufferedMemory(MemoryBase):
 
         return memories
 
+    def info(self) -> Dict[str, Any]:
+        """Conversation metadata, kept up to date on every add so it costs
+        O(1) to read.
+
+        Returns:
+            Dict[str, Any]: conversation_id, message_count, created_at and
+            updated_at (timestamps of the first and last message, None
+            while empty) and last_message_id
+        """
+        if self._info_stale:
+            with self._lock.write():
+                if self._info_stale:
+                    size = self.size()
+                    first = self.get_range(0, 1) if size else []
+                    last = self.get_range(size - 1, 1) if size else []
+                    self._created_at = first[0].timestamp if first else None
+                    self._updated_at = last[0].timestamp if last else None
+                    self._last_message_id = last[0].id if last else None
+                    self._info_stale = False
+        with self._lock.read():
+            return {
+                "conversation_id": self._conversation_id,
+                "message_count": self.size(),
+                "created_at": self._created_at,
+                "updated_at": self._updated_at,
+                "last_message_id": self._last_message_id,
+            }
+
+    def get_range(self, offset: int = 0, limit: Optional[int] = None) -> list:
+        """Retrieve the memories at indexes [offset, offset + limit), in
+        O(limit), e.g. to page through a long conversation.
+
+        Args:
+            offset (`int`): Index of the first memory
+            limit (`Optional[int]`): Max number of memories, all remaining if None
+        """
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError("offset and limit must not be negative")
+        with self._lock.read():
+            end = len(self._messages) if limit is None else offset + limit
+            return self._messages[offset:end]
+
+    def query(
+        self,
+        role: Optional[str] = None,
+        name: Optional[str] = None,
+        since: TimeBound = None,
+        until: TimeBound = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        newest_first: bool = False,
+    ) -> list:
+        """Retrieve memories matching every given condition, answered
+        from the secondary indexes instead of scanning all messages.
+
+        Args:
+            role (`Optional[str]`): Message role, e.g. "assistant"
+            name (`Optional[str]`): Sender name
+            since (`Union[str, datetime, None]`):
+                Inclusive lower bound of the message timestamp
+            until (`Union[str, datetime, None]`):
+                Exclusive upper bound of the message timestamp
+            metadata (`Optional[Dict[str, Any]]`):
+                Values of metadata keys listed in `index_metadata_keys`
+            limit (`Optional[int]`): Max number of memories to return
+            newest_first (`bool`): Return the latest matches first
+
+        Returns:
+            list: The matching memories, in conversation order unless
+            `newest_first`
+        """
+        with self._lock.read():
+            positions = self._index.query(
+                role=role,
+                name=name,
+                since=since,
+                until=until,
+                metadata=metadata,
+                limit=limit,
+                newest_first=newest_first,
+            )
+            return self._messages_at(positions)
+
+    def _messages_at(self, positions: List[int]) -> list:
+        """Messages at the given indexes."""
+        return [self._messages[i] for i in positions]
+
+    def replace_range(
+        self,
+        start: int,
+        end: int,
+        messages: Sequence[Message],
+        expected_ids: Optional[Tuple[str, str]] = None,
+    ) -> bool:
+        """
+        Replace the memories at indexes [start, end) with `messages`, e.g.
+        with a summary of them. The new messages are local only: they are
+        not uploaded to hub, and the hub indexes of later messages continue
+        after the ones already uploaded.
+
+        Args:
+            start (`int`): Index of the first memory replaced
+            end (`int`): Index after the last memory replaced
+            messages (`Sequence[Message]`): The replacement memories
+            expected_ids (`Optional[Tuple[str, str]]`): Ids of the first and
+                last memory of the range; nothing is replaced if they moved
+
+        Returns:
+            bool: Whether the range was replaced
+        """
+        with self._lock.write(), self._tracking_size():
+            if not 0 <= start < end <= self.size():
+                return False
+            if expected_ids is not None:
+                first, last = self._messages_at([start, end - 1])
+                if (first.id, last.id) != tuple(expected_ids):
+                    return False
+            for memory_unit in messages:
+                if isinstance(memory_unit.metadata, dict):
+                    memory_unit.metadata["conversation"] = self._conversation_id
+                else:
+                    memory_unit.metadata = {'conversation': self._conversation_id}
+            kept = self._all_messages()
+            hub_offset = self._hub_offset
+            self._hub_offset += (end - start) - len(messages)
+            try:
+                self._rebuild(kept[:start] + list(messages) + kept[end:])
+            except Exception:
+                self._hub_offset = hub_offset
+                raise
+            self._info_stale = True
+            return True
+
+    def _rebuild(self, messages: List[Message]) -> None:
+        """Replace all messages, keeping the conversation. Caller holds the write lock."""
+        self._messages = []
+        self._message_map = {}
+        self._index.clear()
+        for memory_unit in messages:
+            self._append_message(memory_unit)
+
+    def hub_size(self) -> int:
+        """Number of messages of the conversation on hub, or that would be
+        with auto upload: the memories plus the ones compacted away."""
+        return self._hub_offset + self.size()
+
+    def _position_of(self, message_id: str) -> Optional[int]:
+        """Index of a message, None if it is not in memory."""
+        return self._message_map.get(message_id)
+
+    def recall(self, query: str, k: int = 5) -> list:
+        """Retrieve the memories most relevant to a query, by embedding
+        similarity, from anywhere in the conversation.
+
+        Args:
+            query (`str`): The text to match, e.g. the user's question
+            k (`int`): Max number of memories to return
+
+        Returns:
+            list: The matching memories, most relevant first
+
+        Raises:
+            ValueError: If the memory has no recall index
+        """
+        if self._recall_index is None:
+            raise ValueError("recall requires a memory created with a recall_index")
+        hits = self._recall_index.search(query, k=k, conversation_id=self._conversation_id)
+        with self._lock.read():
+            positions = []
+            stale = []
+            for _, message_id, _ in hits:
+                position = self._position_of(message_id)
+                if position is None:
+                    stale.append(message_id)
+                else:
+                    positions.append(position)
+            memories = self._messages_at(positions)
+        if stale:
+            # deleted since they were indexed
+            self._recall_index.delete(stale)
+        return memories
+
     def export(
         self,
         file_path: Optional[str] = None,
         to_mem: bool = False,
+        codec: Optional[str] = None,
     ) -> Optional[list]:
         """
         Export memory, depending on how the memory are stored
@@ -191,15 +515,28 @@ class BufferedMemory(MemoryBase):
                 be serialized and written to the file.
             to_mem (Optional[str]):
                 if True, just return the list of messages in memory
+            codec (Optional[str]):
+                serializer name, e.g. "json", "orjson" or "msgpack". By
+                default it follows the file extension (".msgpack"/".mpk"
+                for MessagePack), JSON otherwise.
         Notice: this method prevents file_path is None when to_mem
         is False.
         """
         if to_mem:
-            return self._messages
+            with self._lock.read():
+                return list(self._all_messages())
 
         if to_mem is False and file_path is not None:
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.write(serialize(self._messages))
+            file_codec = get_codec(codec) if codec else codec_for_path(file_path)
+            with self._lock.read():
+                messages = list(self._all_messages())
+            data = file_codec.dumps(messages)
+            if file_codec.binary:
+                with open(file_path, "wb") as f:
+                    f.write(data)
+            else:
+                with open(file_path, "w", encoding="utf-8") as f:
+                    f.write(data)
         else:
             raise NotImplementedError(
                 "file type only supports "
@@ -207,6 +544,10 @@ class BufferedMemory(MemoryBase):
             )
         return None
 
+    def _all_messages(self) -> list:
+        """All messages of the conversation, in order."""
+        return self._messages
+
     def load(
         self,
         memories: Union[str, list[Message], Message],
@@ -228,8 +569,13 @@ class BufferedMemory(MemoryBase):
         """
         if isinstance(memories, str):
             if os.path.isfile(memories):
-                with open(memories, "r", encoding="utf-8") as f:
-                    load_memories = deserialize(f.read())
+                file_codec = codec_for_path(memories)
+                if file_codec.binary:
+                    with open(memories, "rb") as f:
+                        load_memories = file_codec.loads(f.read())
+                else:
+                    with open(memories, "r", encoding="utf-8") as f:
+                        load_memories = file_codec.loads(f.read())
             else:
                 try:
                     load_memories = deserialize(memories)
@@ -265,28 +611,36 @@ class BufferedMemory(MemoryBase):
             )
 
         # overwrite the original memories after loading the new ones
-        if overwrite:
-            self.clear()
-            if len(load_memories) > 0 and 'conversation' in load_memories[0].metadata:
-                self._conversation_id = load_memories[0].metadata['conversation']
-                membase_account = os.getenv('MEMBASE_ACCOUNT')
-                if membase_account and membase_account != "":
-                    self._owner = membase_account
-                else: 
-                    self._owner = self._conversation_id 
-
-        self.add_with_upload(load_memories, False)
+        with self._lock.write():
+            if overwrite:
+                self.clear()
+                if len(load_memories) > 0 and 'conversation' in load_memories[0].metadata:
+                    self._conversation_id = load_memories[0].metadata['conversation']
+                    membase_account = os.getenv('MEMBASE_ACCOUNT')
+                    if membase_account and membase_account != "":
+                        self._owner = membase_account
+                    else: 
+                        self._owner = self._conversation_id 
+
+            self.add_with_upload(load_memories, False)
 
     def clear(self) -> None:
         """Clean memory, depending on how the memory are stored"""
-        self._messages = []
-        self._message_map = {}
-        self._conversation_id = str(uuid.uuid4())
-        membase_account = os.getenv('MEMBASE_ACCOUNT')
-        if membase_account and membase_account != "":
-            self._owner = membase_account
-        else: 
-            self._owner = self._conversation_id 
+        with self._lock.write(), self._tracking_size():
+            if self._recall_index is not None and self.size():
+                self._recall_index.delete_conversation(self._conversation_id)
+            self._messages = []
+            self._message_map = {}
+            self._index.clear()
+            self._created_at = self._updated_at = self._last_message_id = None
+            self._info_stale = False
+            self._hub_offset = 0
+            self._conversation_id = str(uuid.uuid4())
+            membase_account = os.getenv('MEMBASE_ACCOUNT')
+            if membase_account and membase_account != "":
+                self._owner = membase_account
+            else: 
+                self._owner = self._conversation_id 
 
     def size(self) -> int:
         """Returns the number of memory segments in memory."""
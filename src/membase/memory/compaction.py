@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Compaction of long conversations: old message ranges are rolled into
+summaries or downsampled, and the raw messages moved to cold storage.
+"""
+
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from .buffered_memory import BufferedMemory
+from .context import SUMMARY_TYPE
+from .message import Message
+from .multi_memory import MultiMemory
+from .persistent_memory import PersistentMemory
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+Policy = Callable[[List[Message]], List[Message]]
+"""Turns a range of raw messages into the messages replacing it."""
+
+# messages read per page while looking for the end of the compacted prefix
+_PAGE_SIZE = 64
+
+
+def _copy(message: Message) -> Message:
+    return Message.from_dict(message.to_dict())
+
+
+def downsample(every: int = 16) -> Policy:
+    """
+    Keep the first, the last and every `every`-th message of a range,
+    e.g. for periodic snapshots such as wallet or liquidity records.
+    """
+    if every < 1:
+        raise ValueError("every must be at least 1")
+
+    def policy(messages: List[Message]) -> List[Message]:
+        kept = [m for i, m in enumerate(messages) if i % every == 0]
+        if messages[-1] is not kept[-1]:
+            kept.append(messages[-1])
+        return [_copy(m) for m in kept]
+
+    policy.__name__ = "downsample"
+    return policy
+
+
+def summarize(summarize_fn: Callable[[List[Message]], str], name: str = "compactor") -> Policy:
+    """
+    Replace a range with one system message whose content is
+    `summarize_fn(messages)`, e.g. an LLM call. The summary is tagged as
+    `SUMMARY_TYPE` for the "summary" context strategy.
+    """
+
+    def policy(messages: List[Message]) -> List[Message]:
+        summary = Message(name, summarize_fn(messages), role="system", metadata={"type": SUMMARY_TYPE})
+        # it stands at the place of the range in time too
+        summary.timestamp = messages[-1].timestamp
+        return [summary]
+
+    policy.__name__ = "summarize"
+    return policy
+
+
+class Compactor:
+    """
+    Rolls the old messages of `MultiMemory` conversations into fewer
+    messages through a policy, keeping the raw ones in a cold store.
+
+    A conversation is a compacted prefix followed by raw messages. Each
+    pass compacts batches of `batch_size` raw messages while more than
+    `keep_recent` are left after them, so a pass only touches messages
+    not compacted yet. The raw batch is written to the cold store, a
+    `PersistentMemory` per conversation under `cold_dir`, before it is
+    replaced in the conversation. Both steps are idempotent and the
+    compacted prefix is recognized from the messages themselves, so an
+    interrupted pass is resumed by the next one.
+
+    The replacement messages carry `metadata["compaction"]` with the
+    policy name, the number of raw messages and their position in the cold
+    store, see `raw_messages`. They are not uploaded to hub, whose message
+    stream is append-only and keeps the raw messages.
+
+    Compaction is lossy for readers of the conversation, so `compact_all`
+    only touches the conversations it is given by id or prefix, e.g. the
+    periodic snapshot conversations of an agent, never chat histories by
+    default.
+    """
+
+    def __init__(
+        self,
+        memory: MultiMemory,
+        cold_dir: str,
+        policy: Optional[Policy] = None,
+        policy_name: Optional[str] = None,
+        keep_recent: int = 256,
+        batch_size: int = 256,
+        conversations: Optional[Iterable[str]] = None,
+        prefixes: Optional[Iterable[str]] = None,
+    ) -> None:
+        """
+        Args:
+            memory (MultiMemory): The conversations to compact
+            cold_dir (str): Directory of the cold stores
+            policy (Optional[Policy]): How a batch is compacted, `downsample()` if None
+            policy_name (Optional[str]): Recorded in the compaction metadata,
+                defaults to the policy function name
+            keep_recent (int): Number of latest messages never compacted
+            batch_size (int): Number of raw messages compacted together
+            conversations (Optional[Iterable[str]]): Conversations `compact_all` compacts
+            prefixes (Optional[Iterable[str]]): `compact_all` also compacts the
+                resident conversations whose id starts with one of these
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        if memory._storage_dir and os.path.abspath(memory._storage_dir) == os.path.abspath(cold_dir):
+            raise ValueError("cold_dir must differ from the storage_dir of the memory")
+        self._memory = memory
+        self._cold_dir = cold_dir
+        self._policy = policy or downsample()
+        self._policy_name = policy_name or getattr(self._policy, "__name__", "custom")
+        self._keep_recent = max(0, keep_recent)
+        self._batch_size = batch_size
+        self._conversations = list(conversations or ())
+        self._prefixes = tuple(prefixes or ())
+        self._cold: Dict[str, PersistentMemory] = {}
+        # end of the compacted prefix per conversation, checked before use
+        self._prefix: Dict[str, int] = {}
+        # conversations whose memory cannot rewrite its messages
+        self._unsupported: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def _cold_store(self, conversation_id: str) -> PersistentMemory:
+        with self._lock:
+            cold = self._cold.get(conversation_id)
+            if cold is None:
+                cold = PersistentMemory(
+                    conversation_id=conversation_id,
+                    membase_account=self._memory._membase_account,
+                    storage_dir=self._cold_dir,
+                    fsync=True,
+                )
+                self._cold[conversation_id] = cold
+            return cold
+
+    @staticmethod
+    def _is_compacted(message: Message) -> bool:
+        return isinstance(message.metadata, dict) and "compaction" in message.metadata
+
+    def _compacted_prefix(self, conversation_id: str, memory: BufferedMemory) -> int:
+        """Number of leading messages produced by compaction."""
+        prefix = self._prefix.get(conversation_id, 0)
+        size = memory.size()
+        if prefix > size or (prefix and not self._is_compacted(memory.get_range(prefix - 1, 1)[0])):
+            # deleted or cleared since, look again from the start
+            prefix = 0
+        while prefix < size:
+            page = memory.get_range(prefix, _PAGE_SIZE)
+            for message in page:
+                if not self._is_compacted(message):
+                    self._prefix[conversation_id] = prefix
+                    return prefix
+                prefix += 1
+        self._prefix[conversation_id] = prefix
+        return prefix
+
+    def compact(self, conversation_id: str) -> int:
+        """
+        Compact the old raw messages of a resident conversation.
+
+        Args:
+            conversation_id (str): The conversation ID
+
+        Returns:
+            int: The number of raw messages compacted
+        """
+        memory = self._memory._lookup(conversation_id)
+        if memory is None:
+            # hibernated conversations are compacted once back in RAM
+            return 0
+        if conversation_id in self._unsupported:
+            return 0
+
+        compacted = 0
+        while True:
+            start = self._compacted_prefix(conversation_id, memory)
+            if memory.size() - self._keep_recent - start < self._batch_size:
+                break
+            batch = memory.get_range(start, self._batch_size)
+
+            cold = self._cold_store(conversation_id)
+            cold.add_with_upload(batch, False)
+            cold_offset = cold._position_of(batch[0].id)
+
+            replacement = self._policy(batch)
+            for message in replacement:
+                if not isinstance(message.metadata, dict):
+                    message.metadata = {}
+                message.metadata["compaction"] = {
+                    "policy": self._policy_name,
+                    "count": len(batch),
+                    "cold_offset": cold_offset,
+                    "first_id": batch[0].id,
+                    "last_id": batch[-1].id,
+                }
+            try:
+                replaced = memory.replace_range(
+                    start,
+                    start + len(batch),
+                    replacement,
+                    expected_ids=(batch[0].id, batch[-1].id),
+                )
+            except NotImplementedError as e:
+                # not a transient failure, skip it from now on instead of failing every pass
+                logger.warning(f"Conversation {conversation_id} cannot be compacted: {e}")
+                self._unsupported.add(conversation_id)
+                break
+            if not replaced:
+                # changed underneath, the next pass starts over
+                self._prefix.pop(conversation_id, None)
+                break
+            self._prefix[conversation_id] = start + len(replacement)
+            compacted += len(batch)
+
+        if compacted:
+            logger.debug(f"compacted {compacted} messages of conversation {conversation_id}")
+        return compacted
+
+    def compact_all(self) -> Dict[str, int]:
+        """
+        Compact the configured conversations, e.g. from a periodic task:
+        the ones given by id and the resident ones matching a prefix.
+
+        Returns:
+            Dict[str, int]: The number of raw messages compacted per conversation
+        """
+        conversations = list(self._conversations)
+        if self._prefixes:
+            conversations.extend(
+                c for c in self._memory._all_memories()
+                if c.startswith(self._prefixes) and c not in self._conversations
+            )
+        result = {}
+        for conversation_id in conversations:
+            try:
+                compacted = self.compact(conversation_id)
+            except Exception as e:
+                logger.error(f"Error compacting conversation {conversation_id}: {e}")
+                continue
+            if compacted:
+                result[conversation_id] = compacted
+        return result
+
+    def raw_messages(self, conversation_id: str, message: Message) -> List[Message]:
+        """
+        The raw messages a compacted message stands for, read from the cold store.
+
+        Args:
+            conversation_id (str): The conversation ID
+            message (Message): A message produced by compaction
+
+        Returns:
+            List[Message]: The raw messages, empty for a message not produced by compaction
+        """
+        if not self._is_compacted(message):
+            return []
+        compaction = message.metadata["compaction"]
+        cold = self._cold_store(conversation_id)
+        return cold.get_range(compaction["cold_offset"], compaction["count"])
+
+    def close(self) -> None:
+        """Close the cold stores."""
+        with self._lock:
+            for cold in self._cold.values():
+                cold.close()
+            self._cold.clear()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Token-budgeted context assembly from conversation memory.
+
+`ContextBuilder` picks the messages of a memory that fit a token budget,
+through a pluggable strategy:
+
+- "recent": the latest messages, newest first until the budget is spent
+- "summary": the latest summary message, see `SUMMARY_TYPE`, followed
+  by the recent messages after it
+- "relevance": the recent messages, plus the older ones most relevant to
+  the query, which requires a memory with a recall index
+
+Token counts are exact with `tiktoken` installed and estimated from the
+text length otherwise.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+from .buffered_memory import BufferedMemory
+from .message import Message
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+SUMMARY_TYPE = "summary"
+"""`metadata["type"]` of the messages the "summary" strategy starts from."""
+
+# OpenAI chat format cost of a message besides its content
+MESSAGE_OVERHEAD = 4
+
+# messages read per page while walking back from the end of a conversation
+_PAGE_SIZE = 64
+
+# the oldest message is only truncated if this many tokens of it fit
+_MIN_TRUNCATED_TOKENS = 16
+
+
+def _text(message: Message) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    if content is None:
+        return ""
+    return json.dumps(content, ensure_ascii=False)
+
+
+class TokenCounter:
+    """
+    Counts message tokens, caching the count of each message by id so a
+    message is tokenized once however many contexts include it. Counts
+    are not refreshed if a message's content is changed in place.
+    """
+
+    def __init__(self, encoding: str = "cl100k_base", max_cached: int = 100_000) -> None:
+        """
+        Args:
+            encoding (str): tiktoken encoding name
+            max_cached (int): Max number of message counts kept, least
+                recently used ones are dropped first
+        """
+        self._encoding = tiktoken.get_encoding(encoding) if tiktoken is not None else None
+        self._max_cached = max_cached
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count_text(self, text: str) -> int:
+        """Tokens of a text."""
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        # about 4 characters per token for English text
+        return (len(text) + 3) // 4
+
+    def count(self, message: Message) -> int:
+        """Tokens of a message, including the per-message overhead."""
+        with self._lock:
+            tokens = self._cache.get(message.id)
+            if tokens is not None:
+                self._cache.move_to_end(message.id)
+                return tokens
+        tokens = self.count_text(_text(message)) + MESSAGE_OVERHEAD
+        with self._lock:
+            self._cache[message.id] = tokens
+            if len(self._cache) > self._max_cached:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def truncate(self, message: Message, max_tokens: int) -> Message:
+        """
+        A copy of the message keeping the end of its content within
+        `max_tokens`, overhead included. The message itself is unchanged.
+        """
+        budget = max(0, max_tokens - MESSAGE_OVERHEAD - 1)
+        text = _text(message)
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text, disallowed_special=())
+            text = self._encoding.decode(tokens[max(0, len(tokens) - budget):]) if budget else ""
+        else:
+            text = text[max(0, len(text) - budget * 4):] if budget else ""
+        return Message.from_dict(dict(message.to_dict(), content="…" + text))
+
+
+class ContextBuilder:
+    """
+    Selects, and truncates if needed, the messages of a memory that fit a
+    token budget, returned in conversation order.
+    """
+
+    def __init__(
+        self,
+        strategy: Union[str, Callable[..., List[Message]]] = "recent",
+        counter: Optional[TokenCounter] = None,
+        truncate: bool = True,
+    ) -> None:
+        """
+        Args:
+            strategy (Union[str, Callable]): "recent", "summary", "relevance", or a
+                callable taking (builder, memory, max_tokens, query) and returning
+                the messages in conversation order
+            counter (Optional[TokenCounter]): Token counter, shared to share its cache
+            truncate (bool): Whether the oldest selected message may be cut to fit
+                the remaining budget instead of being dropped
+        """
+        if isinstance(strategy, str):
+            if strategy not in _STRATEGIES:
+                raise ValueError(
+                    f"Unknown strategy {strategy}, available strategies are {sorted(_STRATEGIES)}"
+                )
+            strategy = _STRATEGIES[strategy]
+        self._strategy = strategy
+        self.counter = counter or TokenCounter()
+        self.truncate = truncate
+
+    def build(self, memory: BufferedMemory, max_tokens: int, query: Optional[str] = None) -> List[Message]:
+        """
+        Messages of the memory fitting in `max_tokens`.
+
+        Args:
+            memory (BufferedMemory): The conversation memory
+            max_tokens (int): Token budget of the history
+            query (Optional[str]): The query the context is for, used by "relevance"
+
+        Returns:
+            List[Message]: The selected messages, in conversation order
+        """
+        if max_tokens <= 0:
+            return []
+        return self._strategy(self, memory, max_tokens, query)
+
+    def recent(self, memory: BufferedMemory, max_tokens: int, start: int = 0) -> List[Message]:
+        """
+        The latest messages from index `start` on that fit in `max_tokens`,
+        reading the memory page by page from its end.
+        """
+        return self._recent(memory, max_tokens, start)[0]
+
+    def _recent(self, memory: BufferedMemory, max_tokens: int, start: int = 0) -> Tuple[List[Message], int]:
+        """`recent`, with the tokens the selected messages use."""
+        selected: List[Message] = []
+        used = 0
+        end = memory.size()
+        while end > start:
+            offset = max(start, end - _PAGE_SIZE)
+            page = memory.get_range(offset, end - offset)
+            for message in reversed(page):
+                tokens = self.counter.count(message)
+                if used + tokens > max_tokens:
+                    remaining = max_tokens - used
+                    if self.truncate and remaining >= _MIN_TRUNCATED_TOKENS + MESSAGE_OVERHEAD:
+                        # a truncated copy is not counted, it would cache under the original id
+                        selected.append(self.counter.truncate(message, remaining))
+                        used = max_tokens
+                    selected.reverse()
+                    return selected, used
+                selected.append(message)
+                used += tokens
+            end = offset
+        selected.reverse()
+        return selected, used
+
+
+def _recent(builder: ContextBuilder, memory: BufferedMemory, max_tokens: int, query: Optional[str]) -> List[Message]:
+    return builder.recent(memory, max_tokens)
+
+
+def _latest_summary(memory: BufferedMemory) -> Optional[Message]:
+    if "type" in memory._index.metadata_keys:
+        found = memory.query(metadata={"type": SUMMARY_TYPE}, newest_first=True, limit=1)
+        return found[0] if found else None
+    found = memory.query(role="system", newest_first=True)
+    for message in found:
+        if isinstance(message.metadata, dict) and message.metadata.get("type") == SUMMARY_TYPE:
+            return message
+    return None
+
+
+def _summary(builder: ContextBuilder, memory: BufferedMemory, max_tokens: int, query: Optional[str]) -> List[Message]:
+    summary = _latest_summary(memory)
+    if summary is None:
+        return builder.recent(memory, max_tokens)
+    position = memory._position_of(summary.id)
+    tokens = builder.counter.count(summary)
+    if position is None or tokens > max_tokens:
+        return builder.recent(memory, max_tokens)
+    return [summary] + builder.recent(memory, max_tokens - tokens, start=position + 1)
+
+
+def _relevance(
+    builder: ContextBuilder,
+    memory: BufferedMemory,
+    max_tokens: int,
+    query: Optional[str],
+    recent_share: float = 0.5,
+    k: int = 32,
+) -> List[Message]:
+    if not query or memory._recall_index is None:
+        return builder.recent(memory, max_tokens)
+    recent, used = builder._recent(memory, int(max_tokens * recent_share))
+    included = {m.id for m in recent}
+
+    recalled = []
+    for message in memory.recall(query, k=k):
+        if message.id in included:
+            continue
+        tokens = builder.counter.count(message)
+        if used + tokens > max_tokens:
+            continue
+        recalled.append(message)
+        included.add(message.id)
+        used += tokens
+    if not recalled:
+        # nothing relevant fits, spend the rest on older recent messages
+        return builder.recent(memory, max_tokens)
+    # recalled messages are older than the recent ones
+    recalled.sort(key=lambda m: memory._position_of(m.id))
+    return recalled + recent
+
+
+_STRATEGIES: Dict[str, Callable[..., List[Message]]] = {
+    "recent": _recent,
+    "summary": _summary,
+    "relevance": _relevance,
+}
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Secondary indexes over the messages of a memory, and the order of the
+conversations of a MultiMemory
+"""
+
+import datetime
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from .message import Message, _get_timestamp
+
+
+TimeBound = Union[str, datetime.datetime, None]
+
+
+def _as_timestamp(value: TimeBound) -> Optional[str]:
+    """Timestamps compare as `Message` formats them, "%Y-%m-%d %H:%M:%S"."""
+    if isinstance(value, datetime.datetime):
+        return _get_timestamp(time=value)
+    return value
+
+
+def _contains(positions: List[int], position: int) -> bool:
+    i = bisect_left(positions, position)
+    return i < len(positions) and positions[i] == position
+
+
+class MessageIndex:
+    """
+    Secondary indexes mapping role, sender name, timestamp and selected
+    metadata keys to message positions.
+
+    Position lists are kept sorted, so a lookup is a dict access or a
+    binary search, plus the size of the smallest matching list. The
+    indexed values are captured when a message is added; later in-place
+    changes to a message are not seen.
+    """
+
+    def __init__(self, metadata_keys: Iterable[str] = ()) -> None:
+        """
+        Args:
+            metadata_keys (Iterable[str]): Metadata keys to index, e.g.
+                ["type"]. Only hashable values are indexed.
+        """
+        self.metadata_keys = tuple(metadata_keys)
+        self.clear()
+
+    def clear(self) -> None:
+        self._by_role: Dict[str, List[int]] = {}
+        self._by_name: Dict[str, List[int]] = {}
+        self._by_metadata: Dict[Tuple[str, Any], List[int]] = {}
+        # timestamp per position, and (timestamp, position) sorted by timestamp
+        self._stamps: List[str] = []
+        self._sorted_stamps: List[str] = []
+        self._sorted_positions: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._stamps)
+
+    def add(self, position: int, message: Message) -> None:
+        """Index a message appended at `position`, which must be the next one."""
+        if position != len(self._stamps):
+            raise ValueError(f"Expect position {len(self._stamps)}, but get {position}")
+        self._by_role.setdefault(message.role, []).append(position)
+        self._by_name.setdefault(message.name, []).append(position)
+        if self.metadata_keys and isinstance(message.metadata, dict):
+            for key in self.metadata_keys:
+                value = message.metadata.get(key)
+                if value is None:
+                    continue
+                try:
+                    self._by_metadata.setdefault((key, value), []).append(position)
+                except TypeError:
+                    # unhashable value, not indexed
+                    pass
+
+        stamp = str(message.timestamp)
+        self._stamps.append(stamp)
+        # messages mostly arrive in time order, so this is usually an append
+        i = bisect_right(self._sorted_stamps, stamp)
+        self._sorted_stamps.insert(i, stamp)
+        self._sorted_positions.insert(i, position)
+
+    def truncate(self, position: int) -> None:
+        """Drop the entries of every position from `position` on."""
+        if position >= len(self._stamps):
+            return
+        for index in (self._by_role, self._by_name, self._by_metadata):
+            for key in list(index):
+                positions = index[key]
+                del positions[bisect_left(positions, position):]
+                if not positions:
+                    del index[key]
+        del self._stamps[position:]
+        kept = [(s, p) for s, p in zip(self._sorted_stamps, self._sorted_positions) if p < position]
+        self._sorted_stamps = [s for s, _ in kept]
+        self._sorted_positions = [p for _, p in kept]
+
+    def query(
+        self,
+        role: Optional[str] = None,
+        name: Optional[str] = None,
+        since: TimeBound = None,
+        until: TimeBound = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        newest_first: bool = False,
+    ) -> List[int]:
+        """
+        Positions of the messages matching every given condition, in
+        message order.
+
+        Args:
+            role (Optional[str]): Message role
+            name (Optional[str]): Sender name
+            since (Union[str, datetime, None]): Inclusive lower bound of the timestamp
+            until (Union[str, datetime, None]): Exclusive upper bound of the timestamp
+            metadata (Optional[Dict[str, Any]]): Values of indexed metadata keys
+            limit (Optional[int]): Max number of positions returned
+            newest_first (bool): Return the latest matches first
+        """
+        since, until = _as_timestamp(since), _as_timestamp(until)
+        lists = []
+        if role is not None:
+            lists.append(self._by_role.get(role, []))
+        if name is not None:
+            lists.append(self._by_name.get(name, []))
+        for key, value in (metadata or {}).items():
+            if key not in self.metadata_keys:
+                raise ValueError(
+                    f"Metadata key {key} is not indexed, "
+                    f"indexed keys are {list(self.metadata_keys)}",
+                )
+            lists.append(self._by_metadata.get((key, value), []))
+
+        time_range = None
+        if since is not None or until is not None:
+            lo = bisect_left(self._sorted_stamps, since) if since is not None else 0
+            hi = bisect_left(self._sorted_stamps, until) if until is not None else len(self._sorted_stamps)
+            time_range = (lo, max(lo, hi))
+
+        # walk the smallest candidate set, checking the others by lookup
+        if time_range is not None and (not lists or time_range[1] - time_range[0] < min(map(len, lists))):
+            candidates = sorted(self._sorted_positions[time_range[0]:time_range[1]])
+            check_time = False
+        elif lists:
+            lists.sort(key=len)
+            candidates = lists.pop(0)
+            check_time = time_range is not None
+        else:
+            candidates = range(len(self._stamps))
+            check_time = False
+
+        if newest_first:
+            candidates = reversed(candidates)
+
+        result = []
+        for position in candidates:
+            if limit is not None and len(result) >= limit:
+                break
+            if check_time:
+                stamp = self._stamps[position]
+                if (since is not None and stamp < since) or (until is not None and stamp >= until):
+                    continue
+            if all(_contains(other, position) for other in lists):
+                result.append(position)
+        return result
+
+
+class ConversationOrder:
+    """
+    Conversations kept sorted by each field `MultiMemory.list_conversation_infos`
+    can sort by, so a page is a slice instead of a sort of every conversation.
+
+    Per field, a sorted list of (value, conversation_id) and a sorted list
+    of the conversations without a value, which come last in either order.
+    Moving a conversation is a binary search and a list insertion per field.
+    """
+
+    FIELDS = ("updated_at", "created_at", "message_count", "conversation_id")
+
+    def __init__(self) -> None:
+        self.clear()
+
+    def clear(self) -> None:
+        # conversation -> its value per field
+        self._keys: Dict[str, Tuple[Any, ...]] = {}
+        self._present: Dict[str, List[Tuple[Any, str]]] = {field: [] for field in self.FIELDS}
+        self._missing: Dict[str, List[str]] = {field: [] for field in self.FIELDS}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def update(self, conversation_id: str, info: Optional[Dict[str, Any]]) -> None:
+        """Insert or move a conversation after its `info` changed, or remove it if None."""
+        keys = None
+        if info is not None:
+            keys = tuple(
+                conversation_id if field == "conversation_id" else info.get(field)
+                for field in self.FIELDS
+            )
+        old = self._keys.get(conversation_id)
+        if old == keys:
+            return
+        if old is not None:
+            for field, value in zip(self.FIELDS, old):
+                if value is None:
+                    entries, entry = self._missing[field], conversation_id
+                else:
+                    entries, entry = self._present[field], (value, conversation_id)
+                del entries[bisect_left(entries, entry)]
+            del self._keys[conversation_id]
+        if keys is None:
+            return
+        for field, value in zip(self.FIELDS, keys):
+            if value is None:
+                insort(self._missing[field], conversation_id)
+            else:
+                insort(self._present[field], (value, conversation_id))
+        self._keys[conversation_id] = keys
+
+    def page(
+        self,
+        sort_by: str,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        descending: bool = True,
+    ) -> List[str]:
+        """IDs of the conversations from `offset` on, at most `limit` of them, sorted by `sort_by`."""
+        present, missing = self._present[sort_by], self._missing[sort_by]
+        total = len(present) + len(missing)
+        start = max(0, offset)
+        end = total if limit is None else min(total, start + max(0, limit))
+        page = []
+        for i in range(start, end):
+            if i < len(present):
+                page.append(present[len(present) - 1 - i if descending else i][1])
+            else:
+                page.append(missing[i - len(present)])
+        return page
@@ -55,6 +55,11 @@ def _map_string_to_color_mark(
     index = hash_value % len(color_marks)
     return color_marks[index]
 
+_PLAIN_TYPES = (str, int, float, bool, type(None))
+
+_ROLES = frozenset(("system", "user", "assistant"))
+
+
 class Message:
     """The message class, which is responsible for storing
     the information of a message, including
@@ -68,6 +73,18 @@ class Message:
     - timestamp:    when the message is created
     """
 
+    __slots__ = (
+        "_id",
+        "_name",
+        "_content",
+        "_role",
+        "_url",
+        "_metadata",
+        "_timestamp",
+    )
+    """Instances carry no `__dict__`, which keeps large conversations small
+    in memory."""
+
     __serialized_attrs: set = {
         "id",
         "name",
@@ -204,7 +221,8 @@ class Message:
     @content.setter
     def content(self, value: Any) -> None:
         """Set the content of the message."""
-        if not is_serializable(value):
+        # plain strings and numbers are always serializable, skip the dump
+        if type(value) not in _PLAIN_TYPES and not is_serializable(value):
             try:
                 value = str(value)
             except Exception as e:
@@ -218,7 +236,7 @@ class Message:
     def role(self, value: Literal["system", "user", "assistant"]) -> None:
         """Set the role of the message sender. The role must be one of
         'system', 'user', 'assistant'."""
-        if value not in ["system", "user", "assistant"]:
+        if value not in _ROLES:
             raise ValueError(
                 f"Invalid role {value}. The role must be one of "
                 f"['system', 'user', 'assistant']",
@@ -318,6 +336,10 @@ class Message:
     def from_dict(cls, serialized_dict: dict) -> "Message":
         """Deserialize the dictionary to a Message object.
 
+        The dictionary is trusted to come from `to_dict`, so the content
+        is not re-checked for serializability and no new id or timestamp
+        is generated.
+
         Args:
             serialized_dict (`dict`):
                 A dictionary that must contain the keys in
@@ -327,29 +349,49 @@ class Message:
         Returns:
             `Message`: A Message object.
         """
-        assert set(
-            serialized_dict.keys(),
-        ) == cls.__serialized_attrs.union(
+        return cls.from_dicts([serialized_dict])[0]
+
+    @classmethod
+    def from_dicts(cls, serialized_dicts: List[dict]) -> List["Message"]:
+        """Deserialize a batch of dictionaries to Message objects, e.g. a
+        conversation loaded from hub.
+
+        Args:
+            serialized_dicts (`List[dict]`):
+                Dictionaries as produced by `to_dict`.
+
+        Returns:
+            `List[Message]`: The Message objects, in order.
+        """
+        expected_keys = cls.__serialized_attrs.union(
             {
                 "__module__",
                 "__name__",
             },
-        ), (
-            f"Expect keys {cls.__serialized_attrs}, but get "
-            f"{set(serialized_dict.keys())}",
         )
+        messages = []
+        for serialized_dict in serialized_dicts:
+            assert serialized_dict.keys() == expected_keys, (
+                f"Expect keys {cls.__serialized_attrs}, but get "
+                f"{set(serialized_dict.keys())}",
+            )
+            assert serialized_dict["__module__"] == cls.__module__
+            assert serialized_dict["__name__"] == cls.__name__
 
-        assert serialized_dict.pop("__module__") == cls.__module__
-        assert serialized_dict.pop("__name__") == cls.__name__
+            role = serialized_dict["role"]
+            if role not in _ROLES:
+                raise ValueError(
+                    f"Invalid role {role}. The role must be one of "
+                    f"['system', 'user', 'assistant']",
+                )
 
-        obj = cls(
-            name=serialized_dict["name"],
-            content=serialized_dict["content"],
-            role=serialized_dict["role"],
-            url=serialized_dict["url"],
-            metadata=serialized_dict["metadata"],
-            echo=False,
-        )
-        obj.id = serialized_dict["id"]
-        obj.timestamp = serialized_dict["timestamp"]
-        return obj
+            obj = cls.__new__(cls)
+            obj._id = serialized_dict["id"]
+            obj._name = serialized_dict["name"]
+            obj._content = serialized_dict["content"]
+            obj._role = role
+            obj._url = serialized_dict["url"]
+            obj._metadata = serialized_dict["metadata"]
+            obj._timestamp = serialized_dict["timestamp"]
+            messages.append(obj)
+        return messages
@@ -3,25 +3,66 @@
 MultiMemory module for managing multiple BufferedMemory instances
 """
 
+import asyncio
 import json
 import logging
-from typing import Optional, Dict, List, Union, Callable
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Iterator, Optional, Dict, List, Set, Tuple, Union, Callable
+from urllib.parse import quote
 import uuid
 from .buffered_memory import BufferedMemory
+from .context import ContextBuilder, TokenCounter
+from .index import ConversationOrder
+from .windowed_memory import WindowedMemory
+from .persistent_memory import PersistentMemory, list_conversations
 from .message import Message
+from .recall import RecallIndex
+from .serialize import msgpack
 
 from membase.storage.hub import hub_client
+from membase.storage.async_hub import async_hub_client
 
 class MultiMemory:
     """
     A class that manages multiple BufferedMemory instances, distinguished by conversation_id
+
+    Conversations are spread over `num_shards` shards, each with its own
+    lock, so threads working on different conversations rarely contend.
+    Each BufferedMemory guards its own messages, see `BufferedMemory`.
+
+    With `max_resident`, `max_resident_messages` or `idle_ttl` set, the
+    least recently used conversations are hibernated out of RAM and
+    rehydrated by `get_memory` on their next access, see `memory_stats`.
     """
     
     def __init__(self, 
                  membase_account: str = "default", 
                  auto_upload_to_hub: bool = False, 
                  default_conversation_id: Optional[str] = None,
-                 preload_from_hub: bool = False
+                 preload_from_hub: bool = False,
+                 lazy_load: bool = False,
+                 preload_workers: int = 8,
+                 preload_callback: Optional[Callable[[str, int, int], None]] = None,
+                 window_size: Optional[int] = None,
+                 spill_to: str = "disk",
+                 spill_dir: Optional[str] = None,
+                 index_metadata_keys: Optional[List[str]] = None,
+                 num_shards: int = 16,
+                 storage_dir: Optional[str] = None,
+                 max_resident: Optional[int] = None,
+                 max_resident_messages: Optional[int] = None,
+                 idle_ttl: Optional[float] = None,
+                 hibernate_to: str = "disk",
+                 hibernate_dir: Optional[str] = None,
+                 recall_dir: Optional[str] = None,
+                 recall_embedding_function: Optional[Any] = None,
                  ):
         """
         Initialize MultiMemory
@@ -31,14 +72,105 @@ class MultiMemory:
             auto_upload_to_hub (bool): Whether to automatically upload to hub
             default_conversation_id (Optional[str]): The default conversation ID. If None, generates a new UUID.
             preload_from_hub (bool): Whether to preload from hub
+            lazy_load (bool): Only list the hub conversations at startup and load
+                each one on first access, instead of preloading everything
+            preload_workers (int): Number of conversations fetched concurrently on preload
+            preload_callback (Optional[Callable[[str, int, int], None]]): Called with
+                (conversation_id, done, total) as each conversation is preloaded
+            window_size (Optional[int]): If set, each conversation is a WindowedMemory
+                keeping at most this many recent messages in RAM
+            spill_to (str): Where windowed conversations spill older messages, "disk" or "hub"
+            spill_dir (Optional[str]): Directory of the spill files, also used with spill_to="hub"
+                for the messages not yet acknowledged by the hub
+            index_metadata_keys (Optional[List[str]]): Metadata keys each conversation
+                indexes for `query`
+            num_shards (int): Number of lock stripes the conversations are spread over
+            storage_dir (Optional[str]): If set, each conversation is a PersistentMemory
+                kept in an append-only log under this directory instead of RAM, and
+                the conversations already stored there are reopened. Takes precedence
+                over window_size. Reopened conversations are not preloaded from hub
+                again, `sync_from_hub` fetches what other writers added since.
+            max_resident (Optional[int]): Max conversations kept in RAM, the least
+                recently used ones beyond it are hibernated
+            max_resident_messages (Optional[int]): Max messages kept in RAM across
+                conversations, enforced the same way
+            idle_ttl (Optional[float]): Seconds after which an unused conversation
+                is hibernated
+            hibernate_to (str): "disk" exports hibernated conversations to
+                `hibernate_dir`; "hub" drops them and reloads them from hub, which
+                requires auto_upload_to_hub. With storage_dir the log is the store.
+            hibernate_dir (Optional[str]): Directory of the hibernated conversations,
+                defaults to a `membase_hibernate` folder in the system temp directory
+            recall_dir (Optional[str]): If set, messages are embedded into a vector
+                index of the account persisted in this directory, enabling `recall`
+            recall_embedding_function (Optional[Any]): Embedding function of the
+                recall index, Chroma's default if None
         """
-        self._memories: Dict[str, BufferedMemory] = {}
+        if hibernate_to not in ("disk", "hub"):
+            raise ValueError(f"Invalid hibernate_to {hibernate_to}, must be 'disk' or 'hub'")
+        if hibernate_to == "hub" and not auto_upload_to_hub:
+            raise ValueError("hibernate_to='hub' requires auto_upload_to_hub=True")
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1")
+        self._shards: List[Dict[str, BufferedMemory]] = [{} for _ in range(num_shards)]
+        self._shard_locks = [threading.Lock() for _ in range(num_shards)]
         self._membase_account = membase_account
         self._auto_upload_to_hub = auto_upload_to_hub
         self._default_conversation_id = default_conversation_id or str(uuid.uuid4())
         self._preload_conversations = {}
-        if preload_from_hub:
-            self.load_all_from_hub()
+        # next hub index to fetch per conversation, see sync_from_hub
+        self._sync_cursors: Dict[str, int] = {}
+        self._preload_workers = preload_workers
+        self._window_size = window_size
+        self._spill_to = spill_to
+        self._spill_dir = spill_dir
+        self._index_metadata_keys = index_metadata_keys
+        self._storage_dir = storage_dir
+        self._max_resident = max_resident
+        self._max_resident_messages = max_resident_messages
+        self._idle_ttl = idle_ttl
+        self._hibernate_to = hibernate_to
+        self._hibernate_dir = hibernate_dir or os.path.join(tempfile.gettempdir(), "membase_hibernate")
+        self._evicting = bool(max_resident or max_resident_messages or idle_ttl)
+        # resident conversations, least recently used first
+        self._last_access: "OrderedDict[str, float]" = OrderedDict()
+        # hibernated conversation -> (store, path, info)
+        self._hibernated: Dict[str, Tuple[str, Optional[str], Dict[str, Any]]] = {}
+        self._evictions = 0
+        self._rehydrations = 0
+        # messages of the resident conversations, kept up to date by their size observers
+        self._resident_messages = 0
+        # hub conversations listed in lazy mode but not loaded yet
+        self._pending_conversations: Set[str] = set()
+        # guards the cursors, pending and preloaded bookkeeping
+        self._lock = threading.Lock()
+        # conversations sorted for list_conversation_infos, refreshed there for
+        # the ones changed since, which the size observers record in _reordered
+        self._order = ConversationOrder()
+        self._reordered: Set[str] = set()
+        # serializes the refreshes of _order
+        self._order_lock = threading.Lock()
+        # conversation -> [lock, users], serializing its hydration and hibernation
+        self._hydrate_locks: Dict[str, list] = {}
+        self._recall_index: Optional[RecallIndex] = None
+        # shared by build_context, so each message is tokenized once
+        self._token_counter: Optional[TokenCounter] = None
+        if recall_dir:
+            self._recall_index = RecallIndex(
+                membase_account=membase_account,
+                persist_directory=recall_dir,
+                embedding_function=recall_embedding_function,
+            )
+        if storage_dir:
+            # reopening only reads each log's index, not its messages
+            for conv_id in list_conversations(storage_dir, membase_account):
+                self._get_or_create(conv_id)
+                # the log already holds the messages loaded from hub
+                self._preload_conversations[conv_id] = True
+        if lazy_load:
+            self.list_from_hub()
+        elif preload_from_hub:
+            self.load_all_from_hub(progress_callback=preload_callback)
             
     def update_conversation_id(self, conversation_id: Optional[str] = None) -> None:
         """
@@ -52,7 +184,8 @@ class MultiMemory:
     def get_memory(self, conversation_id: Optional[str] = None) -> BufferedMemory:
         """
         Get BufferedMemory instance for the specified conversation_id.
-        Creates a new instance if it doesn't exist.
+        Creates a new instance if it doesn't exist. In lazy mode, a hub
+        conversation is loaded on its first access.
 
         Args:
             conversation_id (Optional[str]): The conversation ID. If None, uses default ID.
@@ -62,14 +195,321 @@ class MultiMemory:
         """
         if not conversation_id:
             conversation_id = self._default_conversation_id
-            
-        if conversation_id not in self._memories:
-            self._memories[conversation_id] = BufferedMemory(
-                conversation_id=conversation_id,
-                membase_account=self._membase_account,
-                auto_upload_to_hub=self._auto_upload_to_hub
-            )
-        return self._memories[conversation_id]
+
+        while True:
+            if conversation_id in self._pending_conversations or conversation_id in self._hibernated:
+                self._hydrate(conversation_id)
+            memory = self._get_or_create(conversation_id, unless_hibernated=True)
+            if memory is None:
+                # hibernated meanwhile
+                continue
+            # a hibernation in progress holds the write lock, wait for it to tell
+            with memory._lock.read():
+                if self._lookup(conversation_id) is memory:
+                    break
+        if self._evicting:
+            self._evict(keep=(conversation_id,))
+        return memory
+
+    async def get_memory_async(self, conversation_id: Optional[str] = None) -> BufferedMemory:
+        """
+        Awaitable variant of `get_memory`. Loading or rehydrating the
+        conversation, or hibernating others, runs in a worker thread,
+        off the event loop.
+
+        Args:
+            conversation_id (Optional[str]): The conversation ID. If None, uses default ID.
+
+        Returns:
+            BufferedMemory: The corresponding memory instance
+        """
+        if self._may_block(conversation_id):
+            return await asyncio.to_thread(self.get_memory, conversation_id)
+        return self.get_memory(conversation_id)
+
+    @contextmanager
+    def _resident(self, conversation_id: Optional[str] = None) -> Iterator[BufferedMemory]:
+        """The memory of a conversation, write locked and still resident.
+        One hibernated while this waited for its lock is resolved again."""
+        if not conversation_id:
+            conversation_id = self._default_conversation_id
+        while True:
+            memory = self.get_memory(conversation_id)
+            with memory._lock.write():
+                if self._lookup(conversation_id) is memory:
+                    yield memory
+                    return
+
+    def _shard(self, conversation_id: str) -> int:
+        return hash(conversation_id) % len(self._shards)
+
+    def _lookup(self, conversation_id: str) -> Optional[BufferedMemory]:
+        """The BufferedMemory of a conversation, if it exists."""
+        shard = self._shard(conversation_id)
+        with self._shard_locks[shard]:
+            return self._shards[shard].get(conversation_id)
+
+    def _all_memories(self) -> Dict[str, BufferedMemory]:
+        """A snapshot of all conversations, shard by shard."""
+        memories = {}
+        for shard, lock in zip(self._shards, self._shard_locks):
+            with lock:
+                memories.update(shard)
+        return memories
+
+    def _get_or_create(self, conversation_id: str, unless_hibernated: bool = False) -> Optional[BufferedMemory]:
+        """Get or create the BufferedMemory of a conversation, without lazy loading.
+
+        With `unless_hibernated`, None while the conversation is hibernated
+        or being rehydrated, instead of a memory missing its messages.
+        """
+        shard = self._shard(conversation_id)
+        with self._shard_locks[shard]:
+            if unless_hibernated and conversation_id in self._hibernated:
+                return None
+            memory = self._shards[shard].get(conversation_id)
+            if memory is None:
+                if self._storage_dir:
+                    memory = PersistentMemory(
+                        conversation_id=conversation_id,
+                        membase_account=self._membase_account,
+                        auto_upload_to_hub=self._auto_upload_to_hub,
+                        storage_dir=self._storage_dir,
+                        index_metadata_keys=self._index_metadata_keys,
+                        recall_index=self._recall_index,
+                    )
+                elif self._window_size:
+                    memory = WindowedMemory(
+                        conversation_id=conversation_id,
+                        membase_account=self._membase_account,
+                        auto_upload_to_hub=self._auto_upload_to_hub,
+                        window_size=self._window_size,
+                        spill_to=self._spill_to,
+                        spill_dir=self._spill_dir,
+                        index_metadata_keys=self._index_metadata_keys,
+                        recall_index=self._recall_index,
+                    )
+                else:
+                    memory = BufferedMemory(
+                        conversation_id=conversation_id,
+                        membase_account=self._membase_account,
+                        auto_upload_to_hub=self._auto_upload_to_hub,
+                        index_metadata_keys=self._index_metadata_keys,
+                        recall_index=self._recall_index,
+                    )
+                memory._size_observer = partial(self._count_resident, conversation_id)
+                with self._lock:
+                    self._resident_messages += memory.size()
+                    self._reordered.add(conversation_id)
+                self._shards[shard][conversation_id] = memory
+        if self._evicting:
+            self._touch(conversation_id)
+        return memory
+
+    def _count_resident(self, conversation_id: str, delta: int) -> None:
+        with self._lock:
+            self._resident_messages += delta
+            self._reordered.add(conversation_id)
+
+    @contextmanager
+    def _hydrate_lock(self, conversation_id: str) -> Iterator[None]:
+        """Serializes the hydration and hibernation of a conversation."""
+        with self._lock:
+            entry = self._hydrate_locks.setdefault(conversation_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._hydrate_locks[conversation_id]
+
+    def _hydrate(self, conversation_id: str) -> None:
+        """Load a lazily listed or hibernated conversation; concurrent callers
+        wait for the first one."""
+        with self._hydrate_lock(conversation_id):
+            self._hydrate_locked(conversation_id)
+
+    def _hydrate_locked(self, conversation_id: str) -> bool:
+        """`_hydrate` for callers holding the hydrate lock.
+
+        Returns:
+            bool: True if the conversation was hibernated or lazily listed
+        """
+        hibernated = self._hibernated.get(conversation_id)
+        if hibernated is not None:
+            self._rehydrate(conversation_id, *hibernated)
+            with self._lock:
+                self._hibernated.pop(conversation_id, None)
+                self._rehydrations += 1
+            return True
+        if conversation_id in self._pending_conversations:
+            self._load_locked(conversation_id)
+            self._mark_loaded(conversation_id)
+            return True
+        return False
+
+    def _touch(self, conversation_id: str) -> None:
+        with self._lock:
+            self._last_access[conversation_id] = time.monotonic()
+            self._last_access.move_to_end(conversation_id)
+
+    def _hibernate_path(self, conversation_id: str) -> str:
+        ext = ".msgpack" if msgpack is not None else ".json"
+        return os.path.join(
+            self._hibernate_dir,
+            quote(self._membase_account, safe=""),
+            quote(conversation_id, safe="") + ext,
+        )
+
+    def _evict(self, keep: Union[Set[str], tuple] = ()) -> int:
+        """Hibernate the conversations that are idle or over the budgets,
+        least recently used first, never those in `keep`.
+
+        Returns:
+            int: The number of conversations hibernated
+        """
+        victims = []
+        with self._lock:
+            excess = 0
+            if self._max_resident is not None:
+                excess = len(self._last_access) - self._max_resident
+            deadline = time.monotonic() - self._idle_ttl if self._idle_ttl is not None else None
+            # oldest first, so stop at the first one neither over budget nor idle
+            for conv_id, last_access in self._last_access.items():
+                if conv_id in keep:
+                    continue
+                if len(victims) < excess or (deadline is not None and last_access < deadline):
+                    victims.append(conv_id)
+                else:
+                    break
+            resident = self._resident_messages
+            over_budget = self._max_resident_messages is not None and resident > self._max_resident_messages
+            # only copied when some conversation has to go
+            candidates = list(self._last_access) if over_budget else []
+
+        if over_budget:
+            def size_of(conv_id):
+                memory = self._lookup(conv_id)
+                return memory.size() if memory is not None else 0
+
+            for conv_id in victims:
+                resident -= size_of(conv_id)
+            for conv_id in candidates:
+                if resident <= self._max_resident_messages:
+                    break
+                if conv_id not in keep and conv_id not in victims:
+                    size = size_of(conv_id)
+                    if size:
+                        victims.append(conv_id)
+                        resident -= size
+
+        return sum(1 for conv_id in victims if self._hibernate(conv_id))
+
+    def _hibernate(self, conversation_id: str) -> bool:
+        """Move a resident conversation out of RAM.
+
+        The conversation leaves its shard and is registered as hibernated
+        in one step, before it is stored, and under its hydrate lock, so
+        `get_memory` waits for the store to finish and then rehydrates it
+        instead of handing out the memory being stored.
+        """
+        with self._lock:
+            last_access = self._last_access.pop(conversation_id, None)
+            if last_access is None:
+                # already hibernated by another thread
+                return False
+
+        with self._hydrate_lock(conversation_id):
+            memory = self._lookup(conversation_id)
+            if memory is None:
+                return False
+            with memory._lock.write():
+                if (
+                    self._hibernate_to == "hub" and not self._storage_dir
+                    and hub_client.pending_uploads(self._membase_account, memory._conversation_id)
+                ):
+                    # the hub copy must be complete before the local one is
+                    # dropped, try again on a later pass rather than wait here
+                    with self._lock:
+                        self._last_access[conversation_id] = last_access
+                        self._last_access.move_to_end(conversation_id, last=False)
+                    return False
+
+                info = memory.info()
+                size = info["message_count"]
+                if self._storage_dir:
+                    store, path = "log", None
+                elif self._hibernate_to == "hub":
+                    store, path = "hub", None
+                else:
+                    store, path = "disk", self._hibernate_path(conversation_id)
+
+                shard = self._shard(conversation_id)
+                with self._shard_locks[shard], self._lock:
+                    if self._shards[shard].get(conversation_id) is not memory:
+                        return False
+                    del self._shards[shard][conversation_id]
+                    self._hibernated[conversation_id] = (store, path, info)
+                    self._resident_messages -= memory.size()
+                    self._evictions += 1
+                    if store == "hub":
+                        self._preload_conversations.pop(conversation_id, None)
+                memory._size_observer = None
+
+                # messages added locally were uploaded as <conversation_id>_<index>
+                self._advance_cursor(conversation_id, memory.hub_size())
+                if store == "log":
+                    memory.close()
+                elif store == "disk":
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    memory.export(file_path=path)
+        logging.debug(f"hibernated conversation {conversation_id} ({size} messages) to {store}")
+        return True
+
+    def _rehydrate(self, conversation_id: str, store: str, path: Optional[str], info: Dict[str, Any]) -> None:
+        """Bring a hibernated conversation back into RAM."""
+        if store == "hub":
+            self._load_locked(conversation_id)
+            return
+        memory = self._get_or_create(conversation_id)
+        if store == "disk":
+            memory.load(path)
+            os.remove(path)
+            # hub indexes of compacted conversations run ahead of their size
+            memory._hub_offset = max(0, self._sync_cursors.get(conversation_id, 0) - memory.size())
+        logging.debug(f"rehydrated conversation {conversation_id} from {store}")
+
+    def evict_idle(self) -> int:
+        """
+        Hibernate the conversations idle for longer than `idle_ttl` or over
+        the memory budgets, e.g. from a periodic task.
+
+        Returns:
+            int: The number of conversations hibernated
+        """
+        return self._evict()
+
+    def memory_stats(self) -> Dict[str, int]:
+        """
+        Counters of the resident and hibernated conversations.
+
+        Returns:
+            Dict[str, int]: resident_conversations, resident_messages,
+                hibernated_conversations, hibernated_messages, evictions, rehydrations
+        """
+        memories = self._all_memories()
+        with self._lock:
+            return {
+                "resident_conversations": len(memories),
+                "resident_messages": self._resident_messages,
+                "hibernated_conversations": len(self._hibernated),
+                "hibernated_messages": sum(info["message_count"] for _, _, info in self._hibernated.values()),
+                "evictions": self._evictions,
+                "rehydrations": self._rehydrations,
+            }
     
     def add(self, memories: Union[List[Message], Message, None], conversation_id: Optional[str] = None) -> None:
         """
@@ -79,8 +519,41 @@ class MultiMemory:
             memories: The memories to add
             conversation_id (Optional[str]): The conversation ID. If None, uses default ID.
         """
-        memory = self.get_memory(conversation_id)
-        memory.add(memories)
+        memory, added = self._append_resident(memories, conversation_id)
+        memory._publish(added)
+
+    async def add_async(self, memories: Union[List[Message], Message, None], conversation_id: Optional[str] = None) -> None:
+        """
+        Awaitable variant of `add`, uploading through the async hub client.
+        Loading, rehydrating or hibernating conversations on the way runs
+        in a worker thread, off the event loop.
+
+        Args:
+            memories: The memories to add
+            conversation_id (Optional[str]): The conversation ID. If None, uses default ID.
+        """
+        if self._may_block(conversation_id):
+            memory, added = await asyncio.to_thread(self._append_resident, memories, conversation_id)
+        else:
+            memory, added = self._append_resident(memories, conversation_id)
+        await memory._publish_async(added)
+
+    def _append_resident(
+        self, memories: Union[List[Message], Message, None], conversation_id: Optional[str]
+    ) -> Tuple[BufferedMemory, List[Tuple[str, Message]]]:
+        """Append to the resident memory of a conversation, see `BufferedMemory._append`."""
+        with self._resident(conversation_id) as memory:
+            return memory, memory._append(memories)
+
+    def _may_block(self, conversation_id: Optional[str]) -> bool:
+        """Whether resolving the memory of a conversation may load it from hub
+        or disk, or hibernate others, instead of a dictionary lookup."""
+        conversation_id = conversation_id or self._default_conversation_id
+        return (
+            self._evicting
+            or conversation_id in self._pending_conversations
+            or conversation_id in self._hibernated
+        )
         
     def get(self, conversation_id: Optional[str] = None, recent_n: Optional[int] = None,
             filter_func: Optional[Callable[[int, dict], bool]] = None) -> list:
@@ -97,6 +570,76 @@ class MultiMemory:
         """
         memory = self.get_memory(conversation_id)
         return memory.get(recent_n=recent_n, filter_func=filter_func)
+
+    def get_range(self, conversation_id: Optional[str] = None, offset: int = 0,
+                  limit: Optional[int] = None) -> list:
+        """
+        Get a page of memories from the specified conversation
+
+        Args:
+            conversation_id (Optional[str]): The conversation ID. If None, uses default ID.
+            offset (int): Index of the first memory
+            limit (Optional[int]): Max number of memories, all remaining if None
+
+        Returns:
+            list: List of memories
+        """
+        memory = self.get_memory(conversation_id)
+        return memory.get_range(offset=offset, limit=limit)
+
+    def query(self, conversation_id: Optional[str] = None, **conditions) -> list:
+        """
+        Query memories of the specified conversation from its indexes
+
+        Args:
+            conversation_id (Optional[str]): The conversation ID. If None, uses default ID.
+            **conditions: Conditions of `BufferedMemory.query`, e.g. role, since, limit
+
+        Returns:
+            list: List of matching memories
+        """
+        memory = self.get_memory(conversation_id)
+        return memory.query(**conditions)
+
+    def recall(self, query: str, k: int = 5, conversation_id: Optional[str] = None) -> list:
+        """
+        Recall the memories of the specified conversation most relevant to a query
+
+        Args:
+            query (str): The text to match
+            k (int): Max number of memories to return
+            conversation_id (Optional[str]): The conversation ID. If None, uses default ID.
+
+        Returns:
+            list: The matching memories, most relevant first
+        """
+        memory = self.get_memory(conversation_id)
+        return memory.recall(query, k=k)
+
+    def build_context(
+        self,
+        max_tokens: int,
+        conversation_id: Optional[str] = None,
+        strategy: str = "recent",
+        query: Optional[str] = None,
+    ) -> list:
+        """
+        Select the history of the specified conversation that fits a token budget
+
+        Args:
+            max_tokens (int): Token budget of the history
+            conversation_id (Optional[str]): The conversation ID. If None, uses default ID.
+            strategy (str): "recent", "summary" or "relevance", see `ContextBuilder`
+            query (Optional[str]): The query the context is for, used by "relevance"
+
+        Returns:
+            list: The selected memories, in conversation order
+        """
+        with self._lock:
+            if self._token_counter is None:
+                self._token_counter = TokenCounter()
+        builder = ContextBuilder(strategy, counter=self._token_counter)
+        return builder.build(self.get_memory(conversation_id), max_tokens, query=query)
         
     def delete(self, conversation_id: Optional[str] = None, index: Union[List[int], int] = None) -> None:
         """
@@ -108,9 +651,12 @@ class MultiMemory:
         """
         if conversation_id is None:
             conversation_id = self._default_conversation_id
-            
-        if conversation_id in self._memories:
-            self._memories[conversation_id].delete(index)
+
+        if conversation_id in self._hibernated:
+            self._hydrate(conversation_id)
+        memory = self._lookup(conversation_id)
+        if memory is not None:
+            memory.delete(index)
             
     def clear(self, conversation_id: Optional[str] = None) -> None:
         """
@@ -121,10 +667,33 @@ class MultiMemory:
             conversation_id (Optional[str]): The conversation ID. If None, clears all conversations.
         """
         if conversation_id is None:
-            self._memories.clear()
+            for shard, lock in zip(self._shards, self._shard_locks):
+                with lock:
+                    for memory in shard.values():
+                        memory._size_observer = None
+                    shard.clear()
+            with self._lock:
+                self._resident_messages = 0
+                self._order.clear()
+                self._reordered.clear()
+                self._sync_cursors.clear()
+                self._pending_conversations.clear()
+                self._last_access.clear()
+                hibernated, self._hibernated = self._hibernated, {}
+            for store, path, _ in hibernated.values():
+                if store == "disk" and os.path.exists(path):
+                    os.remove(path)
+            if self._recall_index is not None:
+                self._recall_index.clear()
             self._default_conversation_id = str(uuid.uuid4())
-        elif conversation_id in self._memories:
-            self._memories[conversation_id].clear()
+        else:
+            if conversation_id in self._hibernated:
+                self._hydrate(conversation_id)
+            memory = self._lookup(conversation_id)
+            if memory is not None:
+                memory.clear()
+                with self._lock:
+                    self._sync_cursors.pop(conversation_id, None)
             
     def get_all_conversations(self) -> List[str]:
         """
@@ -133,7 +702,12 @@ class MultiMemory:
         Returns:
             List[str]: List of conversation IDs
         """
-        return list(self._memories.keys())
+        memories = self._all_memories()
+        conversations = list(memories.keys())
+        with self._lock:
+            conversations.extend(c for c in self._pending_conversations if c not in memories)
+            conversations.extend(c for c in self._hibernated if c not in memories)
+        return conversations
     
     def size(self, conversation_id: Optional[str] = None) -> int:
         """
@@ -142,15 +716,109 @@ class MultiMemory:
         Args:
             conversation_id (Optional[str]): The conversation ID.
                 If None, returns total count of memories across all conversations.
+                Hibernated conversations are counted without rehydrating them.
 
         Returns:
             int: Number of memories
         """
         if conversation_id is None:
-            return sum(memory.size() for memory in self._memories.values())
-        elif conversation_id in self._memories:
-            return self._memories[conversation_id].size()
+            stats = self.memory_stats()
+            return stats["resident_messages"] + stats["hibernated_messages"]
+        memory = self._lookup(conversation_id)
+        if memory is not None:
+            return memory.size()
+        hibernated = self._hibernated.get(conversation_id)
+        if hibernated is not None:
+            return hibernated[2]["message_count"]
         return 0
+
+    def has_conversation(self, conversation_id: str) -> bool:
+        """
+        Whether the conversation exists, resident, hibernated or listed
+        from hub, without loading or creating it.
+
+        Args:
+            conversation_id (str): The conversation ID
+
+        Returns:
+            bool: True if the conversation exists
+        """
+        return (
+            self._lookup(conversation_id) is not None
+            or conversation_id in self._hibernated
+            or conversation_id in self._pending_conversations
+        )
+
+    def conversation_info(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Metadata of a conversation, without loading or creating it.
+
+        Args:
+            conversation_id (str): The conversation ID
+
+        Returns:
+            Optional[Dict[str, Any]]: conversation_id, message_count, created_at,
+                updated_at and last_message_id, see `BufferedMemory.info`. For a
+                hub conversation not loaded yet in lazy mode, only the ID is known
+                and the other fields are None. None if the conversation does not exist.
+        """
+        memory = self._lookup(conversation_id)
+        if memory is not None:
+            info = memory.info()
+            # clear() gives the memory a new id, the key stays the same
+            info["conversation_id"] = conversation_id
+            return info
+        hibernated = self._hibernated.get(conversation_id)
+        if hibernated is not None:
+            return dict(hibernated[2], conversation_id=conversation_id)
+        if conversation_id in self._pending_conversations:
+            return {
+                "conversation_id": conversation_id,
+                "message_count": None,
+                "created_at": None,
+                "updated_at": None,
+                "last_message_id": None,
+            }
+        return None
+
+    def list_conversation_infos(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        sort_by: str = "updated_at",
+        descending: bool = True,
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        A page of conversation metadata, from the counters each conversation
+        maintains, so no message is read. The conversations are kept sorted
+        as they change, so a page costs its own size plus the conversations
+        changed since the previous call, not a sort of all of them.
+
+        Args:
+            offset (int): Number of conversations to skip
+            limit (Optional[int]): Max number of conversations, all if None
+            sort_by (str): "updated_at", "created_at", "message_count" or "conversation_id".
+                Conversations without the field sort last.
+            descending (bool): Sort order
+
+        Returns:
+            Tuple[int, List[Dict[str, Any]]]: Total number of conversations and the page
+        """
+        if sort_by not in ("updated_at", "created_at", "message_count", "conversation_id"):
+            raise ValueError(f"Invalid sort_by {sort_by}")
+        with self._order_lock:
+            with self._lock:
+                reordered, self._reordered = self._reordered, set()
+            for conv_id in reordered:
+                # a change made meanwhile marks the conversation again
+                info = self.conversation_info(conv_id)
+                with self._lock:
+                    self._order.update(conv_id, info)
+            with self._lock:
+                total = len(self._order)
+                page = self._order.page(sort_by, offset, limit, descending)
+        infos = [self.conversation_info(c) for c in page]
+        return total, [info for info in infos if info is not None]
         
     @property
     def default_conversation_id(self) -> str:
@@ -165,47 +833,304 @@ class MultiMemory:
     def load_from_hub(self, conversation_id: str) -> None:
         """
         Load memories from hub for the specified conversation.
+        A hibernated conversation is rehydrated first, so the hub
+        messages land after its history.
 
         Args:
             conversation_id (str): The conversation ID to load.
         """
-        # check if the conversation has been preloaded
-        if self.is_preloaded(conversation_id):
+        # check and record the preloaded conversation in one step
+        if not self._claim_preload(conversation_id):
             return
-        # Record the preloaded conversation
-        self._preload_conversations[conversation_id] = True
-        
-        memory = self.get_memory(conversation_id)
+
         msgstrings = hub_client.get_conversation(self._membase_account, conversation_id)
+        self._append_loaded(conversation_id, msgstrings, start=0)
+        if msgstrings is not None:
+            self._advance_cursor(conversation_id, len(msgstrings))
+        self._mark_loaded(conversation_id)
+
+    async def load_from_hub_async(self, conversation_id: str) -> None:
+        """
+        Awaitable variant of `load_from_hub`, using the async hub client.
+
+        Args:
+            conversation_id (str): The conversation ID to load.
+        """
+        if not self._claim_preload(conversation_id):
+            return
+
+        msgstrings = await async_hub_client.get_conversation(self._membase_account, conversation_id)
+        await asyncio.to_thread(self._append_loaded, conversation_id, msgstrings, 0)
+        if msgstrings is not None:
+            self._advance_cursor(conversation_id, len(msgstrings))
+        self._mark_loaded(conversation_id)
+
+    def _load_locked(self, conversation_id: str) -> None:
+        """`load_from_hub` for callers holding the hydrate lock."""
+        if not self._claim_preload(conversation_id):
+            return
+
+        memory = self._get_or_create(conversation_id)
+        msgstrings = hub_client.get_conversation(self._membase_account, conversation_id)
+        self._load_messages(memory, msgstrings)
+        if msgstrings is not None:
+            self._advance_cursor(conversation_id, len(msgstrings))
+        self._mark_loaded(conversation_id)
+
+    def _append_loaded(self, conversation_id: str, msgstrings: Optional[List[str]], start: int) -> List[Message]:
+        """Append message strings fetched from hub, `start` being the hub index
+        of the first one, after rehydrating the conversation if it is hibernated.
+        Messages the rehydration brought back are not appended twice.
+
+        Returns:
+            List[Message]: The messages that were added
+        """
+        with self._hydrate_lock(conversation_id):
+            hydrated = self._hydrate_locked(conversation_id)
+            memory = self._get_or_create(conversation_id)
+            if hydrated and msgstrings:
+                msgstrings = msgstrings[max(0, memory.hub_size() - start):]
+            return self._load_messages(memory, msgstrings)
+
+    def _mark_loaded(self, conversation_id: str, preloaded: bool = False) -> None:
+        """Record a conversation as no longer waiting to be lazily loaded."""
+        with self._lock:
+            self._pending_conversations.discard(conversation_id)
+            if preloaded:
+                self._preload_conversations[conversation_id] = True
+
+    def _claim_preload(self, conversation_id: str) -> bool:
+        """Mark a conversation as preloaded; False if it already was."""
+        with self._lock:
+            if conversation_id in self._preload_conversations:
+                return False
+            self._preload_conversations[conversation_id] = True
+            return True
+
+    def _load_messages(self, memory: BufferedMemory, msgstrings: Optional[List[str]]) -> List[Message]:
+        """Parse message strings fetched from hub and add them without re-uploading.
+
+        Returns:
+            List[Message]: The messages that were added
+        """
         if msgstrings is None:
-            return 
+            return []
+        dicts = []
         for msgstring in msgstrings:
             try:
-                logging.debug("got msg:", msgstring)
+                logging.debug(f"got msg: {msgstring}")
                 json_msg = json.loads(msgstring)
                 # check json_msg is a Message dict
                 if isinstance(json_msg, dict) and "id" in json_msg and "name" in json_msg:
-                    msg = Message.from_dict(json_msg)
-                    memory.add_with_upload(msg, False)
+                    dicts.append(json_msg)
                 else:
-                    logging.debug("invalid message format:", json_msg)
+                    logging.debug(f"invalid message format: {json_msg}")
             except Exception as e:
                 logging.error(f"Error loading message: {e}")
+
+        try:
+            messages = Message.from_dicts(dicts)
+        except Exception:
+            # fall back to one by one, skipping the malformed ones
+            messages = []
+            for json_msg in dicts:
+                try:
+                    messages.append(Message.from_dict(json_msg))
+                except Exception as e:
+                    logging.error(f"Error loading message: {e}")
+
+        # loaded from hub, so appended without uploading again
+        added = memory._append(messages)
+        memory._index_recall(added)
+        for memory_id, memory_unit in added:
+            memory._on_hub(memory_id, memory_unit)
+        return [memory_unit for _, memory_unit in added]
+
+    def sync_cursor(self, conversation_id: str) -> int:
+        """
+        Get the sync high-water mark of a conversation: the hub index
+        of the next message `sync_from_hub` will fetch.
+
+        Args:
+            conversation_id (str): The conversation ID.
+
+        Returns:
+            int: The next hub index
+        """
+        cursor = self._sync_cursors.get(conversation_id, 0)
+        memory = self._lookup(conversation_id)
+        if memory is not None:
+            # messages added locally were uploaded as <conversation_id>_<index> too
+            cursor = max(cursor, memory.hub_size())
+        return cursor
+
+    def _advance_cursor(self, conversation_id: str, cursor: int) -> None:
+        with self._lock:
+            self._sync_cursors[conversation_id] = max(self._sync_cursors.get(conversation_id, 0), cursor)
+
+    def sync_from_hub(self, conversation_id: str, since: Optional[int] = None) -> List[Message]:
+        """
+        Incrementally fetch the messages of a conversation added on the hub
+        after `since`, in O(new messages).
+
+        Messages are stored on the hub as `<conversation_id>_<index>`, so
+        this downloads index `since`, `since + 1`, ... until one is missing,
+        appends them and advances the conversation's sync cursor.
+
+        Args:
+            conversation_id (str): The conversation ID to sync.
+            since (Optional[int]): Hub index to start from. If None, uses the
+                conversation's cursor, see `sync_cursor`.
+
+        Returns:
+            List[Message]: The newly appended messages
+        """
+        with self._hydrate_lock(conversation_id):
+            # a hibernated conversation is rehydrated first, so the new
+            # messages land after its history and its cursor is current
+            self._hydrate_locked(conversation_id)
+            cursor = self.sync_cursor(conversation_id) if since is None else since
+            memory = self._get_or_create(conversation_id)
+            loaded = []
+            while True:
+                content = hub_client.download_hub(self._membase_account, f"{conversation_id}_{cursor}")
+                if not content:
+                    break
+                loaded.extend(self._load_messages(memory, [content.decode("utf-8")]))
+                cursor += 1
+        self._advance_cursor(conversation_id, cursor)
+        self._mark_loaded(conversation_id, preloaded=True)
+        return loaded
+
+    async def sync_from_hub_async(self, conversation_id: str, since: Optional[int] = None) -> List[Message]:
+        """
+        Awaitable variant of `sync_from_hub`, using the async hub client.
+
+        Args:
+            conversation_id (str): The conversation ID to sync.
+            since (Optional[int]): Hub index to start from. If None, uses the
+                conversation's cursor.
+
+        Returns:
+            List[Message]: The newly appended messages
+        """
+        if conversation_id in self._pending_conversations or conversation_id in self._hibernated:
+            await asyncio.to_thread(self._hydrate, conversation_id)
+        start = self.sync_cursor(conversation_id) if since is None else since
+        cursor = start
+        msgstrings = []
+        while True:
+            content = await async_hub_client.download_hub(self._membase_account, f"{conversation_id}_{cursor}")
+            if not content:
+                break
+            msgstrings.append(content.decode("utf-8"))
+            cursor += 1
+        # hibernated again while downloading is rehydrated before appending
+        loaded = await asyncio.to_thread(self._append_loaded, conversation_id, msgstrings, start)
+        self._advance_cursor(conversation_id, cursor)
+        self._mark_loaded(conversation_id, preloaded=True)
+        return loaded
         
-        
-        
-    def load_all_from_hub(self) -> None:
+    def list_from_hub(self) -> List[str]:
+        """
+        List the hub conversations of the current account without loading
+        them. Each one is loaded on its first access through `get_memory`.
+
+        Returns:
+            List[str]: The conversation IDs found on the hub
+        """
+        conversations = hub_client.list_conversations(self._membase_account)
+        if conversations and isinstance(conversations, list):
+            logging.info("remote conversations: %s", conversations)
+            with self._lock:
+                for conv_id in conversations:
+                    if conv_id not in self._preload_conversations:
+                        self._pending_conversations.add(conv_id)
+                        self._reordered.add(conv_id)
+            return conversations
+        logging.warning("no conversations found")
+        return []
+
+    def load_all_from_hub(
+        self,
+        max_workers: Optional[int] = None,
+        progress_callback: Optional[Callable[[str, int, int], None]] = None,
+    ) -> Dict[str, Any]:
         """
         Load all memories from hub for all conversations under the current account.
+        Conversations are fetched and parsed by a bounded thread pool.
 
         Args:
-            overwrite (bool): Whether to overwrite existing memories
+            max_workers (Optional[int]): Number of concurrent fetches. Defaults
+                to the `preload_workers` given at construction.
+            progress_callback (Optional[Callable[[str, int, int], None]]): Called
+                with (conversation_id, done, total) as each conversation is loaded
+
+        Returns:
+            Dict[str, Any]: Preload metrics: conversations, messages, seconds
         """
+        start = time.monotonic()
         conversations = hub_client.list_conversations(self._membase_account)
+        if not conversations or not isinstance(conversations, list):
+            logging.warning("no conversations found")
+            return {"conversations": 0, "messages": 0, "seconds": time.monotonic() - start}
+
+        logging.info("remote conversations: %s", conversations)
+        total = len(conversations)
+        done = 0
+        # conversations still loading must not be hibernated mid-load
+        loading = set(conversations)
+        with ThreadPoolExecutor(max_workers=max_workers or self._preload_workers) as executor:
+            futures = {executor.submit(self.load_from_hub, conv_id): conv_id for conv_id in conversations}
+            for future in as_completed(futures):
+                conv_id = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error(f"Error preloading conversation {conv_id}: {e}")
+                self._mark_loaded(conv_id)
+                loading.discard(conv_id)
+                if self._evicting:
+                    self._evict(keep=loading)
+                done += 1
+                if progress_callback is not None:
+                    progress_callback(conv_id, done, total)
+
+        metrics = {
+            "conversations": total,
+            "messages": sum(self.size(conv_id) for conv_id in conversations),
+            "seconds": time.monotonic() - start,
+        }
+        logging.info(f"preloaded from hub: {metrics}")
+        return metrics
+
+    async def load_all_from_hub_async(
+        self,
+        progress_callback: Optional[Callable[[str, int, int], None]] = None,
+    ) -> None:
+        """
+        Awaitable variant of `load_all_from_hub`. Conversations are fetched
+        concurrently, bounded by the async hub client's concurrency limit.
+
+        Args:
+            progress_callback (Optional[Callable[[str, int, int], None]]): Called
+                with (conversation_id, done, total) as each conversation is loaded
+        """
+        conversations = await async_hub_client.list_conversations(self._membase_account)
         if conversations and isinstance(conversations, list):
             logging.info("remote conversations: %s", conversations)
-            for conv_id in conversations:
-                self.load_from_hub(conv_id)
+            total = len(conversations)
+            done = 0
+
+            async def load(conv_id):
+                nonlocal done
+                await self.load_from_hub_async(conv_id)
+                self._mark_loaded(conv_id)
+                done += 1
+                if progress_callback is not None:
+                    progress_callback(conv_id, done, total)
+
+            await asyncio.gather(*[load(conv_id) for conv_id in conversations])
         else:
             logging.warning("no conversations found")
             
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent memory module for conversation, backed by an append-only
+local log
+"""
+
+import os
+from typing import Callable, Iterable, List, Optional, Sequence, Union
+from urllib.parse import quote, unquote
+
+from loguru import logger
+
+from .buffered_memory import BufferedMemory
+from .message import Message
+from .recall import RecallIndex
+from .serialize import get_codec
+
+from membase.storage.log import AppendLog
+
+
+def conversation_path(storage_dir: str, membase_account: str, conversation_id: str) -> str:
+    """Log path of a conversation, without extension."""
+    return os.path.join(storage_dir, quote(membase_account, safe=""), quote(conversation_id, safe=""))
+
+
+def list_conversations(storage_dir: str, membase_account: str) -> List[str]:
+    """Conversation IDs with a log under `storage_dir` for the account."""
+    directory = os.path.join(storage_dir, quote(membase_account, safe=""))
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        unquote(name[:-len(".log")])
+        for name in os.listdir(directory)
+        if name.endswith(".log")
+    )
+
+
+class PersistentMemory(BufferedMemory):
+    """
+    Buffered memory whose messages live in an append-only log on disk
+    instead of RAM.
+
+    Each message is appended to `<storage_dir>/<account>/<conversation>.log`
+    in O(1), with its offset in a `.idx` index and its id in a `.ids`
+    file. Opening a conversation only reads the index and ids, and
+    `get(recent_n)` deserializes just the tail through mmap. Messages
+    returned by reads are fresh objects: changing them does not change
+    the log. The `query` indexes are built on the first query.
+    """
+
+    def __init__(
+        self,
+        conversation_id: Optional[str] = None,
+        membase_account: str = "default",
+        auto_upload_to_hub: bool = False,
+        storage_dir: str = "membase_data",
+        fsync: bool = False,
+        index_metadata_keys: Optional[Sequence[str]] = None,
+        recall_index: Optional[RecallIndex] = None,
+    ) -> None:
+        """
+        Persistent memory module for conversation.
+
+        Args:
+            conversation_id (Optional[str]): The conversation ID
+            membase_account (str): The membase account name
+            auto_upload_to_hub (bool): Whether to automatically upload to hub
+            storage_dir (str): Root directory of the conversation logs
+            fsync (bool): Whether to fsync the log after every append
+            index_metadata_keys (Optional[Sequence[str]]): Metadata keys
+                that `query` can filter on
+            recall_index (Optional[RecallIndex]): Vector index the added
+                messages are embedded into, enabling `recall`
+        """
+        super().__init__(
+            conversation_id=conversation_id,
+            membase_account=membase_account,
+            auto_upload_to_hub=auto_upload_to_hub,
+            index_metadata_keys=index_metadata_keys,
+            recall_index=recall_index,
+        )
+        self._messages = None
+        # records are joined into one JSON array to decode, so a text codec
+        self._codec = get_codec()
+        if self._codec.binary:
+            self._codec = get_codec("json")
+        self._log = AppendLog(
+            conversation_path(storage_dir, membase_account, self._conversation_id),
+            fsync=fsync,
+        )
+        self._ids_path = self._log.data_path[:-len(".log")] + ".ids"
+        self._ids_file = None
+        self._load_ids()
+        self._hub_path = self._log.data_path[:-len(".log")] + ".hub"
+        if os.path.exists(self._hub_path):
+            with open(self._hub_path, "r", encoding="utf-8") as f:
+                self._hub_offset = int(f.read() or 0)
+        self._index_ready = len(self._log) == 0
+        # first and last message are read on the first info()
+        self._info_stale = len(self._log) > 0
+
+    def _load_ids(self) -> None:
+        ids = []
+        if os.path.exists(self._ids_path):
+            with open(self._ids_path, "r", encoding="utf-8") as f:
+                ids = f.read().splitlines()
+        if len(ids) != len(self._log):
+            # the ids file is behind or ahead of the log after a crash, rebuild it
+            logger.warning(f"Rebuilding message ids of {self._log.data_path}")
+            ids = [m.id for m in self._decode(self._log.read_range(0, len(self._log)))]
+            with open(self._ids_path, "w", encoding="utf-8") as f:
+                f.writelines(i + "\n" for i in ids)
+        self._message_map = {message_id: i for i, message_id in enumerate(ids)}
+
+    def _decode(self, records: List[bytes]) -> List[Message]:
+        if not records:
+            return []
+        return self._codec.loads(b"[" + b",".join(records) + b"]")
+
+    def _append_message(self, memory_unit: Message) -> int:
+        index = self._log.append(self._codec.dumps(memory_unit).encode("utf-8"))
+        if self._ids_file is None:
+            self._ids_file = open(self._ids_path, "a", encoding="utf-8")
+        self._ids_file.write(memory_unit.id + "\n")
+        self._ids_file.flush()
+        self._message_map[memory_unit.id] = index
+        if self._index_ready:
+            self._index.add(index, memory_unit)
+        return index
+
+    def _ensure_index(self) -> None:
+        if self._index_ready:
+            return
+        with self._lock.write():
+            if not self._index_ready:
+                self._index.clear()
+                for i, memory_unit in enumerate(self._all_messages()):
+                    self._index.add(i, memory_unit)
+                self._index_ready = True
+
+    def size(self) -> int:
+        """Returns the number of memory segments in memory."""
+        return len(self._log)
+
+    def get(
+        self,
+        recent_n: Optional[int] = None,
+        filter_func: Optional[Callable[[int, dict], bool]] = None,
+    ) -> list:
+        """Retrieve memory, reading only the last `recent_n` messages
+        from the log.
+
+        Args:
+            recent_n (`Optional[int]`, default `None`):
+                The last number of memories to return.
+            filter_func
+                (`Callable[[int, dict], bool]`, default to `None`):
+                The function to filter memories, which take the index and
+                memory unit as input, and return a boolean value.
+        """
+        with self._lock.read():
+            total = len(self._log)
+            start = 0 if not recent_n else max(0, total - recent_n)
+            memories = self._decode(self._log.read_range(start, total))
+
+        if filter_func is not None:
+            memories = [_ for i, _ in enumerate(memories) if filter_func(i, _)]
+
+        return memories
+
+    def get_range(self, offset: int = 0, limit: Optional[int] = None) -> list:
+        """Retrieve the memories at indexes [offset, offset + limit),
+        reading only those records from the log."""
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError("offset and limit must not be negative")
+        with self._lock.read():
+            end = len(self._log) if limit is None else offset + limit
+            return self._decode(self._log.read_range(offset, end))
+
+    def query(self, *args, **kwargs) -> list:
+        self._ensure_index()
+        return super().query(*args, **kwargs)
+
+    def _messages_at(self, positions: List[int]) -> list:
+        return self._decode(self._log.read(positions))
+
+    def _all_messages(self) -> list:
+        return self._decode(self._log.read_range(0, len(self._log)))
+
+    def delete(self, index: Union[Iterable, int]) -> None:
+        """
+        Delete memory fragment by index. The log is rewritten without
+        the deleted records.
+        """
+        with self._lock.write(), self._tracking_size():
+            if len(self._log) == 0:
+                logger.warning(
+                    "The memory is empty, and the delete operation is "
+                    "skipping.",
+                )
+                return
+
+            if isinstance(index, int):
+                index = [index]
+
+            if not isinstance(index, list):
+                raise NotImplementedError(
+                    "index type only supports {None, int, list}",
+                )
+
+            index = set(index)
+            invalid_index = [_ for _ in index if _ >= len(self._log) or _ < 0]
+            if len(invalid_index) > 0:
+                logger.warning(
+                    f"Skip delete operation for the invalid "
+                    f"index {invalid_index}",
+                )
+            index -= set(invalid_index)
+            if not index:
+                return
+
+            ids = sorted(self._message_map, key=self._message_map.get)
+            kept = [i for i in range(len(self._log)) if i not in index]
+            self._log.rewrite(self._log.read(kept))
+            ids = [ids[i] for i in kept]
+            self._rewrite_ids(ids)
+            self._message_map = {message_id: i for i, message_id in enumerate(ids)}
+            self._index_ready = False
+            self._info_stale = True
+
+    def _rebuild(self, messages: List[Message]) -> None:
+        # the hub offset is saved first: a gap in hub indexes after a crash
+        # is safer than overwriting uploaded messages
+        self._save_hub_offset()
+        self._log.rewrite(self._codec.dumps(m).encode("utf-8") for m in messages)
+        ids = [m.id for m in messages]
+        self._rewrite_ids(ids)
+        self._message_map = {message_id: i for i, message_id in enumerate(ids)}
+        self._index_ready = False
+
+    def _save_hub_offset(self) -> None:
+        tmp = self._hub_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(self._hub_offset))
+        os.replace(tmp, self._hub_path)
+
+    def _rewrite_ids(self, ids: List[str]) -> None:
+        if self._ids_file is not None:
+            self._ids_file.close()
+            self._ids_file = None
+        with open(self._ids_path, "w", encoding="utf-8") as f:
+            f.writelines(i + "\n" for i in ids)
+
+    def clear(self) -> None:
+        """Clean memory, including its log.
+
+        Unlike `BufferedMemory.clear`, the conversation keeps its id, which
+        names its files on disk. New messages are uploaded after the hub
+        indexes already used, so no hub item is overwritten.
+        """
+        with self._lock.write(), self._tracking_size():
+            conversation_id, hub_size = self._conversation_id, self.hub_size()
+            super().clear()
+            self._conversation_id = conversation_id
+            # saved first, as in _rebuild
+            self._hub_offset = hub_size
+            self._save_hub_offset()
+            self._messages = None
+            self._log.truncate()
+            self._rewrite_ids([])
+            self._index_ready = True
+
+    def close(self) -> None:
+        """Close the log files; the memory stays on disk."""
+        self._log.close()
+        if self._ids_file is not None:
+            self._ids_file.close()
+            self._ids_file = None
+
+    def __del__(self) -> None:
+        if getattr(self, "_log", None) is not None:
+            self.close()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Vector index over the message contents of an account, for semantic recall
+"""
+
+import hashlib
+import json
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .message import Message
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _collection_name(membase_account: str) -> str:
+    """Chroma collection names are 3-63 characters of [a-zA-Z0-9._-],
+    starting and ending with an alphanumeric one."""
+    name = "memory_" + re.sub(r"[^a-zA-Z0-9._-]", "_", membase_account)
+    if len(name) > 63 or not name[-1].isalnum():
+        name = "memory_" + hashlib.sha256(membase_account.encode()).hexdigest()[:32]
+    return name
+
+
+def _content_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if content is None:
+        return ""
+    return json.dumps(content, ensure_ascii=False)
+
+
+class RecallIndex:
+    """
+    Embeddings of the messages of one account, kept in a Chroma collection
+    of `ChromaKnowledgeBase`, so a memory can look up the turns relevant to
+    a query instead of only the recent ones.
+
+    Each message is embedded once, keyed by its id, with its conversation
+    id as metadata so a search can be restricted to one conversation.
+    Messages with empty content are not indexed.
+    """
+
+    def __init__(
+        self,
+        membase_account: str = "default",
+        persist_directory: str = "./chroma_db",
+        embedding_function: Optional[Any] = None,
+    ) -> None:
+        """
+        Args:
+            membase_account (str): The membase account name
+            persist_directory (str): Directory of the Chroma database
+            embedding_function: Custom embedding function, Chroma's default if None
+        """
+        # chromadb is slow to import, only load it when recall is used
+        from membase.knowledge.chroma import ChromaKnowledgeBase
+
+        self._kb = ChromaKnowledgeBase(
+            persist_directory=persist_directory,
+            collection_name=_collection_name(membase_account),
+            embedding_function=embedding_function,
+            membase_account=membase_account,
+        )
+
+    def add(self, conversation_id: str, messages: Sequence[Message]) -> int:
+        """
+        Embed and index messages of a conversation, skipping the ones
+        already indexed, in one batch.
+
+        Returns:
+            int: The number of messages indexed
+        """
+        messages = {m.id: m for m in messages if _content_text(m.content)}
+        if not messages:
+            return 0
+        existing = set(self._kb.collection.get(ids=list(messages), include=[])["ids"])
+        new = [m for message_id, m in messages.items() if message_id not in existing]
+        if not new:
+            return 0
+        documents = [_content_text(m.content) for m in new]
+        self._kb.collection.add(
+            ids=[m.id for m in new],
+            embeddings=self._kb.embed(documents),
+            documents=documents,
+            metadatas=[
+                {"conversation_id": conversation_id, "role": m.role, "name": m.name}
+                for m in new
+            ],
+        )
+        self._kb.invalidate_stats()
+        return len(new)
+
+    def search(
+        self,
+        query: str,
+        k: int = 5,
+        conversation_id: Optional[str] = None,
+    ) -> List[Tuple[str, str, float]]:
+        """
+        The messages closest to the query, nearest first.
+
+        Args:
+            query (str): The query text
+            k (int): Max number of messages
+            conversation_id (Optional[str]): Only search this conversation
+
+        Returns:
+            List[Tuple[str, str, float]]: (conversation_id, message_id, distance)
+        """
+        if k < 1:
+            return []
+        metadata_filter: Optional[Dict[str, Any]] = None
+        if conversation_id is not None:
+            metadata_filter = {"conversation_id": conversation_id}
+        documents = self._kb.retrieve(query, top_k=k, metadata_filter=metadata_filter)
+        return [
+            (doc.metadata["conversation_id"], doc.doc_id, doc.metadata["score"])
+            for doc in documents
+        ]
+
+    def delete(self, message_ids: Sequence[str]) -> None:
+        """Remove messages from the index."""
+        if message_ids:
+            self._kb.delete_documents(list(message_ids))
+
+    def delete_conversation(self, conversation_id: str) -> None:
+        """Remove every message of a conversation from the index."""
+        self._kb.collection.delete(where={"conversation_id": conversation_id})
+        self._kb.invalidate_stats()
+
+    def clear(self) -> None:
+        """Remove every message from the index."""
+        self._kb.clear()
@@ -1,8 +1,31 @@
 # -*- coding: utf-8 -*-
-"""The serialization module for the package."""
+"""The serialization module for the package.
+
+Serialization goes through pluggable codecs. The text codecs produce
+JSON: `orjson` when it is installed, falling back to the stdlib `json`
+for values orjson rejects. The binary `msgpack` codec is available when
+`msgpack` is installed, e.g. for compact memory exports. The default
+text codec can be forced with the `MEMBASE_SERIALIZER` environment
+variable.
+"""
 import importlib
 import json
-from typing import Any
+import os
+from typing import Any, Dict, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+
+_CLASS_CACHE: Dict[Tuple[str, str], Any] = {}
+"""Classes resolved by `_deserialize_hook`, keyed by (module, name)."""
 
 
 def _default_serialize(obj: Any) -> Any:
@@ -18,33 +41,216 @@ def _default_serialize(obj: Any) -> Any:
     return obj
 
 
+def _strict_default_serialize(obj: Any) -> Any:
+    """Like `_default_serialize`, but raise for unsupported objects, as
+    orjson and msgpack expect."""
+    value = _default_serialize(obj)
+    if value is obj:
+        raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+    return value
+
+
+def _resolve_class(module_name: str, class_name: str) -> Any:
+    """Import a class once and cache it."""
+    key = (module_name, class_name)
+    cls = _CLASS_CACHE.get(key)
+    if cls is None:
+        module = importlib.import_module(module_name)
+        cls = getattr(module, class_name)
+        _CLASS_CACHE[key] = cls
+    return cls
+
+
 def _deserialize_hook(data: dict) -> Any:
     """Deserialize the JSON string to an object, including Message object."""
     module_name = data.get("__module__", None)
     class_name = data.get("__name__", None)
 
     if module_name is not None and class_name is not None:
-        module = importlib.import_module(module_name)
-        cls = getattr(module, class_name)
+        cls = _resolve_class(module_name, class_name)
         if hasattr(cls, "from_dict"):
             return cls.from_dict(data)
     return data
 
 
+def _apply_hook(obj: Any, tagged: Optional[int] = None) -> Any:
+    """Apply `_deserialize_hook` bottom-up, for decoders without an object hook.
+
+    A list of objects of one class with a `from_dicts` bulk constructor,
+    e.g. a list of messages, is built in a single call. `tagged` is an
+    upper bound on the number of class-tagged dicts in `obj`: when it
+    says every tagged dict is a top-level item, nested values are not
+    walked.
+    """
+    if tagged == 0:
+        return obj
+    if isinstance(obj, dict):
+        _apply_hook_values(obj)
+        return _deserialize_hook(obj)
+    if isinstance(obj, list):
+        cls = _bulk_class(obj)
+        if cls is None or tagged != len(obj):
+            for item in obj:
+                if isinstance(item, dict):
+                    _apply_hook_values(item)
+                elif isinstance(item, list):
+                    _apply_hook(item)
+        if cls is not None:
+            obj[:] = cls.from_dicts(obj)
+            return obj
+        for i, item in enumerate(obj):
+            if isinstance(item, dict):
+                obj[i] = _deserialize_hook(item)
+    return obj
+
+
+def _count_tagged(data: Union[str, bytes]) -> int:
+    """Upper bound on the class-tagged dicts encoded in `data`."""
+    if isinstance(data, str):
+        return data.count("__module__")
+    return data.count(b"__module__")
+
+
+def _apply_hook_values(obj: dict) -> None:
+    for key, value in obj.items():
+        if isinstance(value, (dict, list)):
+            obj[key] = _apply_hook(value)
+
+
+def _bulk_class(items: list) -> Any:
+    """The class shared by all items of the list if it has `from_dicts`."""
+    if not items or not isinstance(items[0], dict):
+        return None
+    key = (items[0].get("__module__"), items[0].get("__name__"))
+    if key[0] is None or key[1] is None:
+        return None
+    for item in items:
+        if not isinstance(item, dict) or (item.get("__module__"), item.get("__name__")) != key:
+            return None
+    cls = _resolve_class(*key)
+    return cls if hasattr(cls, "from_dicts") else None
+
+
+class Codec:
+    """A serialization format."""
+
+    name: str = ""
+    binary: bool = False
+
+    def dumps(self, obj: Any) -> Union[str, bytes]:
+        raise NotImplementedError
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """The stdlib json codec."""
+
+    name = "json"
+
+    def dumps(self, obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, default=_default_serialize)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data, object_hook=_deserialize_hook)
+
+
+class OrjsonCodec(Codec):
+    """JSON through orjson, falling back to stdlib json for values orjson
+    rejects (e.g. integers beyond 64 bits)."""
+
+    name = "orjson"
+
+    def dumps(self, obj: Any) -> str:
+        try:
+            return orjson.dumps(
+                obj,
+                default=_strict_default_serialize,
+                option=orjson.OPT_NON_STR_KEYS,
+            ).decode("utf-8")
+        except TypeError:
+            return _json_codec.dumps(obj)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        try:
+            obj = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # stdlib json also accepts NaN / Infinity
+            return _json_codec.loads(data)
+        if isinstance(obj, (dict, list)):
+            return _apply_hook(obj, _count_tagged(data))
+        return obj
+
+
+class MsgpackCodec(Codec):
+    """Compact binary MessagePack codec."""
+
+    name = "msgpack"
+    binary = True
+
+    def dumps(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, default=_strict_default_serialize, use_bin_type=True)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        obj = msgpack.unpackb(data, raw=False, strict_map_key=False)
+        if isinstance(obj, (dict, list)):
+            return _apply_hook(obj, _count_tagged(data))
+        return obj
+
+
+_json_codec = JsonCodec()
+_CODECS: Dict[str, Codec] = {"json": _json_codec}
+if orjson is not None:
+    _CODECS["orjson"] = OrjsonCodec()
+if msgpack is not None:
+    _CODECS["msgpack"] = MsgpackCodec()
+
+_FILE_EXTENSIONS = {
+    ".msgpack": "msgpack",
+    ".mpk": "msgpack",
+}
+
+
+def register_codec(codec: Codec) -> None:
+    """Register a codec, replacing any codec of the same name."""
+    _CODECS[codec.name] = codec
+
+
+def get_codec(name: Optional[str] = None) -> Codec:
+    """Get a codec by name. Without a name, returns the default text codec:
+    `MEMBASE_SERIALIZER` if set, else orjson when installed, else json."""
+    if name is None:
+        name = os.getenv("MEMBASE_SERIALIZER") or ("orjson" if "orjson" in _CODECS else "json")
+    codec = _CODECS.get(name)
+    if codec is None:
+        raise ValueError(
+            f"Serializer {name} is not available, "
+            f"choose from {sorted(_CODECS)} or install its package",
+        )
+    return codec
+
+
+def codec_for_path(file_path: str) -> Codec:
+    """Pick the codec of a file by its extension, the default text codec otherwise."""
+    name = _FILE_EXTENSIONS.get(os.path.splitext(file_path)[1].lower())
+    return get_codec(name)
+
+
 def serialize(obj: Any) -> str:
     """Serialize the object to a JSON string.
 
     This function supports to serialize `Message` object for now.
     """
-    return json.dumps(obj, ensure_ascii=False, default=_default_serialize)
+    return get_codec().dumps(obj)
 
 
-def deserialize(s: str) -> Any:
+def deserialize(s: Union[str, bytes]) -> Any:
     """Deserialize the JSON string to an object
 
     This function supports to serialize `Message` object for now.
     """
-    return json.loads(s, object_hook=_deserialize_hook)
+    return get_codec().loads(s)
 
 
 def is_serializable(obj: Any) -> bool:
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+Windowed memory module for conversation, keeping only the recent
+messages in RAM
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union, Callable
+
+from loguru import logger
+
+from .buffered_memory import BufferedMemory
+from .message import Message
+from .recall import RecallIndex
+from .serialize import serialize, deserialize
+
+from membase.storage.hub import hub_client
+
+# concurrent downloads when paging spilled messages in from hub
+_PAGE_IN_WORKERS = 8
+
+
+class _SpillFile:
+    """Append-only file of serialized messages with an in-memory offset index."""
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        # spilled messages only live as long as the memory, start empty
+        self._file = open(path, "w+b")
+        self._offsets = array("q")
+        # concurrent readers of the memory share the file position
+        self._lock = threading.Lock()
+
+    def append(self, message: Message) -> int:
+        """Append a message and return its slot."""
+        data = serialize(message).encode("utf-8") + b"\n"
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            self._offsets.append(self._file.tell())
+            self._file.write(data)
+            return len(self._offsets) - 1
+
+    def read(self, start: int, end: int) -> List[Message]:
+        """Read the messages in slots [start, end)."""
+        if start >= end:
+            return []
+        with self._lock:
+            self._file.flush()
+            self._file.seek(self._offsets[start])
+            lines = [self._file.readline() for _ in range(start, end)]
+        return [deserialize(line.decode("utf-8")) for line in lines]
+
+    def truncate(self) -> None:
+        with self._lock:
+            self._file.seek(0)
+            self._file.truncate()
+            self._offsets = array("q")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+class WindowedMemory(BufferedMemory):
+    """
+    Buffered memory that keeps at most `window_size` recent messages in RAM.
+
+    Appends are O(1) on a bounded deque. Older messages spill to a local
+    file, or to the hub where they were already uploaded as
+    `<conversation_id>_<index>`, and are paged back in when a read
+    reaches past the window. When spilling to hub, only messages the hub
+    acknowledged are dropped from the machine; the others, e.g. uploads
+    still in flight or local summaries, spill to the local file.
+    """
+
+    def __init__(
+        self,
+        conversation_id: Optional[str] = None,
+        membase_account: str = "default",
+        auto_upload_to_hub: bool = False,
+        window_size: int = 64,
+        spill_to: str = "disk",
+        spill_dir: Optional[str] = None,
+        index_metadata_keys: Optional[Sequence[str]] = None,
+        recall_index: Optional[RecallIndex] = None,
+    ) -> None:
+        """
+        Windowed memory module for conversation.
+
+        Args:
+            conversation_id (Optional[str]): The conversation ID
+            membase_account (str): The membase account name
+            auto_upload_to_hub (bool): Whether to automatically upload to hub
+            window_size (int): Max number of messages kept in RAM
+            spill_to (str): "disk" or "hub", where older messages are paged from.
+                "hub" requires auto_upload_to_hub.
+            spill_dir (Optional[str]): Directory of the spill files, defaults to
+                a `membase_spill` folder in the system temp directory. Used with
+                spill_to="hub" too, for messages the hub has not acknowledged
+            index_metadata_keys (Optional[Sequence[str]]): Metadata keys
+                that `query` can filter on. The indexes cover spilled
+                messages too, which `query` pages back in.
+            recall_index (Optional[RecallIndex]): Vector index the added
+                messages are embedded into, enabling `recall`
+        """
+        if window_size < 1:
+            raise ValueError("window_size must be at least 1")
+        if spill_to not in ("disk", "hub"):
+            raise ValueError(f"Invalid spill_to {spill_to}, must be 'disk' or 'hub'")
+        if spill_to == "hub" and not auto_upload_to_hub:
+            raise ValueError("spill_to='hub' requires auto_upload_to_hub=True")
+
+        super().__init__(
+            conversation_id=conversation_id,
+            membase_account=membase_account,
+            auto_upload_to_hub=auto_upload_to_hub,
+            index_metadata_keys=index_metadata_keys,
+            recall_index=recall_index,
+        )
+        self._window_size = window_size
+        self._spill_to = spill_to
+        self._spill_dir = spill_dir or os.path.join(tempfile.gettempdir(), "membase_spill")
+        self._spill_file: Optional[_SpillFile] = None
+        # id -> hub index of the resident messages the hub acknowledged,
+        # written by the upload workers, see _on_hub
+        self._acked: Dict[str, int] = {}
+        self._ack_lock = threading.Lock()
+        # ids of the messages a replace_range is putting in, see _rebuild
+        self._replacing: Set[str] = set()
+        self._reset_window()
+
+    def _reset_window(self) -> None:
+        self._messages = deque()
+        self._message_map = {}
+        # index of the first resident message
+        self._base = 0
+        # id -> index of the spilled messages, so duplicate detection
+        # and recall still cover them
+        self._spilled_ids: Dict[str, int] = {}
+        # where each spilled message is: its hub index if >= 0, else
+        # slot -(ref + 1) of the spill file
+        self._spill_refs = array("q")
+        self._index.clear()
+        if self._spill_file is not None:
+            self._spill_file.truncate()
+
+    def _contains(self, message_id: str) -> bool:
+        return message_id in self._message_map or message_id in self._spilled_ids
+
+    def _position_of(self, message_id: str) -> Optional[int]:
+        position = self._message_map.get(message_id)
+        if position is None:
+            position = self._spilled_ids.get(message_id)
+        return position
+
+    def _append_message(self, memory_unit: Message) -> int:
+        if len(self._messages) >= self._window_size:
+            self._spill(self._messages.popleft())
+        self._messages.append(memory_unit)
+        index = self._base + len(self._messages) - 1
+        self._message_map[memory_unit.id] = index
+        self._index.add(index, memory_unit)
+        return index
+
+    def _on_hub(self, memory_id: str, memory_unit: Message) -> None:
+        if self._spill_to == "hub":
+            with self._ack_lock:
+                self._acked[memory_unit.id] = int(memory_id.rpartition("_")[2])
+
+    def _spill(self, memory_unit: Message) -> None:
+        self._message_map.pop(memory_unit.id, None)
+        self._spilled_ids[memory_unit.id] = self._base
+        hub_index = None
+        if self._spill_to == "hub":
+            with self._ack_lock:
+                hub_index = self._acked.pop(memory_unit.id, None)
+        if hub_index is None:
+            # not known to be on hub, keep it on disk
+            if self._spill_file is None:
+                os.makedirs(self._spill_dir, exist_ok=True)
+                name = hashlib.sha256(
+                    f"{self._membase_account}/{self._conversation_id}/{id(self)}".encode()
+                ).hexdigest()
+                self._spill_file = _SpillFile(os.path.join(self._spill_dir, name + ".jsonl"))
+            self._spill_refs.append(-self._spill_file.append(memory_unit) - 1)
+        else:
+            self._spill_refs.append(hub_index)
+        self._base += 1
+
+    def _page_in(self, start: int, end: int) -> List[Message]:
+        """Read spilled messages in [start, end) back from disk or hub."""
+        if start >= end:
+            return []
+        return self._page_in_at(self._spill_refs[start:end])
+
+    def _page_in_at(self, refs: Sequence[int]) -> List[Message]:
+        """Read the spilled messages with the given refs. Runs of consecutive
+        file slots are read at once, hub messages are downloaded concurrently.
+
+        Raises:
+            KeyError: If a spilled message is missing from the hub
+        """
+        messages: List[Optional[Message]] = [None] * len(refs)
+        hub = []
+        run = 0
+        for i in range(1, len(refs) + 1):
+            if i < len(refs) and refs[i - 1] < 0 and refs[i] == refs[i - 1] - 1:
+                continue
+            if refs[run] < 0:
+                messages[run:i] = self._spill_file.read(-refs[run] - 1, -refs[i - 1])
+            else:
+                hub.extend(range(run, i))
+            run = i
+
+        if hub:
+            names = [f"{self._conversation_id}_{refs[i]}" for i in hub]
+            with ThreadPoolExecutor(max_workers=min(_PAGE_IN_WORKERS, len(names))) as executor:
+                contents = list(executor.map(lambda name: hub_client.download_hub(self._membase_account, name), names))
+            for i, name, content in zip(hub, names, contents):
+                if not content:
+                    raise KeyError(f"Spilled message {name} not found on hub")
+                messages[i] = deserialize(content.decode("utf-8"))
+        return messages
+
+    @property
+    def resident_size(self) -> int:
+        """Number of messages currently held in RAM."""
+        return len(self._messages)
+
+    def size(self) -> int:
+        """Returns the number of memory segments in memory."""
+        with self._lock.read():
+            return self._base + len(self._messages)
+
+    def get(
+        self,
+        recent_n: Optional[int] = None,
+        filter_func: Optional[Callable[[int, dict], bool]] = None,
+    ) -> list:
+        """Retrieve memory, paging in spilled messages if `recent_n`
+        reaches past the window.
+
+        Args:
+            recent_n (`Optional[int]`, default `None`):
+                The last number of memories to return.
+            filter_func
+                (`Callable[[int, dict], bool]`, default to `None`):
+                The function to filter memories, which take the index and
+                memory unit as input, and return a boolean value.
+        """
+        with self._lock.read():
+            total = self._base + len(self._messages)
+            start = 0 if not recent_n else max(0, total - recent_n)
+
+            memories = self._page_in(start, self._base)
+            resident_start = max(0, start - self._base)
+            if resident_start == 0:
+                memories.extend(self._messages)
+            else:
+                memories.extend(list(self._messages)[resident_start:])
+
+        if filter_func is not None:
+            memories = [_ for i, _ in enumerate(memories) if filter_func(i, _)]
+
+        return memories
+
+    def get_range(self, offset: int = 0, limit: Optional[int] = None) -> list:
+        """Retrieve the memories at indexes [offset, offset + limit),
+        paging in only the spilled ones in that range."""
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError("offset and limit must not be negative")
+        with self._lock.read():
+            total = self._base + len(self._messages)
+            end = total if limit is None else min(total, offset + limit)
+            memories = self._page_in(offset, min(end, self._base))
+            start = max(offset, self._base) - self._base
+            if start < end - self._base:
+                memories.extend(islice(self._messages, start, end - self._base))
+            return memories
+
+    def delete(self, index: Union[Iterable, int]) -> None:
+        """
+        Delete memory fragment by index. Deleting resident messages only
+        rebuilds the window; deleting spilled ones pages them all in and
+        spills them again.
+        """
+        with self._lock.write(), self._tracking_size():
+            if self.size() == 0:
+                logger.warning(
+                    "The memory is empty, and the delete operation is "
+                    "skipping.",
+                )
+                return
+
+            if isinstance(index, int):
+                index = [index]
+
+            if not isinstance(index, list):
+                raise NotImplementedError(
+                    "index type only supports {None, int, list}",
+                )
+
+            index = set(index)
+            invalid_index = [_ for _ in index if _ >= self.size() or _ < 0]
+            if len(invalid_index) > 0:
+                logger.warning(
+                    f"Skip delete operation for the invalid "
+                    f"index {invalid_index}",
+                )
+            index -= set(invalid_index)
+            if not index:
+                return
+
+            if min(index) >= self._base:
+                kept = [m for i, m in enumerate(self._messages) if i + self._base not in index]
+                self._messages = deque(kept)
+                self._message_map = {m.id: self._base + i for i, m in enumerate(kept)}
+                self._index.truncate(self._base)
+                for i, memory_unit in enumerate(kept):
+                    self._index.add(self._base + i, memory_unit)
+                if kept:
+                    # the first message is older than the window, keep its timestamp
+                    self._updated_at = kept[-1].timestamp
+                    self._last_message_id = kept[-1].id
+                else:
+                    self._info_stale = True
+                return
+
+            self._rebuild([m for i, m in enumerate(self.get()) if i not in index])
+            self._info_stale = True
+
+    def replace_range(
+        self,
+        start: int,
+        end: int,
+        messages: Sequence[Message],
+        expected_ids: Optional[Tuple[str, str]] = None,
+    ) -> bool:
+        with self._lock.write():
+            # replacements are local only, even when they reuse the id of
+            # a message on hub, e.g. the copies a compaction policy keeps
+            self._replacing = {m.id for m in messages}
+            try:
+                return super().replace_range(start, end, messages, expected_ids)
+            finally:
+                self._replacing = set()
+
+    def _rebuild(self, messages: List[Message]) -> None:
+        if self._spill_to == "hub":
+            # the messages already on hub spill there again, by their hub index
+            with self._ack_lock:
+                for message_id, position in self._spilled_ids.items():
+                    if self._spill_refs[position] >= 0:
+                        self._acked[message_id] = self._spill_refs[position]
+                for message_id in self._replacing:
+                    self._acked.pop(message_id, None)
+        self._reset_window()
+        for memory_unit in messages:
+            self._append_message(memory_unit)
+        if self._spill_to == "hub":
+            with self._ack_lock:
+                self._acked = {
+                    message_id: hub_index for message_id, hub_index in self._acked.items()
+                    if message_id in self._message_map
+                }
+
+    def _messages_at(self, positions: List[int]) -> list:
+        spilled = iter(self._page_in_at([self._spill_refs[i] for i in positions if i < self._base]))
+        return [self._messages[i - self._base] if i >= self._base else next(spilled) for i in positions]
+
+    def _all_messages(self) -> list:
+        return self.get()
+
+    def clear(self) -> None:
+        """Clean memory, including the spill file"""
+        with self._lock.write(), self._tracking_size():
+            super().clear()
+            self._reset_window()
+            with self._ack_lock:
+                self._acked.clear()
+
+    def __del__(self) -> None:
+        if getattr(self, "_spill_file", None) is not None:
+            self._spill_file.close()
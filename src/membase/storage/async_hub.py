@@ -0,0 +1,489 @@
+"""asyncio-native hub client, for use inside FastAPI routes and async agents."""
+import asyncio
+import json
+import os
+import itertools
+import random
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from .breaker import CircuitBreaker, CircuitOpenError, RetryBudget
+from .cache import HubCache
+from .hub import (
+    _DATA_BUCKET, _already_uploaded, _invalidate_uploaded, _is_retryable, _notify_ack, _resolve_bucket, hub_client,
+)
+from .ledger import UploadLedger, payload_digest
+from .transfer import (
+    Blob, BlobDecoder, ChunkReader, ChunkWriter, ManifestSniffer, check_codec, decode_blob,
+    default_codec, encode_blob, encode_body, iter_chunks, parse_manifest, part_name,
+)
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class AsyncHubUnavailableError(CircuitOpenError, httpx.TransportError):
+    """The hub circuit is open, the request was not sent."""
+
+
+async def _aclose_quietly(http: httpx.AsyncClient) -> None:
+    try:
+        await http.aclose()
+    except Exception as e:
+        logger.debug(f"Error closing a stale hub http client: {e}")
+
+
+class AsyncClient:
+    """Async counterpart of `membase.storage.hub.Client`.
+
+    Requests go through one pooled `httpx.AsyncClient` per event loop,
+    and at most `max_concurrency` requests are in flight at a time. Like
+    the sync client, requests pass a circuit breaker and reads are retried
+    within a retry budget, and optionally hedged.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        max_concurrency: Optional[int] = None,
+        timeout: float = 30.0,
+        max_retries: Optional[int] = None,
+        retry_backoff: Optional[float] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        cache: Optional[HubCache] = None,
+        cache_max_age: float = 0,
+        ledger: Optional[UploadLedger] = None,
+        compression: Optional[str] = None,
+        compress_requests: bool = False,
+        chunk_size: int = 8 * 1024 * 1024,
+        connect_timeout: float = 5.0,
+        breaker: Optional[CircuitBreaker] = None,
+        retry_budget: Optional[RetryBudget] = None,
+        hedge_after: float = 0,
+    ):
+        """
+        Args:
+            base_url: Hub server url
+            max_concurrency: Max in-flight requests (env MEMBASE_HUB_ASYNC_CONCURRENCY, default 16)
+            timeout: Read timeout in seconds
+            max_retries: Retries of a failed upload (env MEMBASE_HUB_UPLOAD_RETRIES, default 3)
+            retry_backoff: Base delay in seconds of the exponential backoff (env MEMBASE_HUB_RETRY_BACKOFF, default 0.5)
+            transport: Optional httpx transport, e.g. a mock transport in tests
+            cache: Optional read-through cache, normally shared with the sync client
+            cache_max_age: Seconds a cached entry is served without revalidation
+            ledger: Optional ledger of acknowledged uploads, normally shared with the sync client
+            compression: Codec of uploaded blobs and of the parts of chunked ones, "zstd", "gzip" or "none"
+            compress_requests: Whether upload requests are sent compressed with Content-Encoding
+            chunk_size: Blobs larger than this many bytes are uploaded in parts, 0 disables chunking
+            connect_timeout: Connect timeout in seconds
+            breaker: Circuit breaker, normally shared with the sync client so both see the hub health
+            retry_budget: Budget of read retries, normally shared with the sync client
+            hedge_after: Seconds after which a slow conversation or download read
+                is duplicated, 0 disables hedging
+        """
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency or int(os.getenv('MEMBASE_HUB_ASYNC_CONCURRENCY', '16'))
+        self.timeout = timeout
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('MEMBASE_HUB_UPLOAD_RETRIES', '3'))
+        self.retry_backoff = retry_backoff if retry_backoff is not None else float(os.getenv('MEMBASE_HUB_RETRY_BACKOFF', '0.5'))
+        self.membase_id = os.getenv('MEMBASE_ID', '')
+        self._transport = transport
+        self.cache = cache
+        self.cache_max_age = cache_max_age
+        self.ledger = ledger
+        self.compression = check_codec(compression or default_codec())
+        self.compress_requests = compress_requests
+        self.chunk_size = chunk_size
+        self.connect_timeout = connect_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.hedge_after = hedge_after
+
+        # httpx clients and semaphores are bound to the loop they are first used on
+        self._loop = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # closes of the clients of previous loops, referenced until done
+        self._closing = set()
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._loop is not loop:
+            if self._http is not None:
+                self._close_stale(self._http, self._loop)
+            self._loop = loop
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                transport=self._transport,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._http, self._semaphore
+
+    def _close_stale(self, http: httpx.AsyncClient, loop) -> None:
+        """Close the client of a previous event loop, so its pool does not leak."""
+        if loop is not None and loop.is_running():
+            # its connections belong to that loop, close them there
+            asyncio.run_coroutine_threadsafe(_aclose_quietly(http), loop)
+            return
+        # the loop has stopped; close what can be closed from this one
+        task = asyncio.get_running_loop().create_task(_aclose_quietly(http))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _post(self, path, check=True, **kwargs) -> httpx.Response:
+        http, semaphore = self._client()
+        if not self.breaker.allow():
+            raise AsyncHubUnavailableError(f"Hub circuit is open, not sending {path}")
+        self.retry_budget.record_request()
+        try:
+            async with semaphore:
+                response = await http.post(f"{self.base_url}{path}", **kwargs)
+        except asyncio.CancelledError:
+            # a cancelled hedge says nothing about the hub health
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if check:
+            response.raise_for_status()
+        return response
+
+    async def _read_through(self, key, path, data, count_of=None, probe=None):
+        """Async counterpart of `Client._read_through`."""
+        if self.cache is None:
+            return (await self._fetch(path, data, {})).content
+
+        entry = self.cache.get(key)
+        headers = {}
+        if entry is not None:
+            if entry.is_fresh(self.cache_max_age):
+                return entry.value
+            headers = entry.conditional_headers()
+            if not headers and probe is not None and entry.count is not None:
+                try:
+                    if await probe(entry.count) is False:
+                        self.cache.touch(key)
+                        return entry.value
+                except httpx.HTTPError:
+                    pass
+
+        try:
+            # with a cached entry to fall back on, failures are not worth retrying
+            response = await self._fetch(path, data, headers, retry=entry is None)
+            if response.status_code == 304 and entry is not None:
+                self.cache.touch(key)
+                return entry.value
+        except httpx.HTTPError as err:
+            if entry is not None:
+                logger.warning(f"Hub request failed, serving cached {key}: {err}")
+                return entry.value
+            raise
+
+        content = response.content
+        self.cache.put(
+            key,
+            content,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            count=count_of(content) if count_of is not None else None,
+        )
+        return content
+
+    async def _fetch(self, path, data, headers, retry=True):
+        """Async counterpart of `Client._fetch`."""
+        async def attempt():
+            response = await self._hedged(path, data, headers)
+            response.raise_for_status()
+            return response
+        return await self._with_retries(attempt) if retry else await attempt()
+
+    async def _hedged(self, path, data, headers):
+        """Async counterpart of `Client._hedged`; the losing request is cancelled."""
+        if not self.hedge_after:
+            return await self._post(path, check=False, data=data, headers=headers)
+        first = asyncio.ensure_future(self._post(path, check=False, data=data, headers=headers))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+        second = asyncio.ensure_future(self._post(path, check=False, data=data, headers=headers))
+        done, pending = await asyncio.wait({first, second}, return_when=asyncio.FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is None:
+            for task in pending:
+                task.cancel()
+            return winner.result()
+        return await (second if winner is first else first)
+
+    async def _exists(self, owner, filename):
+        """Whether the hub has the item: True, False, or None if it could not tell."""
+        response = await self._post("/api/download", check=False, data={'id': filename, 'owner': owner})
+        if response.status_code == 404:
+            return False
+        if response.is_success:
+            return True
+        return None
+
+    def _backoff(self, attempt):
+        delay = self.retry_backoff * (2 ** attempt)
+        # full jitter keeps concurrent callers from retrying in lockstep
+        return random.uniform(0, delay)
+
+    async def _with_retries(self, fn, *args):
+        """Await `fn`, retrying retryable request errors with backoff."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await fn(*args)
+            except httpx.HTTPError as err:
+                if not self._should_retry(err, attempt):
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+
+    def _should_retry(self, err, attempt):
+        """Whether a failed read is retried, spending the retry budget if so."""
+        if attempt == self.max_retries or not _is_retryable(err) or isinstance(err, CircuitOpenError):
+            return False
+        return self.retry_budget.try_retry()
+
+    async def aclose(self):
+        """Close the pooled http client."""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def upload_hub(self, owner, filename, msg, bucket: Optional[str] = None, wait=True, dedupe_key=None, on_ack=None):
+        """Upload a meme to the hub.
+
+        With wait=True the upload is sent directly and awaited, with retries.
+        With wait=False it is handed to the background workers of the sync
+        `hub_client`, so it is batched and spooled like any other upload.
+        Either way, with a ledger an upload the hub already holds is skipped;
+        `dedupe_key`, when given, is hashed for the ledger instead of `msg`.
+        `on_ack` is called once the hub acknowledged the upload.
+
+        Returns:
+            If wait=True, returns upload result; if wait=False, returns queue status.
+            None if the upload failed.
+        """
+        if not wait:
+            return hub_client.upload_hub(
+                owner, filename, msg, bucket=bucket, wait=False, dedupe_key=dedupe_key, on_ack=on_ack
+            )
+
+        bucket = _resolve_bucket(owner, msg, bucket, self.membase_id)
+        digest = None
+        if self.ledger is not None:
+            digest = payload_digest(msg if dedupe_key is None else dedupe_key)
+            if _already_uploaded(self.ledger, owner, bucket, filename, digest):
+                logger.debug(f"Upload skipped, already on hub: {owner}/{filename}")
+                _notify_ack(on_ack)
+                return {"status": "skipped", "message": "Already uploaded"}
+
+        meme_struct = {
+            "Owner": owner,
+            "Bucket": bucket,
+            "ID": filename,
+            "Message": msg
+        }
+        data, headers = encode_body(
+            json.dumps(meme_struct).encode('utf-8'),
+            self.compression if self.compress_requests else None,
+        )
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self._post("/api/upload", headers={'Content-Type': 'application/json', **headers}, content=data)
+                logger.debug(f"Upload done: {response.json()}")
+                if self.cache is not None:
+                    _invalidate_uploaded(self.cache, owner, filename)
+                if self.ledger is not None:
+                    self.ledger.record([(owner, bucket, filename, digest)])
+                _notify_ack(on_ack)
+                return {"status": "completed", "message": "Upload task completed"}
+            except httpx.HTTPError as err:
+                logger.error(f"Error during upload: {err}")
+                if attempt == self.max_retries or not _is_retryable(err):
+                    return None
+                await asyncio.sleep(self._backoff(attempt))
+
+    async def upload_hub_data(self, owner, filename, data: Blob):
+        """Upload meme data to the hub server with multipart form.
+
+        Blobs larger than `chunk_size` are uploaded in compressed parts
+        and a manifest, smaller ones compressed behind a header naming the
+        codec, like `Client.upload_hub_data`.
+        """
+        try:
+            if not self.chunk_size:
+                blob = data if isinstance(data, (bytes, bytearray, memoryview)) else data.read()
+                res = await self._post_data(owner, filename, encode_blob(blob, self.compression))
+            else:
+                chunks = iter_chunks(data, self.chunk_size)
+                first = next(chunks, b"")
+                second = next(chunks, None)
+                if second is None:
+                    res = await self._post_data(owner, filename, encode_blob(first, self.compression))
+                else:
+                    res = await self._upload_chunked(owner, filename, itertools.chain([first, second], chunks))
+            logger.debug(f"Upload done: {res}")
+            return res
+        except httpx.HTTPError as err:
+            logger.error(f"Error during upload: {err}")
+            return None
+
+    async def _post_data(self, owner, filename, blob):
+        files = {
+            'file': (filename, bytes(blob), 'application/octet-stream')
+        }
+        response = await self._post("/api/uploadData", files=files, data={'owner': owner})
+        if self.cache is not None:
+            self.cache.invalidate(HubCache.download_key(owner, filename))
+        return response.json()
+
+    async def _upload_chunked(self, owner, filename, chunks):
+        writer = ChunkWriter(self.compression, self.chunk_size)
+        for chunk in chunks:
+            name = part_name(filename, writer.parts)
+            part, digest = writer.add(chunk)
+            if self.ledger is not None and self.ledger.get(owner, _DATA_BUCKET, name) == digest:
+                continue
+            await self._with_retries(self._post_data, owner, name, part)
+            if self.ledger is not None:
+                self.ledger.record([(owner, _DATA_BUCKET, name, digest)])
+        return await self._with_retries(self._post_data, owner, filename, writer.manifest())
+
+    async def list_conversations(self, owner):
+        """List all conversations for a given owner."""
+        try:
+            response = await self._with_retries(lambda: self._post("/api/conversation", data={'owner': owner}))
+            return response.json()
+        except httpx.HTTPError as err:
+            logger.error(f"Error during list conversations: {err}")
+            return None
+
+    async def get_conversation(self, owner, conversation_id):
+        """Get a conversation for a given owner and conversation id."""
+        try:
+            content = await self._read_through(
+                HubCache.conversation_key(owner, conversation_id),
+                "/api/conversation",
+                {'owner': owner, 'id': conversation_id},
+                count_of=lambda value: len(json.loads(value)),
+                probe=lambda count: self._exists(owner, f"{conversation_id}_{count}"),
+            )
+            return json.loads(content)
+        except (httpx.HTTPError, ValueError) as err:
+            logger.error(f"Error during get conversation: {err}")
+            return None
+
+    async def download_hub(self, owner, filename):
+        """Download meme data from the hub server."""
+        try:
+            logger.debug(f"Downloading {owner} {filename} from hub {self.base_url}")
+            content = await self._read_through(
+                HubCache.download_key(owner, filename),
+                "/api/download",
+                {'id': filename, 'owner': owner},
+            )
+            manifest = parse_manifest(content)
+            if manifest is None:
+                return decode_blob(content)
+            return b"".join([chunk async for chunk in self._iter_parts(owner, filename, manifest)])
+        except (httpx.HTTPError, ValueError) as err:
+            logger.error(f"Error during download: {err}")
+            return None
+
+    async def download_hub_stream(self, owner, filename, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        """Async counterpart of `Client.download_hub_stream`."""
+        sniffer, decoder = ManifestSniffer(), BlobDecoder()
+        async for piece in self._stream_download(owner, filename, chunk_size):
+            for chunk in iter_chunks(decoder.feed(sniffer.feed(piece)), chunk_size):
+                yield chunk
+        rest, manifest = sniffer.finish()
+        if manifest is not None:
+            async for chunk in self._iter_parts(owner, filename, manifest, chunk_size):
+                yield chunk
+        else:
+            for chunk in iter_chunks(decoder.feed(rest) + decoder.finish(), chunk_size):
+                yield chunk
+
+    async def _stream_download(self, owner, filename, chunk_size):
+        http, semaphore = self._client()
+        received = 0
+        for attempt in range(self.max_retries + 1):
+            headers = {}
+            if received:
+                # byte ranges are only meaningful on the identity encoding
+                headers = {'Range': f"bytes={received}-", 'Accept-Encoding': 'identity'}
+            if not self.breaker.allow():
+                raise AsyncHubUnavailableError(f"Hub circuit is open, not downloading {filename}")
+            connected = False
+            try:
+                async with semaphore:
+                    async with http.stream(
+                        "POST", f"{self.base_url}/api/download",
+                        data={'id': filename, 'owner': owner}, headers=headers,
+                    ) as response:
+                        connected = True
+                        if response.status_code >= 500:
+                            self.breaker.record_failure()
+                        else:
+                            self.breaker.record_success()
+                        response.raise_for_status()
+                        # a hub ignoring the range sends the whole blob again
+                        skip = received if response.status_code != 206 else 0
+                        async for piece in response.aiter_bytes(chunk_size):
+                            if skip:
+                                dropped = min(skip, len(piece))
+                                piece = piece[dropped:]
+                                skip -= dropped
+                                if not piece:
+                                    continue
+                            received += len(piece)
+                            yield piece
+                return
+            except httpx.HTTPError as err:
+                if not connected:
+                    self.breaker.record_failure()
+                if not self._should_retry(err, attempt):
+                    raise
+                logger.warning(f"Download of {owner}/{filename} interrupted at {received} bytes, resuming: {err}")
+                await asyncio.sleep(self._backoff(attempt))
+
+    async def _download_part(self, owner, name):
+        return (await self._post("/api/download", data={'id': name, 'owner': owner})).content
+
+    async def _iter_parts(self, owner, filename, manifest, chunk_size=None):
+        """Raw chunks of a chunked blob, fetched part by part."""
+        reader = ChunkReader(manifest)
+        for name in reader.part_names(filename):
+            chunk = reader.read(await self._with_retries(self._download_part, owner, name))
+            if chunk_size:
+                for piece in iter_chunks(chunk, chunk_size):
+                    yield piece
+            else:
+                yield chunk
+        reader.check()
+
+
+async_hub_client = AsyncClient(
+    hub_client.base_url,
+    cache=hub_client.cache,
+    cache_max_age=hub_client.cache_max_age,
+    ledger=hub_client.ledger,
+    compression=hub_client.compression,
+    compress_requests=hub_client.compress_requests,
+    chunk_size=hub_client.chunk_size,
+    timeout=hub_client.read_timeout,
+    connect_timeout=hub_client.connect_timeout,
+    breaker=hub_client.breaker,
+    retry_budget=hub_client.retry_budget,
+    hedge_after=hub_client.hedge_after,
+)
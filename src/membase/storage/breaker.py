@@ -0,0 +1,116 @@
+"""Circuit breaker and retry budget protecting callers from a degraded hub."""
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the hub circuit is open."""
+
+
+class CircuitBreaker:
+    """Fails hub requests fast once the hub looks unhealthy.
+
+    After `failure_threshold` consecutive failures (connection errors,
+    timeouts, 5xx) the circuit opens and requests are refused for
+    `reset_timeout` seconds. Then a single trial request is let through:
+    its success closes the circuit, its failure opens it again. A trial
+    that never reports back, e.g. a cancelled one, is replaced after
+    another `reset_timeout`. A threshold of 0 disables the breaker.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: Consecutive failures opening the circuit, 0 to disable
+            reset_timeout: Seconds the circuit stays open before a trial request
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_at = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return self.CLOSED
+            if self._trial_at is not None or time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self.OPEN
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now."""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            since = self._opened_at if self._trial_at is None else self._trial_at
+            if now - since < self.reset_timeout:
+                return False
+            # one trial request at a time while half open
+            self._trial_at = now
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Hub is reachable again, closing the circuit")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_at = None
+
+    def record_failure(self) -> None:
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            if self._trial_at is not None or (self._opened_at is None and self._failures >= self.failure_threshold):
+                if self._opened_at is None:
+                    logger.warning(f"Hub failed {self._failures} times in a row, opening the circuit")
+                self._opened_at = time.monotonic()
+                self._trial_at = None
+
+
+class RetryBudget:
+    """Caps retries to a share of the requests sent.
+
+    Every request deposits `ratio` of a retry and every retry withdraws a
+    whole one, so while the hub is failing retries add at most `ratio`
+    extra load instead of multiplying it. Unused retries accumulate up
+    to ten times `reserve`.
+    """
+
+    def __init__(self, ratio: float = 0.2, reserve: int = 10):
+        """
+        Args:
+            ratio: Retries allowed per request sent
+            reserve: Retries available before any request was sent
+        """
+        self.ratio = ratio
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self._tokens = float(reserve)
+        self._max_tokens = float(max(reserve, 1) * 10)
+
+    def record_request(self) -> None:
+        with self._lock:
+            self._tokens = min(self._max_tokens, self._tokens + self.ratio)
+
+    def try_retry(self) -> bool:
+        """Withdraw a retry, False if the budget is spent."""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
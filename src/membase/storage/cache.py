@@ -0,0 +1,146 @@
+"""Persistent read-through cache for hub conversations and downloads."""
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    """A cached hub response and the validators needed to revalidate it."""
+
+    __slots__ = ("value", "etag", "last_modified", "count", "fetched_at")
+
+    def __init__(self, value: bytes, etag: Optional[str], last_modified: Optional[str],
+                 count: Optional[int], fetched_at: float):
+        self.value = value
+        self.etag = etag
+        self.last_modified = last_modified
+        self.count = count
+        self.fetched_at = fetched_at
+
+    def is_fresh(self, max_age: float) -> bool:
+        """Whether the entry can be served without asking the hub."""
+        return max_age > 0 and time.time() - self.fetched_at < max_age
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Headers for a conditional request revalidating this entry."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HubCache:
+    """Size-bounded LRU cache of hub responses, stored in SQLite.
+
+    Keys are `conversation:<owner>:<id>` and `download:<owner>:<filename>`.
+    Entries keep the ETag / Last-Modified the hub sent, and the message
+    count for conversations, so callers can revalidate instead of
+    refetching. The least recently accessed entries are evicted once
+    the stored values exceed `max_bytes`.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Args:
+            path: SQLite file path of the cache
+            max_bytes: Upper bound on the total size of cached values
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " count INTEGER,"
+            " size INTEGER NOT NULL,"
+            " fetched_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (accessed_at)")
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    @staticmethod
+    def conversation_key(owner: str, conversation_id: str) -> str:
+        return f"conversation:{owner}:{conversation_id}"
+
+    @staticmethod
+    def download_key(owner: str, filename: str) -> str:
+        return f"download:{owner}:{filename}"
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Return the cached entry and mark it as recently used."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, etag, last_modified, count, fetched_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return CacheEntry(*row)
+
+    def put(self, key: str, value: bytes, etag: Optional[str] = None,
+            last_modified: Optional[str] = None, count: Optional[int] = None) -> None:
+        """Store a fresh hub response, evicting old entries if over budget."""
+        size = len(value)
+        if size > self.max_bytes:
+            logger.debug(f"Not caching {key}: {size} bytes exceeds the cache budget")
+            self.invalidate(key)
+            return
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, etag, last_modified, count, size, fetched_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, value, etag, last_modified, count, size, now, now),
+            )
+            self._size += size - (old[0] if old else 0)
+            self._evict()
+
+    def touch(self, key: str) -> None:
+        """Record that the hub confirmed the entry is still valid."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE cache SET fetched_at = ?, accessed_at = ? WHERE key = ?", (now, now, key))
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._size -= row[0]
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until under budget. Caller holds the lock."""
+        while self._size > self.max_bytes:
+            row = self._conn.execute("SELECT key, size FROM cache ORDER BY accessed_at LIMIT 1").fetchone()
+            if row is None:
+                self._size = 0
+                return
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (row[0],))
+            self._size -= row[1]
+            logger.debug(f"Evicted {row[0]} from hub cache")
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
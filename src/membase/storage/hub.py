@@ -1,140 +1,745 @@
-from typing import Optional
+from typing import Iterator, Optional
+import concurrent.futures
+import heapq
+import itertools
 import requests
+import requests.adapters
+import urllib3
 import json
 import os
+import random
 from io import BytesIO
 from urllib.parse import urlencode
 import queue
 import threading
 import time
 
+from .breaker import CircuitBreaker, CircuitOpenError, RetryBudget
+from .cache import HubCache
+from .ledger import UploadLedger, payload_digest
+from .spool import UploadSpool
+from .transfer import (
+    Blob, BlobDecoder, ChunkReader, ChunkWriter, ManifestSniffer, check_codec, decode_blob,
+    default_codec, encode_blob, encode_body, iter_chunks, parse_manifest, part_name,
+)
+
 import logging
 logger = logging.getLogger(__name__)
 
+
+class HubUnavailableError(CircuitOpenError, requests.ConnectionError):
+    """The hub circuit is open, the request was not sent."""
+
+
+class _UploadTask:
+    """A queued upload and its completion state."""
+
+    __slots__ = (
+        "owner", "bucket", "filename", "msg", "event", "seq", "attempts", "error", "digest", "counted", "on_ack",
+    )
+
+    def __init__(self, owner, bucket, filename, msg, event=None, seq=None, digest=None, on_ack=None):
+        self.owner = owner
+        self.bucket = bucket
+        self.filename = filename
+        self.msg = msg
+        self.event = event if event is not None else threading.Event()
+        self.seq = seq
+        self.attempts = 0
+        self.error = None
+        self.digest = digest
+        # whether the task is in the in-flight counts, see Client.pending_uploads
+        self.counted = False
+        # called once the hub acknowledged the upload
+        self.on_ack = on_ack
+
+    def meme_struct(self):
+        return {
+            "Owner": self.owner,
+            "Bucket": self.bucket,
+            "ID": self.filename,
+            "Message": self.msg
+        }
+
+    @property
+    def stream(self):
+        """The ordered stream the upload belongs to: its owner and conversation."""
+        # memories are stored as <conversation_id>_<index>
+        conversation_id, _, index = self.filename.rpartition("_")
+        if conversation_id and index.isdigit():
+            return self.owner, conversation_id
+        return self.owner, self.filename
+
+
+class _UploadQueues:
+    """One FIFO queue per upload worker.
+
+    All the uploads of a conversation go to the same queue, so a single
+    worker sends them, in the order they were queued.
+    """
+
+    def __init__(self, count):
+        self.queues = [queue.Queue() for _ in range(count)]
+
+    def put(self, task):
+        self.queues[hash(task.stream) % len(self.queues)].put(task)
+
+    def join(self):
+        for q in self.queues:
+            q.join()
+
+
+def _is_retryable(err: Exception) -> bool:
+    """Client errors (4xx except 429) will not succeed on retry."""
+    # requests and httpx errors both carry the response of a failed status check
+    response = getattr(err, "response", None)
+    code = getattr(response, "status_code", None) if response is not None else None
+    if isinstance(code, int):
+        return code >= 500 or code == 429
+    return True
+
+
+def _resolve_bucket(owner, msg, bucket, membase_id):
+    """Pick the upload bucket: explicit bucket, else the message sender name, else membase id or owner."""
+    if bucket is not None:
+        return bucket
+    default_bucket = owner
+    if membase_id != "":
+        default_bucket = membase_id
+    if isinstance(msg, str):
+        try:
+            msg_dict = json.loads(msg)
+            return msg_dict.get("name", default_bucket)
+        except (json.JSONDecodeError, AttributeError):
+            return default_bucket
+    return default_bucket
+
+
+# uploadData has no bucket, its items are recorded in the ledger under this one
+_DATA_BUCKET = ""
+
+
+def _invalidate_uploaded(cache: HubCache, owner, filename):
+    """Drop cache entries an acknowledged upload has made stale."""
+    cache.invalidate(HubCache.download_key(owner, filename))
+    # memories are stored as <conversation_id>_<index>
+    conversation_id, _, index = filename.rpartition("_")
+    if conversation_id and index.isdigit():
+        cache.invalidate(HubCache.conversation_key(owner, conversation_id))
+
+
+def _notify_ack(on_ack):
+    """Call an upload's acknowledgement callback, if any, keeping its errors
+    away from the upload workers."""
+    if on_ack is None:
+        return
+    try:
+        on_ack()
+    except Exception as e:
+        logger.error(f"Error in upload acknowledgement callback: {e}")
+
+
+def _already_uploaded(ledger: UploadLedger, owner, bucket, filename, digest) -> bool:
+    """Whether the hub acknowledged this payload for the item last."""
+    acked = ledger.get(owner, bucket, filename)
+    if acked == digest:
+        return True
+    if acked is not None:
+        # until the new payload is acknowledged, the old one must not be skipped
+        ledger.forget(owner, bucket, filename)
+    return False
+
+
 class Client:
-    def __init__(self, base_url):
+    def __init__(
+        self,
+        base_url,
+        batch_size: Optional[int] = None,
+        batch_wait_ms: Optional[int] = None,
+        num_workers: Optional[int] = None,
+        bulk_endpoint: Optional[str] = None,
+        spool_path: Optional[str] = None,
+        max_retries: Optional[int] = None,
+        retry_backoff: Optional[float] = None,
+        retry_backoff_max: float = 60.0,
+        cache_path: Optional[str] = None,
+        cache_max_bytes: Optional[int] = None,
+        cache_max_age: Optional[float] = None,
+        ledger_path: Optional[str] = None,
+        compression: Optional[str] = None,
+        compress_requests: Optional[bool] = None,
+        chunk_size: Optional[int] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        breaker_failures: Optional[int] = None,
+        breaker_reset: Optional[float] = None,
+        retry_budget: Optional[float] = None,
+        hedge_after_ms: Optional[int] = None,
+    ):
+        """Create a hub client.
+
+        Uploads are queued and sent by background workers. Each worker
+        drains up to `batch_size` tasks, or whatever arrived within
+        `batch_wait_ms`, and sends them over a shared keep-alive session.
+        Failed uploads are retried with exponential backoff. The uploads of
+        a conversation are all sent by the same worker and reach the hub in
+        order: while one waits for a retry, the later ones are held back.
+
+        Every request has connect and read timeouts, and goes through a
+        circuit breaker: after repeated failures requests fail fast for a
+        while, and reads are served from the cache if one is configured.
+        Reads are retried with backoff, within a retry budget, and can be
+        hedged by a duplicate request when the hub is slow to answer.
+
+        Args:
+            base_url: Hub server url
+            batch_size: Max uploads per batch (env MEMBASE_HUB_BATCH_SIZE, default 32)
+            batch_wait_ms: Max time to wait to fill a batch (env MEMBASE_HUB_BATCH_WAIT_MS, default 20)
+            num_workers: Number of upload workers (env MEMBASE_HUB_UPLOAD_WORKERS, default 4)
+            bulk_endpoint: Optional hub path accepting a json list of memes,
+                e.g. "/api/uploadBatch" (env MEMBASE_HUB_BULK_ENDPOINT).
+                If unset, batch items are posted one by one to /api/upload.
+            spool_path: SQLite file for the durable upload spool (env MEMBASE_HUB_SPOOL).
+                When set, uploads are written to disk before upload_hub returns,
+                replayed after a restart and retried until the hub accepts them.
+            max_retries: Retries before a waiting caller is released (env MEMBASE_HUB_UPLOAD_RETRIES, default 3).
+                Without a spool the upload is dropped after that.
+            retry_backoff: Base delay in seconds of the exponential backoff (env MEMBASE_HUB_RETRY_BACKOFF, default 0.5)
+            retry_backoff_max: Maximum backoff delay in seconds
+            cache_path: SQLite file for the read-through cache of conversations
+                and downloads (env MEMBASE_HUB_CACHE). Disabled if unset.
+            cache_max_bytes: Cache size budget (env MEMBASE_HUB_CACHE_MAX_MB, default 256 MB)
+            cache_max_age: Seconds a cached entry is served without revalidation
+                (env MEMBASE_HUB_CACHE_MAX_AGE, default 0: always revalidate)
+            ledger_path: SQLite file of the upload ledger (env MEMBASE_HUB_LEDGER).
+                When set, an upload whose payload the hub already acknowledged
+                for the same owner, bucket and id is skipped.
+            compression: Codec of uploaded blobs and of the parts of chunked ones, "zstd", "gzip" or "none"
+                (env MEMBASE_HUB_COMPRESSION, default zstd if zstandard is installed, else gzip)
+            compress_requests: Whether upload requests are sent compressed with
+                Content-Encoding, for hubs that accept it (env MEMBASE_HUB_COMPRESS_REQUESTS, default off)
+            chunk_size: Blobs larger than this many bytes are uploaded in parts
+                (env MEMBASE_HUB_CHUNK_MB, default 8 MB, 0 disables chunking)
+            connect_timeout: Seconds to connect to the hub (env MEMBASE_HUB_CONNECT_TIMEOUT, default 5)
+            read_timeout: Seconds to wait for hub data (env MEMBASE_HUB_READ_TIMEOUT, default 30)
+            breaker_failures: Consecutive failures opening the circuit
+                (env MEMBASE_HUB_BREAKER_FAILURES, default 5, 0 disables the breaker)
+            breaker_reset: Seconds the circuit stays open before a trial request
+                (env MEMBASE_HUB_BREAKER_RESET, default 30)
+            retry_budget: Read retries allowed per request sent
+                (env MEMBASE_HUB_RETRY_BUDGET, default 0.2)
+            hedge_after_ms: Send a duplicate conversation or download read if the
+                first has not answered after this long (env MEMBASE_HUB_HEDGE_MS, default 0: off)
+        """
         self.base_url = base_url
-        self.upload_queue = queue.Queue()
-        self.upload_thread = threading.Thread(target=self._process_upload_queue, daemon=True)
-        self.upload_thread.start()
+        self.batch_size = max(1, batch_size or int(os.getenv('MEMBASE_HUB_BATCH_SIZE', '32')))
+        self.batch_wait_ms = batch_wait_ms if batch_wait_ms is not None else int(os.getenv('MEMBASE_HUB_BATCH_WAIT_MS', '20'))
+        self.num_workers = max(1, num_workers or int(os.getenv('MEMBASE_HUB_UPLOAD_WORKERS', '4')))
+        self.bulk_endpoint = bulk_endpoint or os.getenv('MEMBASE_HUB_BULK_ENDPOINT') or None
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('MEMBASE_HUB_UPLOAD_RETRIES', '3'))
+        self.retry_backoff = retry_backoff if retry_backoff is not None else float(os.getenv('MEMBASE_HUB_RETRY_BACKOFF', '0.5'))
+        self.retry_backoff_max = retry_backoff_max
+
+        spool_path = spool_path or os.getenv('MEMBASE_HUB_SPOOL') or None
+        self.spool = UploadSpool(spool_path) if spool_path else None
+
+        cache_path = cache_path or os.getenv('MEMBASE_HUB_CACHE') or None
+        if cache_max_bytes is None:
+            cache_max_bytes = int(float(os.getenv('MEMBASE_HUB_CACHE_MAX_MB', '256')) * 1024 * 1024)
+        self.cache = HubCache(cache_path, cache_max_bytes) if cache_path else None
+        self.cache_max_age = cache_max_age if cache_max_age is not None else float(os.getenv('MEMBASE_HUB_CACHE_MAX_AGE', '0'))
+
+        ledger_path = ledger_path or os.getenv('MEMBASE_HUB_LEDGER') or None
+        self.ledger = UploadLedger(ledger_path) if ledger_path else None
+
+        self.compression = check_codec(compression or os.getenv('MEMBASE_HUB_COMPRESSION') or default_codec())
+        if compress_requests is None:
+            compress_requests = os.getenv('MEMBASE_HUB_COMPRESS_REQUESTS', '').lower() in ('1', 'true', 'yes')
+        self.compress_requests = compress_requests
+        if chunk_size is None:
+            chunk_size = int(float(os.getenv('MEMBASE_HUB_CHUNK_MB', '8')) * 1024 * 1024)
+        self.chunk_size = chunk_size
+
+        if connect_timeout is None:
+            connect_timeout = float(os.getenv('MEMBASE_HUB_CONNECT_TIMEOUT', '5'))
+        if read_timeout is None:
+            read_timeout = float(os.getenv('MEMBASE_HUB_READ_TIMEOUT', '30'))
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.breaker = CircuitBreaker(
+            breaker_failures if breaker_failures is not None else int(os.getenv('MEMBASE_HUB_BREAKER_FAILURES', '5')),
+            breaker_reset if breaker_reset is not None else float(os.getenv('MEMBASE_HUB_BREAKER_RESET', '30')),
+        )
+        self.retry_budget = RetryBudget(
+            retry_budget if retry_budget is not None else float(os.getenv('MEMBASE_HUB_RETRY_BUDGET', '0.2')),
+        )
+        if hedge_after_ms is None:
+            hedge_after_ms = int(os.getenv('MEMBASE_HUB_HEDGE_MS', '0'))
+        self.hedge_after = hedge_after_ms / 1000.0
+
+        # One pooled session shared by uploads and reads, so connections are reused
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.num_workers,
+            pool_maxsize=self.num_workers * 2,
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # advertise zstd too when urllib3 can decode it
+        self.session.headers['Accept-Encoding'] = urllib3.util.make_headers(accept_encoding=True)['accept-encoding']
+
+        self._hedge_pool = None
+        if self.hedge_after > 0:
+            self._hedge_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.num_workers * 2, thread_name_prefix="hub-hedge",
+            )
+
+        self.upload_queue = _UploadQueues(self.num_workers)
+
+        # stream -> (task waiting for a retry, tasks of the stream held behind it)
+        self._held = {}
+        self._held_lock = threading.Lock()
+        # stream -> uploads queued, held or retrying, not yet acknowledged or dropped
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+        # Delayed retries: heap of (due_time, tiebreak, task)
+        self._retry_heap = []
+        self._retry_cond = threading.Condition()
+        self._retry_counter = 0
+        self._closed = False
+        self._retry_thread = threading.Thread(target=self._process_retries, name="hub-retry", daemon=True)
+        self._retry_thread.start()
+
+        if self.spool is not None:
+            self._replay_spool()
+
+        self.upload_threads = []
+        for i in range(self.num_workers):
+            t = threading.Thread(
+                target=self._process_upload_queue, args=(self.upload_queue.queues[i],),
+                name=f"hub-upload-{i}", daemon=True,
+            )
+            t.start()
+            self.upload_threads.append(t)
+        # kept for backward compatibility
+        self.upload_thread = self.upload_threads[0]
         self.membase_id = os.getenv('MEMBASE_ID', '')
 
-    def _process_upload_queue(self):
-        while True:
+    def _replay_spool(self):
+        """Queue uploads left unacknowledged by a previous run."""
+        pending = self.spool.pending()
+        for seq, owner, bucket, filename, msg, attempts, digest in pending:
+            if self.ledger is None:
+                digest = None
+            elif digest is None:
+                digest = payload_digest(msg)
+            task = _UploadTask(owner, bucket, filename, msg, seq=seq, digest=digest)
+            task.attempts = attempts
+            self._queue(task)
+        if pending:
+            logger.info(f"Replaying {len(pending)} spooled uploads")
+
+    def _queue(self, task):
+        """Queue a new upload, counting it in flight until it is settled."""
+        with self._inflight_lock:
+            self._inflight[task.stream] = self._inflight.get(task.stream, 0) + 1
+        task.counted = True
+        self.upload_queue.put(task)
+
+    def _settle(self, task):
+        """An upload was acknowledged or dropped, it is no longer in flight."""
+        if not task.counted:
+            return
+        task.counted = False
+        with self._inflight_lock:
+            count = self._inflight.get(task.stream, 0) - 1
+            if count > 0:
+                self._inflight[task.stream] = count
+            else:
+                self._inflight.pop(task.stream, None)
+
+    def pending_uploads(self, owner, conversation_id):
+        """Number of uploads of a conversation queued, held or retrying,
+        i.e. not yet on the hub."""
+        with self._inflight_lock:
+            return self._inflight.get((owner, conversation_id), 0)
+
+    def _next_batch(self, upload_queue):
+        """Block for one task, then drain more until the batch is full or the wait expires.
+
+        Returns:
+            (batch, stop): the tasks to send and whether a stop sentinel was seen
+        """
+        task = upload_queue.get()
+        if task is None:
+            return [], True
+
+        batch = [task]
+        deadline = time.monotonic() + self.batch_wait_ms / 1000.0
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
             try:
-                upload_task = self.upload_queue.get()
-                if upload_task is None:
-                    break
-                
-                owner, bucket, filename, msg, event = upload_task
-                meme_struct = {
-                    "Owner": owner,
-                    "Bucket": bucket,
-                    "ID": filename,
-                    "Message": msg
-                }
-
-                meme_struct_json = json.dumps(meme_struct)
-                headers = {'Content-Type': 'application/json'}
-                
-                response = requests.post(f"{self.base_url}/api/upload", headers=headers, data=meme_struct_json)
+                if remaining > 0:
+                    task = upload_queue.get(timeout=remaining)
+                else:
+                    task = upload_queue.get_nowait()
+            except queue.Empty:
+                break
+            if task is None:
+                return batch, True
+            batch.append(task)
+        return batch, False
+
+    def _post(self, url, **kwargs):
+        """POST through the pooled session, with timeouts and the circuit breaker."""
+        if not self.breaker.allow():
+            raise HubUnavailableError(f"Hub circuit is open, not sending {url}")
+        self.retry_budget.record_request()
+        try:
+            response = self.session.post(url, timeout=(self.connect_timeout, self.read_timeout), **kwargs)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        code = response.status_code
+        if isinstance(code, int) and code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def _encode(self, payload):
+        """Request body and headers of a json upload."""
+        body, headers = encode_body(
+            json.dumps(payload).encode('utf-8'),
+            self.compression if self.compress_requests else None,
+        )
+        return body, {'Content-Type': 'application/json', **headers}
+
+    def _send_one(self, task):
+        body, headers = self._encode(task.meme_struct())
+        response = self._post(f"{self.base_url}/api/upload", headers=headers, data=body)
+        response.raise_for_status()
+        return response.json()
+
+    def _send_batch(self, batch):
+        """Send a batch of upload tasks, completing or rescheduling each one.
+
+        Tasks queued behind a retry of their conversation are held back,
+        and sent once that retry succeeds or is given up.
+        """
+        while batch:
+            batch = self._send_ready([task for task in batch if not self._hold(task)])
+
+    def _hold(self, task):
+        """Hold a task back if an earlier upload of its stream waits for a retry."""
+        with self._held_lock:
+            held = self._held.get(task.stream)
+            if held is None or held[0] is task:
+                return False
+            held[1].append(task)
+            return True
+
+    def _release(self, task):
+        """The tasks held behind `task`, once it no longer blocks its stream."""
+        with self._held_lock:
+            held = self._held.get(task.stream)
+            if held is None or held[0] is not task:
+                return []
+            del self._held[task.stream]
+            return held[1]
+
+    def _send_ready(self, batch):
+        """Send tasks no earlier upload is blocking.
+
+        Returns:
+            The held tasks released by the tasks completed or given up
+        """
+        if self.bulk_endpoint and len(batch) > 1:
+            try:
+                body, headers = self._encode([task.meme_struct() for task in batch])
+                response = self._post(f"{self.base_url}{self.bulk_endpoint}", headers=headers, data=body)
                 response.raise_for_status()
-                
-                res = response.json()
+                logger.debug(f"Bulk upload done: {len(batch)} items")
+                return self._complete(batch)
+            except requests.RequestException as err:
+                logger.warning(f"Bulk upload failed, falling back to single uploads: {err}")
+
+        done = []
+        released = []
+        for task in batch:
+            # an earlier task of its stream failed in this batch
+            if self._hold(task):
+                continue
+            try:
+                res = self._send_one(task)
                 logger.debug(f"Upload done: {res}")
-                
-                event.set()
-                
+                done.append(task)
             except requests.RequestException as err:
                 logger.error(f"Error during upload: {err}")
+                released.extend(self._fail(task, err))
+            except Exception as e:
+                logger.error(f"Unexpected error in upload queue processing: {e}")
+                released.extend(self._fail(task, e))
+        return released + self._complete(done)
+
+    def _complete(self, tasks):
+        """Acknowledge sent tasks.
+
+        Returns:
+            The tasks held behind them
+        """
+        if self.spool is not None:
+            self.spool.ack([t.seq for t in tasks if t.seq is not None])
+        if self.ledger is not None:
+            self.ledger.record(
+                (t.owner, t.bucket, t.filename, t.digest) for t in tasks if t.digest is not None
+            )
+        released = []
+        for task in tasks:
+            if self.cache is not None:
+                _invalidate_uploaded(self.cache, task.owner, task.filename)
+            task.error = None
+            self._settle(task)
+            task.event.set()
+            _notify_ack(task.on_ack)
+            released.extend(self._release(task))
+        return released
+
+    def _backoff(self, attempts):
+        delay = min(self.retry_backoff_max, self.retry_backoff * (2 ** (attempts - 1)))
+        # full jitter keeps retrying workers from hitting the hub in lockstep
+        return random.uniform(0, delay)
+
+    def _fail(self, task, err):
+        """Schedule a retry, or give up on the task once its retries are used.
+
+        Returns:
+            The tasks held behind the task if it was given up
+        """
+        task.attempts += 1
+        task.error = err
+        if self.spool is not None and task.seq is not None:
+            self.spool.record_attempt(task.seq)
+
+        retryable = _is_retryable(err)
+        if task.attempts > self.max_retries or not retryable:
+            # release waiting callers; spooled uploads keep retrying in the background
+            task.event.set()
+            if self.spool is None or not retryable:
+                logger.error(f"Dropping upload {task.owner}/{task.filename} after {task.attempts} attempts: {err}")
+                if self.spool is not None and task.seq is not None:
+                    self.spool.ack([task.seq])
+                self._settle(task)
+                return self._release(task)
+            with self._held_lock:
+                held = self._held.get(task.stream)
+                for blocked in held[1] if held is not None and held[0] is task else []:
+                    blocked.error = err
+                    blocked.event.set()
+        with self._held_lock:
+            self._held.setdefault(task.stream, (task, []))
+        self._schedule_retry(task, self._backoff(task.attempts))
+        return []
+
+    def _schedule_retry(self, task, delay):
+        with self._retry_cond:
+            self._retry_counter += 1
+            heapq.heappush(self._retry_heap, (time.monotonic() + delay, self._retry_counter, task))
+            self._retry_cond.notify()
+
+    def _process_retries(self):
+        while True:
+            with self._retry_cond:
+                while not self._closed and (
+                    not self._retry_heap or self._retry_heap[0][0] > time.monotonic()
+                ):
+                    timeout = self._retry_heap[0][0] - time.monotonic() if self._retry_heap else None
+                    self._retry_cond.wait(timeout)
+                if self._closed:
+                    return
+                _, _, task = heapq.heappop(self._retry_heap)
+            self.upload_queue.put(task)
+
+    def _process_upload_queue(self, upload_queue):
+        while True:
+            batch, stop = self._next_batch(upload_queue)
+            try:
+                if batch:
+                    self._send_batch(batch)
             except Exception as e:
                 logger.error(f"Unexpected error in upload queue processing: {e}")
             finally:
-                self.upload_queue.task_done()
-                time.sleep(0.1)
+                for _ in batch:
+                    upload_queue.task_done()
+                if stop:
+                    upload_queue.task_done()
+            if stop:
+                break
+
+    def close(self):
+        """Stop the upload workers after the queued tasks are sent, and close the session.
+
+        Uploads still waiting for a retry are dropped from memory; with a
+        spool they are replayed by the next client.
+        """
+        for upload_queue in self.upload_queue.queues:
+            upload_queue.put(None)
+        for t in self.upload_threads:
+            t.join()
+        with self._retry_cond:
+            self._closed = True
+            self._retry_cond.notify()
+        self._retry_thread.join()
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+        self.session.close()
+        if self.spool is not None:
+            self.spool.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.ledger is not None:
+            self.ledger.close()
 
     def initialize(self, base_url):
         if self.base_url is None:
             self.base_url = base_url
 
-    def upload_hub(self, owner, filename, msg, bucket: Optional[str] = None, wait=True):
+    def upload_hub(self, owner, filename, msg, bucket: Optional[str] = None, wait=True, dedupe_key=None, on_ack=None):
         """Add upload task to queue, optionally wait for completion
-        
+
+        With a spool configured the upload is durable once this returns,
+        so `wait=False` does not lose data on restart or hub failure.
+        With a ledger configured, an upload the hub already holds is not
+        sent again and returns status "skipped".
+
         Args:
             owner: Owner of the meme
             filename: Name of the file
             msg: Message content
             bucket: Bucket name
             wait: Whether to wait for upload completion
-            
+            dedupe_key: Value the ledger hashes instead of `msg`, for
+                payloads carrying fields that change on every upload
+            on_ack: Called without arguments from an upload worker once
+                the hub acknowledged the upload, or right away if skipped
+
         Returns:
-            If wait=True, returns upload result; if wait=False, returns queue status
+            If wait=True, returns upload result; if wait=False, returns queue status.
+            None if the upload failed.
         """
         try:
-            default_bucket = owner
-            if self.membase_id != "":
-                default_bucket = self.membase_id
-                
-            if bucket is None:
-                if isinstance(msg, str):
-                    try:
-                        msg_dict = json.loads(msg)
-                        bucket = msg_dict.get("name", default_bucket)
-                    except json.JSONDecodeError:
-                        bucket = default_bucket
-                else:    
-                    bucket = default_bucket
-
-            # Create an event object for synchronization
-            event = threading.Event()
-            # Add upload task and event object to queue
-            self.upload_queue.put((owner, bucket, filename, msg, event))
+            bucket = _resolve_bucket(owner, msg, bucket, self.membase_id)
+
+            digest = None
+            if self.ledger is not None:
+                digest = payload_digest(msg if dedupe_key is None else dedupe_key)
+                if _already_uploaded(self.ledger, owner, bucket, filename, digest):
+                    logger.debug(f"Upload skipped, already on hub: {owner}/{filename}")
+                    _notify_ack(on_ack)
+                    return {"status": "skipped", "message": "Already uploaded"}
+
+            seq = None
+            if self.spool is not None:
+                seq = self.spool.append(owner, bucket, filename, msg, digest=digest)
+
+            task = _UploadTask(owner, bucket, filename, msg, seq=seq, digest=digest, on_ack=on_ack)
+            self._queue(task)
             logger.debug(f"Upload task queued: {owner}/{filename}")
-            
+
             if wait:
                 # Wait for upload completion
-                event.wait()
-                return {"status": "completed", "message": "Upload task completed"}
+                task.event.wait()
+                if task.error is None:
+                    return {"status": "completed", "message": "Upload task completed"}
+                if self.spool is not None and _is_retryable(task.error):
+                    return {"status": "spooled", "message": f"Upload failed, retrying in background: {task.error}"}
+                logger.error(f"Upload failed: {task.error}")
+                return None
             else:
                 return {"status": "queued", "message": "Upload task has been queued"}
-                
+
         except Exception as e:
             logger.error(f"Error queueing upload task: {e}")
             return None
 
-    def upload_hub_data(self, owner, filename, data):
-        """Upload meme data to the hub server with multipart form."""
-        try:
-            # Create a BytesIO stream from the data to simulate a file-like object
-            file_stream = BytesIO(data)
-            
-            # Prepare the files and data for the multipart request
-            files = {
-                'file': (filename, file_stream, 'application/octet-stream')
-            }
-            data = {
-                'owner': owner
-            }
-
-            # Send the POST request to upload data
-            response = requests.post(f"{self.base_url}/api/uploadData", files=files, data=data)
+    def upload_hub_data(self, owner, filename, data: Blob):
+        """Upload meme data to the hub server with multipart form.
 
-            # Raise an exception if the request was not successful
-            response.raise_for_status()
+        `data` is bytes or a binary file object. Blobs larger than
+        `chunk_size` are read and uploaded part by part, each part
+        compressed, then a manifest is stored under `filename`;
+        `download_hub` and `download_hub_stream` put them back together.
+        Smaller blobs are compressed as well, behind a header naming the codec.
+        With a ledger, parts the hub already acknowledged are skipped, so
+        uploading the same blob again resumes an interrupted upload.
 
-            # Parse the response JSON into a dictionary
-            res = response.json()
-
-            # Log the upload completion
+        Returns:
+            The hub response of the blob, or of its manifest. None if the upload failed.
+        """
+        try:
+            if not self.chunk_size:
+                blob = data if isinstance(data, (bytes, bytearray, memoryview)) else data.read()
+                res = self._post_data(owner, filename, encode_blob(blob, self.compression))
+            else:
+                chunks = iter_chunks(data, self.chunk_size)
+                first = next(chunks, b"")
+                second = next(chunks, None)
+                if second is None:
+                    res = self._post_data(owner, filename, encode_blob(first, self.compression))
+                else:
+                    res = self._upload_chunked(owner, filename, itertools.chain([first, second], chunks))
             logger.debug(f"Upload done: {res}")
-
-            # Optionally return the response if needed
             return res
-
         except requests.RequestException as err:
             logger.error(f"Error during upload: {err}")
             return None
 
+    def _post_data(self, owner, filename, blob):
+        # Create a BytesIO stream from the data to simulate a file-like object
+        files = {
+            'file': (filename, BytesIO(blob), 'application/octet-stream')
+        }
+        response = self._post(f"{self.base_url}/api/uploadData", files=files, data={'owner': owner})
+        response.raise_for_status()
+        if self.cache is not None:
+            self.cache.invalidate(HubCache.download_key(owner, filename))
+        return response.json()
+
+    def _upload_chunked(self, owner, filename, chunks):
+        writer = ChunkWriter(self.compression, self.chunk_size)
+        skipped = 0
+        for chunk in chunks:
+            name = part_name(filename, writer.parts)
+            part, digest = writer.add(chunk)
+            if self.ledger is not None and self.ledger.get(owner, _DATA_BUCKET, name) == digest:
+                skipped += 1
+                continue
+            self._with_retries(self._post_data, owner, name, part)
+            if self.ledger is not None:
+                self.ledger.record([(owner, _DATA_BUCKET, name, digest)])
+        if skipped:
+            logger.info(f"Resumed upload of {owner}/{filename}: {skipped} of {writer.parts} parts already on hub")
+        return self._with_retries(self._post_data, owner, filename, writer.manifest())
+
+    def _with_retries(self, fn, *args):
+        """Call `fn`, retrying retryable request errors with backoff."""
+        attempts = 0
+        while True:
+            try:
+                return fn(*args)
+            except requests.RequestException as err:
+                attempts += 1
+                if not self._should_retry(err, attempts):
+                    raise
+                time.sleep(self._backoff(attempts))
+
+    def _should_retry(self, err, attempts):
+        """Whether a failed read is retried, spending the retry budget if so."""
+        if attempts > self.max_retries or not _is_retryable(err) or isinstance(err, CircuitOpenError):
+            return False
+        return self.retry_budget.try_retry()
+
     def list_conversations(self, owner):
         """List all conversations for a given owner."""
         # Prepare the form data (URL-encoded parameters)
@@ -146,15 +751,22 @@ class Client:
         encoded_form = urlencode(form_data)
         
         try:    
-            response = requests.post(f"{self.base_url}/api/conversation", data=encoded_form, headers={'Content-Type': 'application/x-www-form-urlencoded'})
-            response.raise_for_status()
-            return response.json()
+            def fetch():
+                response = self._post(f"{self.base_url}/api/conversation", data=encoded_form, headers={'Content-Type': 'application/x-www-form-urlencoded'})
+                response.raise_for_status()
+                return response
+
+            return self._with_retries(fetch).json()
         except requests.RequestException as err:
             logger.error(f"Error during list conversations: {err}")
             return None
     
     def get_conversation(self, owner, conversation_id):
-        """Get a conversation for a given owner and conversation id."""
+        """Get a conversation for a given owner and conversation id.
+
+        Served from the local cache when one is configured and the
+        conversation is unchanged on the hub.
+        """
         # Prepare the form data (URL-encoded parameters)
         form_data = {
             'owner': owner,
@@ -163,17 +775,29 @@ class Client:
             
         # URL encode the form data
         encoded_form = urlencode(form_data)
-        
-        try:    
-            response = requests.post(f"{self.base_url}/api/conversation", data=encoded_form, headers={'Content-Type': 'application/x-www-form-urlencoded'})
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as err:
+
+        def fetch(headers):
+            headers = {'Content-Type': 'application/x-www-form-urlencoded', **headers}
+            return self._post(f"{self.base_url}/api/conversation", data=encoded_form, headers=headers)
+
+        try:
+            content = self._read_through(
+                HubCache.conversation_key(owner, conversation_id),
+                fetch,
+                count_of=lambda value: len(json.loads(value)),
+                probe=lambda count: self._exists(owner, f"{conversation_id}_{count}"),
+            )
+            return json.loads(content)
+        except (requests.RequestException, ValueError) as err:
             logger.error(f"Error during get conversation: {err}")
             return None
 
     def download_hub(self, owner, filename):
-        """Download meme data from the hub server."""
+        """Download meme data from the hub server.
+
+        Served from the local cache when one is configured and the
+        blob is unchanged on the hub.
+        """
         try:
             # Prepare the form data (URL-encoded parameters)
             form_data = {
@@ -186,22 +810,202 @@ class Client:
             
             # Log the download action
             logger.debug(f"Downloading {owner} {filename} from hub {self.base_url}")
-            
-            # Send the POST request with the encoded form data
-            response = requests.post(f"{self.base_url}/api/download", data=encoded_form, headers={'Content-Type': 'application/x-www-form-urlencoded'})
-            
-            # Raise an exception if the request was not successful
-            response.raise_for_status()
-            
-            # Return the response content (bytes)
-            return response.content
-        
-        except requests.RequestException as err:
+
+            def fetch(headers):
+                headers = {'Content-Type': 'application/x-www-form-urlencoded', **headers}
+                return self._post(f"{self.base_url}/api/download", data=encoded_form, headers=headers)
+
+            # Return the response content (bytes); chunked blobs only have their manifest cached
+            content = self._read_through(HubCache.download_key(owner, filename), fetch)
+            manifest = parse_manifest(content)
+            if manifest is None:
+                return decode_blob(content)
+            return b"".join(self._iter_parts(owner, filename, manifest))
+
+        except (requests.RequestException, ValueError) as err:
             logger.error(f"Error during download: {err}")
             return None
 
+    def download_hub_stream(self, owner, filename, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """Download meme data from the hub server as chunks of about `chunk_size` bytes.
+
+        The blob is never held in memory as a whole, and is not cached. A
+        download cut off midway is resumed from the last byte received.
+
+        Raises:
+            requests.RequestException: If the hub cannot be reached after retries
+            ValueError: If a chunked blob does not match its manifest
+        """
+        sniffer, decoder = ManifestSniffer(), BlobDecoder()
+        for piece in self._stream_download(owner, filename, chunk_size):
+            # a compressed single-part blob inflates, so it is split again
+            yield from iter_chunks(decoder.feed(sniffer.feed(piece)), chunk_size)
+        rest, manifest = sniffer.finish()
+        if manifest is not None:
+            yield from self._iter_parts(owner, filename, manifest, chunk_size)
+        else:
+            yield from iter_chunks(decoder.feed(rest) + decoder.finish(), chunk_size)
+
+    def _stream_download(self, owner, filename, chunk_size):
+        encoded_form = urlencode({'id': filename, 'owner': owner})
+        received = 0
+        attempts = 0
+        while True:
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+            if received:
+                # byte ranges are only meaningful on the identity encoding
+                headers.update({'Range': f"bytes={received}-", 'Accept-Encoding': 'identity'})
+            try:
+                response = self._post(
+                    f"{self.base_url}/api/download", data=encoded_form, headers=headers, stream=True,
+                )
+                try:
+                    response.raise_for_status()
+                    # a hub ignoring the range sends the whole blob again
+                    skip = received if response.status_code != 206 else 0
+                    for piece in response.iter_content(chunk_size):
+                        if skip:
+                            dropped = min(skip, len(piece))
+                            piece = piece[dropped:]
+                            skip -= dropped
+                            if not piece:
+                                continue
+                        received += len(piece)
+                        yield piece
+                finally:
+                    response.close()
+                return
+            except requests.RequestException as err:
+                attempts += 1
+                if not self._should_retry(err, attempts):
+                    raise
+                logger.warning(f"Download of {owner}/{filename} interrupted at {received} bytes, resuming: {err}")
+                time.sleep(self._backoff(attempts))
+
+    def _download_part(self, owner, name):
+        response = self._post(
+            f"{self.base_url}/api/download",
+            data=urlencode({'id': name, 'owner': owner}),
+            headers={'Content-Type': 'application/x-www-form-urlencoded'},
+        )
+        response.raise_for_status()
+        return response.content
+
+    def _iter_parts(self, owner, filename, manifest, chunk_size=None):
+        """Raw chunks of a chunked blob, fetched part by part."""
+        reader = ChunkReader(manifest)
+        for name in reader.part_names(filename):
+            chunk = reader.read(self._with_retries(self._download_part, owner, name))
+            if chunk_size:
+                yield from iter_chunks(chunk, chunk_size)
+            else:
+                yield chunk
+        reader.check()
+
+    def _read_through(self, key, fetch, count_of=None, probe=None):
+        """Fetch a hub response through the local cache.
+
+        A cached entry younger than `cache_max_age` is returned as is.
+        Otherwise it is revalidated with its ETag / Last-Modified, or, if
+        the hub sent neither, by `probe(count)` reporting whether an item
+        past the cached message count exists. A stale entry is served if
+        the hub cannot be reached.
+
+        Args:
+            key: Cache key
+            fetch: Callable taking extra request headers and returning a response
+            count_of: Callable returning the message count of a response body
+            probe: Callable taking the cached count, returning False if nothing was added
+
+        Returns:
+            The response body (bytes)
+        """
+        if self.cache is None:
+            return self._fetch(fetch, {}).content
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            if entry.is_fresh(self.cache_max_age):
+                return entry.value
+            headers = entry.conditional_headers()
+            if not headers and probe is not None and entry.count is not None:
+                try:
+                    if probe(entry.count) is False:
+                        self.cache.touch(key)
+                        return entry.value
+                except requests.RequestException:
+                    pass
+        else:
+            headers = {}
+
+        try:
+            # with a cached entry to fall back on, failures are not worth retrying
+            response = self._fetch(fetch, headers, retry=entry is None)
+            if response.status_code == 304 and entry is not None:
+                self.cache.touch(key)
+                return entry.value
+        except requests.RequestException as err:
+            if entry is not None:
+                logger.warning(f"Hub request failed, serving cached {key}: {err}")
+                return entry.value
+            raise
+
+        content = response.content
+        self.cache.put(
+            key,
+            content,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            count=count_of(content) if count_of is not None else None,
+        )
+        return content
+
+    def _fetch(self, fetch, headers, retry=True):
+        """Send a read, hedged and optionally retried, raising on an error status."""
+        def attempt():
+            response = self._hedged(fetch, headers)
+            response.raise_for_status()
+            return response
+        return self._with_retries(attempt) if retry else attempt()
+
+    def _hedged(self, fetch, headers):
+        """`fetch(headers)`, duplicated if it has not answered within `hedge_after`.
+
+        The first successful answer wins; the other request is left to finish.
+        """
+        if self._hedge_pool is None:
+            return fetch(headers)
+        first = self._hedge_pool.submit(fetch, headers)
+        try:
+            return first.result(timeout=self.hedge_after)
+        except concurrent.futures.TimeoutError:
+            pass
+        second = self._hedge_pool.submit(fetch, headers)
+        done, _ = concurrent.futures.wait((first, second), return_when=concurrent.futures.FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is None:
+            return winner.result()
+        return (second if winner is first else first).result()
+
+    def _exists(self, owner, filename):
+        """Whether the hub has the item: True, False, or None if it could not tell."""
+        response = self._post(
+            f"{self.base_url}/api/download",
+            data=urlencode({'id': filename, 'owner': owner}),
+            headers={'Content-Type': 'application/x-www-form-urlencoded'},
+        )
+        if response.status_code == 404:
+            return False
+        if response.ok:
+            return True
+        return None
+
     def wait_for_upload_queue(self):
-        """Wait for all tasks in the upload queue to complete"""
+        """Wait for all tasks in the upload queue to complete
+
+        Uploads waiting in backoff for a retry, and those held behind
+        them, are not awaited.
+        """
         self.upload_queue.join()
 
 he = os.getenv('MEMBASE_HUB', 'https://testnet.hub.membase.io')      
@@ -0,0 +1,98 @@
+"""Local ledger of the hub uploads already acknowledged, keyed by content hash."""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Iterable, Optional, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def payload_digest(msg: Any) -> str:
+    """sha256 of an upload payload; dicts hash the same whatever their key order."""
+    if isinstance(msg, str):
+        data = msg
+    else:
+        data = json.dumps(msg, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class UploadLedger:
+    """Content hash of the last upload the hub acknowledged per owner/bucket/id.
+
+    The client looks an upload up before queueing it and skips it when
+    the hub already holds the same payload, so re-adding memories after a
+    reload or re-ingesting documents costs no network traffic. Entries
+    are only written on acknowledgement, so a failed or dropped upload
+    is never suppressed.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite file path of the ledger
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ledger ("
+            " owner TEXT NOT NULL,"
+            " bucket TEXT NOT NULL,"
+            " filename TEXT NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " acked_at REAL NOT NULL,"
+            " PRIMARY KEY (owner, bucket, filename))"
+        )
+
+    def get(self, owner: str, bucket: str, filename: str) -> Optional[str]:
+        """Digest of the last acknowledged upload of the item, None if unknown."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest FROM ledger WHERE owner = ? AND bucket = ? AND filename = ?",
+                (owner, bucket, filename),
+            ).fetchone()
+        return row[0] if row else None
+
+    def record(self, entries: Iterable[Tuple[str, str, str, str]]) -> None:
+        """Record acknowledged uploads, as (owner, bucket, filename, digest)."""
+        now = time.time()
+        rows = [(owner, bucket, filename, digest, now) for owner, bucket, filename, digest in entries]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ledger (owner, bucket, filename, digest, acked_at) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.execute("COMMIT")
+
+    def forget(self, owner: str, bucket: str, filename: str) -> None:
+        """Drop the entry of an item, e.g. while a different payload is in flight."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM ledger WHERE owner = ? AND bucket = ? AND filename = ?",
+                (owner, bucket, filename),
+            )
+
+    def clear(self) -> None:
+        """Forget every upload, so everything is sent again."""
+        with self._lock:
+            self._conn.execute("DELETE FROM ledger")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM ledger").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
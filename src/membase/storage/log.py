@@ -0,0 +1,154 @@
+"""Append-only record log with an offset index, read through mmap."""
+import mmap
+import os
+import struct
+import threading
+from array import array
+from typing import Iterable, List, Optional
+
+import logging
+logger = logging.getLogger(__name__)
+
+# one index entry per record: offset and length in the data file
+_ENTRY = struct.Struct("<QI")
+
+
+class AppendLog:
+    """Records appended to `<path>.log`, located by the `<path>.idx` index.
+
+    Opening a log only reads its index, 12 bytes per record, so a large
+    log costs nothing until records are read. Appends write the record,
+    then its index entry, and are O(1). Reads go through an mmap of the
+    data file and only touch the requested records. A record whose index
+    entry was not written, e.g. after a crash, is ignored on open.
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        """
+        Args:
+            path: Path of the log without extension
+            fsync: Whether to fsync both files after every append
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.data_path = path + ".log"
+        self.index_path = path + ".idx"
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._offsets = array("Q")
+        self._lengths = array("I")
+        self._data = None
+        self._index = None
+        self._map: Optional[mmap.mmap] = None
+        self._load_index()
+
+    def _load_index(self) -> None:
+        data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "rb") as f:
+            raw = f.read()
+        count = len(raw) // _ENTRY.size
+        for offset, length in _ENTRY.iter_unpack(raw[:count * _ENTRY.size]):
+            if offset + length > data_size:
+                logger.warning(f"Dropping torn records at the end of {self.data_path}")
+                break
+            self._offsets.append(offset)
+            self._lengths.append(length)
+        if len(self._offsets) * _ENTRY.size != len(raw):
+            with open(self.index_path, "r+b") as f:
+                f.truncate(len(self._offsets) * _ENTRY.size)
+
+    def _open(self) -> None:
+        """Open the files for appending. Caller holds the lock."""
+        if self._data is None:
+            self._data = open(self.data_path, "ab")
+            self._index = open(self.index_path, "ab")
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def append(self, record: bytes) -> int:
+        """Append a record and return its position."""
+        with self._lock:
+            self._open()
+            offset = self._data.tell()
+            self._data.write(record)
+            self._data.flush()
+            self._index.write(_ENTRY.pack(offset, len(record)))
+            self._index.flush()
+            if self.fsync:
+                os.fsync(self._data.fileno())
+                os.fsync(self._index.fileno())
+            self._offsets.append(offset)
+            self._lengths.append(len(record))
+            return len(self._offsets) - 1
+
+    def _mapped(self, end: int) -> mmap.mmap:
+        """An mmap covering the first `end` bytes. Caller holds the lock."""
+        if self._map is None or len(self._map) < end:
+            if self._map is not None:
+                self._map.close()
+            with open(self.data_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def read(self, positions: Iterable[int]) -> List[bytes]:
+        """Read the records at the given positions."""
+        positions = list(positions)
+        if not positions:
+            return []
+        with self._lock:
+            end = max(self._offsets[i] + self._lengths[i] for i in positions)
+            data = self._mapped(end)
+            return [data[self._offsets[i]:self._offsets[i] + self._lengths[i]] for i in positions]
+
+    def read_range(self, start: int, end: int) -> List[bytes]:
+        """Read the records in [start, end)."""
+        return self.read(range(start, min(end, len(self._offsets))))
+
+    def rewrite(self, records: Iterable[bytes]) -> None:
+        """Replace the whole log with the given records."""
+        tmp = AppendLog(self.data_path[:-len(".log")] + ".tmp", fsync=self.fsync)
+        tmp.truncate()
+        for record in records:
+            tmp.append(record)
+        tmp.close()
+        with self._lock:
+            self._close_files()
+            os.replace(tmp.data_path, self.data_path)
+            os.replace(tmp.index_path, self.index_path)
+            self._offsets = tmp._offsets
+            self._lengths = tmp._lengths
+
+    def truncate(self) -> None:
+        """Remove every record."""
+        with self._lock:
+            self._close_files()
+            for path in (self.data_path, self.index_path):
+                open(path, "wb").close()
+            self._offsets = array("Q")
+            self._lengths = array("I")
+
+    def _close_files(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._data is not None:
+            self._data.close()
+            self._index.close()
+            self._data = None
+            self._index = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_files()
+
+    def remove(self) -> None:
+        """Close the log and delete its files."""
+        with self._lock:
+            self._close_files()
+            for path in (self.data_path, self.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
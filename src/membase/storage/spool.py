@@ -0,0 +1,127 @@
+"""Durable write-ahead spool for hub uploads, backed by SQLite in WAL mode."""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class UploadSpool:
+    """Append-only local log of pending hub uploads.
+
+    Every upload is appended before it is handed to the upload workers,
+    and acknowledged once the hub accepts it. Acknowledged entries are
+    only marked; `compact` removes them in bulk and truncates the WAL.
+    Unacknowledged entries survive restarts and are replayed by the client.
+    Each append is synced to disk before it returns, so it also survives
+    a power loss.
+    """
+
+    def __init__(self, path: str, compact_every: int = 1000):
+        """
+        Args:
+            path: SQLite file path of the spool
+            compact_every: Run compaction after this many acknowledgements
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._acked_since_compact = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # FULL syncs the WAL on every commit: NORMAL may lose the last
+        # appends on power loss, though they were acknowledged to the caller
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " owner TEXT NOT NULL,"
+            " bucket TEXT NOT NULL,"
+            " filename TEXT NOT NULL,"
+            " msg TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " acked INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " digest TEXT)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(spool)")]
+        if "digest" not in columns:
+            # spools written before the ledger digest was kept
+            self._conn.execute("ALTER TABLE spool ADD COLUMN digest TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS spool_pending ON spool (acked, seq)")
+
+    def append(self, owner: str, bucket: str, filename: str, msg: Any, digest: Optional[str] = None) -> int:
+        """Durably append an upload and return its sequence number.
+
+        `msg` is stored json encoded, so both strings and dicts round-trip.
+        `digest` is the ledger digest of the upload, kept for the replay.
+        """
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO spool (owner, bucket, filename, msg, created_at, digest) VALUES (?, ?, ?, ?, ?, ?)",
+                (owner, bucket, filename, json.dumps(msg), time.time(), digest),
+            )
+            return cur.lastrowid
+
+    def ack(self, seqs: List[int]) -> None:
+        """Mark entries as acknowledged by the hub."""
+        if not seqs:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("UPDATE spool SET acked = 1 WHERE seq = ?", [(s,) for s in seqs])
+            self._conn.execute("COMMIT")
+            self._acked_since_compact += len(seqs)
+            should_compact = self._acked_since_compact >= self.compact_every
+        if should_compact:
+            self.compact()
+
+    def record_attempt(self, seq: int) -> None:
+        """Record a failed delivery attempt."""
+        with self._lock:
+            self._conn.execute("UPDATE spool SET attempts = attempts + 1 WHERE seq = ?", (seq,))
+
+    def pending(self, limit: Optional[int] = None) -> List[Tuple[int, str, str, str, Any, int, Optional[str]]]:
+        """Return unacknowledged entries in append order.
+
+        Returns:
+            List of (seq, owner, bucket, filename, msg, attempts, digest)
+        """
+        sql = "SELECT seq, owner, bucket, filename, msg, attempts, digest FROM spool WHERE acked = 0 ORDER BY seq"
+        params = ()
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = (limit,)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [(seq, owner, bucket, filename, json.loads(msg), attempts, digest)
+                for seq, owner, bucket, filename, msg, attempts, digest in rows]
+
+    def pending_count(self) -> int:
+        """Number of unacknowledged entries."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM spool WHERE acked = 0").fetchone()[0]
+
+    def compact(self) -> int:
+        """Remove acknowledged entries and truncate the WAL.
+
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM spool WHERE acked = 1")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._acked_since_compact = 0
+        logger.debug(f"Spool compacted: {cur.rowcount} entries removed")
+        return cur.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
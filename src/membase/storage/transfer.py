@@ -0,0 +1,296 @@
+"""Compression and chunking of hub payloads.
+
+Blobs larger than the chunk size are uploaded as numbered parts, each
+compressed on its own, followed by a small json manifest stored under
+the blob name. Readers recognize the manifest and fetch the parts, so a
+blob never has to be held in memory as a whole.
+
+Blobs uploaded in a single part are compressed with the same codec,
+behind a short header naming it, so readers know how to decode them.
+"""
+import gzip
+import hashlib
+import json
+import zlib
+from typing import BinaryIO, Iterator, Optional, Tuple, Union
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+CODECS = ("zstd", "gzip", "none")
+
+# manifests start with this key, anything else is a plain blob
+MANIFEST_PREFIX = b'{"membase_chunked": '
+MANIFEST_VERSION = 1
+
+# manifests are a few hundred bytes, anything bigger is not one
+_MAX_MANIFEST_BYTES = 64 * 1024
+
+# compressed single-part blobs start with this, then the codec and a newline
+BLOB_HEADER_PREFIX = b"\x00membase-codec:"
+_MAX_BLOB_HEADER_BYTES = len(BLOB_HEADER_PREFIX) + 16
+
+# single-part blobs smaller than this are stored as is, compression would not pay off
+_MIN_COMPRESSED_BLOB = 1024
+
+Blob = Union[bytes, bytearray, memoryview, BinaryIO]
+
+
+def default_codec() -> str:
+    """zstd if `zstandard` is installed, gzip otherwise."""
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def check_codec(codec: str) -> str:
+    """The codec to use for `codec`, gzip in place of zstd without `zstandard`."""
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression {codec}, available ones are {list(CODECS)}")
+    if codec == "zstd" and zstandard is None:
+        logger.warning("zstd compression requires the zstandard package, using gzip")
+        return "gzip"
+    return codec
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == "gzip":
+        # level 6 is most of the gain of 9 at a fraction of its cost
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    return data
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("the blob is zstd compressed, install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "gzip":
+        return gzip.decompress(data)
+    return data
+
+
+def encode_body(body: bytes, codec: Optional[str], min_bytes: int = 1024) -> Tuple[bytes, dict]:
+    """Compress a request body for a hub accepting `Content-Encoding`.
+
+    Bodies under `min_bytes` are sent as is, compression would not pay off.
+
+    Returns:
+        (body, extra headers)
+    """
+    if not codec or codec == "none" or len(body) < min_bytes:
+        return body, {}
+    return compress(body, codec), {"Content-Encoding": codec}
+
+
+def encode_blob(blob: bytes, codec: str) -> bytes:
+    """A single-part blob as stored on hub, compressed behind a header
+    naming `codec`, or as is when small or not made smaller by it."""
+    blob = bytes(blob)
+    if blob.startswith(BLOB_HEADER_PREFIX):
+        # would be mistaken for an encoded blob, so it gets a header too
+        return BLOB_HEADER_PREFIX + b"none\n" + blob
+    if codec == "none" or len(blob) < _MIN_COMPRESSED_BLOB:
+        return blob
+    encoded = BLOB_HEADER_PREFIX + codec.encode("ascii") + b"\n" + compress(blob, codec)
+    return encoded if len(encoded) < len(blob) else blob
+
+
+def _split_blob_header(content: bytes) -> Tuple[Optional[str], int]:
+    """The codec of an encoded blob and where its payload starts, (None, 0) for a plain blob."""
+    if not content.startswith(BLOB_HEADER_PREFIX):
+        return None, 0
+    end = content.find(b"\n", len(BLOB_HEADER_PREFIX), _MAX_BLOB_HEADER_BYTES)
+    if end < 0:
+        return None, 0
+    codec = content[len(BLOB_HEADER_PREFIX):end].decode("ascii", "replace")
+    if codec not in CODECS:
+        return None, 0
+    return codec, end + 1
+
+
+def decode_blob(content: bytes) -> bytes:
+    """The original bytes of a single-part blob stored by `encode_blob`."""
+    codec, start = _split_blob_header(content)
+    if codec is None:
+        return content
+    return decompress(content[start:], codec)
+
+
+def iter_chunks(data: Blob, chunk_size: int) -> Iterator[bytes]:
+    """Split bytes or a binary file object into chunks of `chunk_size`."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start:start + chunk_size])
+        return
+    while True:
+        chunk = data.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def part_name(filename: str, index: int) -> str:
+    """Hub id of the `index`-th part of a chunked blob."""
+    return f"{filename}.part{index:06d}"
+
+
+def make_manifest(size: int, parts: int, codec: str, sha256: str, chunk_size: int) -> bytes:
+    # the version key goes first, readers recognize a manifest by it
+    return json.dumps({
+        "membase_chunked": MANIFEST_VERSION,
+        "size": size,
+        "parts": parts,
+        "chunk_size": chunk_size,
+        "codec": codec,
+        "sha256": sha256,
+    }).encode("utf-8")
+
+
+def looks_like_manifest(head: bytes) -> bool:
+    """Whether a blob starting with `head` may be a manifest."""
+    n = min(len(head), len(MANIFEST_PREFIX))
+    return head[:n] == MANIFEST_PREFIX[:n]
+
+
+def parse_manifest(content: bytes) -> Optional[dict]:
+    """The manifest of a chunked blob, None for a plain blob."""
+    if len(content) > _MAX_MANIFEST_BYTES or not content.startswith(MANIFEST_PREFIX):
+        return None
+    try:
+        manifest = json.loads(content)
+    except ValueError:
+        return None
+    if manifest.get("membase_chunked") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+class ChunkWriter:
+    """Tracks the parts of a blob being uploaded and builds its manifest."""
+
+    def __init__(self, codec: str, chunk_size: int):
+        self.codec = codec
+        self.chunk_size = chunk_size
+        self.size = 0
+        self.parts = 0
+        self._sha256 = hashlib.sha256()
+
+    def add(self, chunk: bytes) -> Tuple[bytes, str]:
+        """Account for the next raw chunk.
+
+        Returns:
+            (compressed part, digest of the part for the upload ledger)
+        """
+        self.size += len(chunk)
+        self.parts += 1
+        self._sha256.update(chunk)
+        # the codec is part of the digest, a part stored with another codec is not reusable
+        return compress(chunk, self.codec), f"{self.codec}:{hashlib.sha256(chunk).hexdigest()}"
+
+    def manifest(self) -> bytes:
+        return make_manifest(self.size, self.parts, self.codec, self._sha256.hexdigest(), self.chunk_size)
+
+
+class ChunkReader:
+    """Decodes the parts of a chunked blob and checks them against its manifest."""
+
+    def __init__(self, manifest: dict):
+        self.manifest = manifest
+        self._sha256 = hashlib.sha256()
+
+    def part_names(self, filename: str) -> Iterator[str]:
+        for index in range(self.manifest["parts"]):
+            yield part_name(filename, index)
+
+    def read(self, part: bytes) -> bytes:
+        """The raw chunk of the next part."""
+        chunk = decompress(part, self.manifest["codec"])
+        self._sha256.update(chunk)
+        return chunk
+
+    def check(self) -> None:
+        """Raise ValueError if the parts read do not add up to the blob."""
+        if self._sha256.hexdigest() != self.manifest["sha256"]:
+            raise ValueError("Chunked blob does not match its manifest checksum")
+
+
+class ManifestSniffer:
+    """Passes a download through, holding back its start while it may be a manifest."""
+
+    def __init__(self):
+        self._head = bytearray()
+        self._sniffing = True
+
+    def feed(self, piece: bytes) -> bytes:
+        """The bytes of a plain blob that can be handed on, maybe empty."""
+        if not self._sniffing:
+            return piece
+        self._head += piece
+        if looks_like_manifest(self._head) and len(self._head) <= _MAX_MANIFEST_BYTES:
+            return b""
+        self._sniffing = False
+        head = bytes(self._head)
+        self._head = bytearray()
+        return head
+
+    def finish(self) -> Tuple[bytes, Optional[dict]]:
+        """Once the download is over: (bytes still held back, manifest or None)."""
+        head = bytes(self._head)
+        self._head = bytearray()
+        if self._sniffing:
+            manifest = parse_manifest(head)
+            if manifest is not None:
+                return b"", manifest
+        return head, None
+
+
+class BlobDecoder:
+    """Decodes a single-part blob stored by `encode_blob` as it downloads."""
+
+    def __init__(self):
+        self._head = bytearray()
+        self._sniffing = True
+        self._decompressor = None
+
+    def feed(self, piece: bytes) -> bytes:
+        """The decoded bytes available so far, maybe empty."""
+        if self._sniffing:
+            self._head += piece
+            n = min(len(self._head), len(BLOB_HEADER_PREFIX))
+            if self._head[:n] == BLOB_HEADER_PREFIX[:n] and len(self._head) < _MAX_BLOB_HEADER_BYTES \
+                    and b"\n" not in self._head[len(BLOB_HEADER_PREFIX):]:
+                return b""
+            self._sniffing = False
+            head = bytes(self._head)
+            self._head = bytearray()
+            codec, start = _split_blob_header(head)
+            if codec is None:
+                return head
+            if codec == "zstd":
+                if zstandard is None:
+                    raise ValueError("the blob is zstd compressed, install the zstandard package to read it")
+                self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+            elif codec == "gzip":
+                self._decompressor = zlib.decompressobj(wbits=31)
+            piece = head[start:]
+        if self._decompressor is None:
+            return piece
+        return self._decompressor.decompress(piece)
+
+    def finish(self) -> bytes:
+        """Once the download is over, the decoded bytes still held back."""
+        if self._sniffing:
+            # shorter than a header, a plain blob
+            head = bytes(self._head)
+            self._head = bytearray()
+            return head
+        flush = getattr(self._decompressor, "flush", None)
+        return flush() if flush is not None else b""
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Round-trip benchmark of the serializer codecs, run manually:
+
+    python tests/bench_serialize.py [num_messages]
+"""
+
+import sys
+import time
+
+from membase.memory.message import Message
+from membase.memory.serialize import _CODECS
+
+
+def main(n: int = 100_000) -> None:
+    messages = [
+        Message("user", f"message {i} " * 8, role="user", metadata={"i": i})
+        for i in range(n)
+    ]
+    for name, codec in sorted(_CODECS.items()):
+        start = time.perf_counter()
+        data = codec.dumps(messages)
+        dumped = time.perf_counter()
+        loaded = codec.loads(data)
+        done = time.perf_counter()
+        assert loaded == messages
+        print(
+            f"{name:8s} dumps {dumped - start:6.3f}s  loads {done - dumped:6.3f}s  "
+            f"size {len(data) / 1e6:7.2f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
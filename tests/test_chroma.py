@@ -358,4 +358,181 @@ def test_retrieve_with_filters(kb, sample_documents):
         query="fox",
         metadata_filter={"source": "nonexistent"}
     )
-    assert len(results) == 0 
\ No newline at end of file
+    assert len(results) == 0 
+
+def test_bulk_ingest(test_dir):
+    """Test batched ingest skips existing, repeated and near duplicate documents."""
+    from tests.test_memory import BagOfWords
+
+    kb = ChromaKnowledgeBase(persist_directory=test_dir, embedding_function=BagOfWords())
+    docs = [Document(content=f"document number {i} word{i}") for i in range(25)]
+    docs.append(Document(content="document number 0 word0"))
+
+    stats = kb.add_documents(docs, batch_size=10)
+    assert stats["received"] == 26
+    assert stats["added"] == 25
+    assert stats["existing"] == 1
+    assert stats["docs_per_second"] > 0
+    assert kb.collection.count() == 25
+
+    stats = kb.add_documents(docs[:5], batch_size=10)
+    assert stats["added"] == 0
+    assert stats["existing"] == 5
+
+    # same words in another order embed to the same vector
+    stats = kb.add_documents(
+        [Document(content="word3 3 number document"), Document(content="something else entirely")],
+        strict=True,
+    )
+    assert stats["duplicates"] == 1
+    assert stats["added"] == 1
+
+
+def test_upload_existing_documents(test_dir):
+    """Test documents already in the collection are still handed to the hub."""
+    from unittest.mock import patch
+    from tests.test_memory import BagOfWords
+
+    kb = ChromaKnowledgeBase(
+        persist_directory=test_dir,
+        membase_account="test_user",
+        auto_upload_to_hub=True,
+        embedding_function=BagOfWords(),
+    )
+    docs = [Document(content=f"uploaded text {i}") for i in range(3)]
+    with patch("membase.knowledge.chroma.hub_client") as client:
+        kb.add_documents(docs[:1])
+        stats = kb.add_documents(docs)
+    assert stats["existing"] == 1
+    uploaded = [call.kwargs["filename"] for call in client.upload_hub.call_args_list]
+    assert uploaded == [docs[0].doc_id] + [doc.doc_id for doc in docs]
+
+
+def test_reingest_skipped_by_ledger(test_dir):
+    """Test submitting the same documents again sends nothing to the hub."""
+    from unittest.mock import patch
+    from tests.test_hub import _mock_client
+    from tests.test_memory import BagOfWords
+
+    client = _mock_client(num_workers=1, ledger_path=os.path.join(test_dir, "ledger.db"))
+    kb = ChromaKnowledgeBase(
+        persist_directory=test_dir,
+        membase_account="test_user",
+        auto_upload_to_hub=True,
+        embedding_function=BagOfWords(),
+    )
+    try:
+        with patch("membase.knowledge.chroma.hub_client", client):
+            kb.add_documents([Document(content="ledger text", metadata={"source": "a"}), Document(content="bare")])
+            assert client.session.post.call_count == 2
+
+            # fresh objects: new timestamps, metadata not yet stamped with the collection
+            stats = kb.add_documents([Document(content="ledger text", metadata={"source": "a"}), Document(content="bare")])
+            assert stats["existing"] == 2
+            assert client.session.post.call_count == 2
+
+            kb.add_documents(Document(content="ledger text", metadata={"source": "b"}))
+            assert client.session.post.call_count == 3
+    finally:
+        client.close()
+
+
+def test_embedding_cache(test_dir):
+    """Test identical texts are embedded once across clear, reload and queries."""
+    from tests.test_memory import BagOfWords
+
+    class CountingBagOfWords(BagOfWords):
+        calls = []
+
+        def __call__(self, input):
+            self.calls.extend(input)
+            return super().__call__(input)
+
+    cache = os.path.join(test_dir, "embeddings.db")
+    embedding_function = CountingBagOfWords()
+    kb = ChromaKnowledgeBase(
+        persist_directory=test_dir,
+        embedding_function=embedding_function,
+        embedding_cache=cache,
+        embedding_workers=2,
+        embedding_batch_size=3,
+    )
+    docs = [Document(content=f"cached text {i}") for i in range(10)]
+    assert kb.add_documents(docs)["added"] == 10
+    assert len(embedding_function.calls) == 10
+
+    kb.clear()
+    kb.add_documents([Document(content=f"cached text {i}") for i in range(10)])
+    assert kb.retrieve("cached text 3", top_k=1)[0].content == "cached text 3"
+    kb.retrieve("cached text 3", top_k=1)
+    assert len(embedding_function.calls) == 10
+
+    reloaded = ChromaKnowledgeBase(
+        persist_directory=test_dir,
+        embedding_function=embedding_function,
+        embedding_cache=cache,
+    )
+    reloaded.embed(["cached text 1", "something new"])
+    assert embedding_function.calls[10:] == ["something new"]
+
+
+def test_exists_and_stats_without_full_scan(test_dir):
+    """Test exists and get_stats only look up the given ids and the count."""
+    from unittest.mock import patch
+    from tests.test_memory import BagOfWords
+
+    kb = ChromaKnowledgeBase(persist_directory=test_dir, embedding_function=BagOfWords())
+    kb.add_documents([Document(content=f"doc {i}", doc_id=f"id{i}") for i in range(3)])
+
+    with patch.object(kb.collection, "get", wraps=kb.collection.get) as get:
+        assert kb.exists("id1") is True
+        assert kb.exists(["id0", "missing"]) == [True, False]
+        assert kb.get_stats()["documents"] == 3
+        assert all(call.kwargs.get("ids") for call in get.call_args_list)
+
+    kb.delete_documents(["id0", "missing"])
+    assert kb.get_stats()["documents"] == 2
+    kb.add_documents(Document(content="doc 9", doc_id="id9"))
+    assert kb.get_stats()["documents"] == 3
+    kb.clear()
+    assert kb.get_stats()["documents"] == 0
+
+
+def test_count_sees_other_writers(test_dir):
+    """Test the cached count catches up with other writers once count_ttl passes."""
+    from tests.test_memory import BagOfWords
+
+    reader = ChromaKnowledgeBase(persist_directory=test_dir, embedding_function=BagOfWords(), count_ttl=60)
+    writer = ChromaKnowledgeBase(persist_directory=test_dir, embedding_function=BagOfWords())
+    assert reader.count() == 0
+    writer.add_documents([Document(content=f"doc {i}", doc_id=f"id{i}") for i in range(3)])
+    # within count_ttl the cached value is served
+    assert reader.count() == 0
+    reader._counted_at -= 60
+    assert reader.count() == 3
+
+
+def test_paginated_documents(test_dir):
+    """Test pages are read from Chroma with limit and offset, not sliced from a full scan."""
+    from unittest.mock import patch
+    from tests.test_memory import BagOfWords
+
+    kb = ChromaKnowledgeBase(persist_directory=test_dir, embedding_function=BagOfWords())
+    kb.add_documents([Document(content=f"doc {i}", metadata={"i": i}, doc_id=f"id{i}") for i in range(7)])
+
+    with patch.object(kb.collection, "get", wraps=kb.collection.get) as get:
+        page = kb.get_all_documents(offset=2, limit=3)
+        assert [doc.doc_id for doc in page] == ["id2", "id3", "id4"]
+        assert page[0].content == "doc 2" and page[0].metadata["i"] == 2
+        assert get.call_args.kwargs["limit"] == 3 and get.call_args.kwargs["offset"] == 2
+
+        assert kb.get_all_documents(offset=10) == []
+        assert kb.get_all_documents(limit=0) == []
+        ids_only = kb.get_all_documents(limit=2, include=[])
+        assert [(doc.doc_id, doc.content) for doc in ids_only] == [("id0", ""), ("id1", "")]
+
+        get.reset_mock()
+        docs = list(kb.iter_documents(batch_size=3))
+        assert [doc.doc_id for doc in docs] == [f"id{i}" for i in range(7)]
+        assert all(call.kwargs["limit"] == 3 for call in get.call_args_list)
+        assert get.call_count == 3
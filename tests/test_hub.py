@@ -0,0 +1,669 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the hub client, with the http session mocked out
+"""
+
+import asyncio
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qsl
+
+import httpx
+import requests
+
+from membase.storage.async_hub import AsyncClient, AsyncHubUnavailableError
+from membase.storage.breaker import CircuitBreaker, RetryBudget
+from membase.storage.cache import HubCache
+from membase.storage.hub import Client, _UploadTask
+from membase.storage.ledger import UploadLedger
+from membase.storage.spool import UploadSpool
+from membase.storage.transfer import BLOB_HEADER_PREFIX, iter_chunks, parse_manifest
+
+
+def _ok_response(payload=None):
+    response = MagicMock()
+    response.raise_for_status.return_value = None
+    response.json.return_value = payload if payload is not None else {"ok": True}
+    return response
+
+
+def _response(status=200, content=b"", headers=None):
+    response = MagicMock()
+    response.status_code = status
+    response.ok = status < 400
+    response.content = content
+    response.headers = headers or {}
+    if status >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(response=response)
+    return response
+
+
+def _mock_client(**kwargs) -> Client:
+    """Create a client whose pooled session is a mock from the start."""
+    with patch("membase.storage.hub.requests.Session") as session_cls:
+        session_cls.return_value.post.return_value = _ok_response()
+        return Client("http://hub.test", **kwargs)
+
+
+class _FakeHub:
+    """In-memory stand-in for the uploadData and download endpoints."""
+
+    def __init__(self):
+        self.blobs = {}
+        self.uploads = []
+
+    def post(self, url, data=None, files=None, headers=None, stream=False, timeout=None):
+        if url.endswith("/api/uploadData"):
+            name, blob, _ = files["file"]
+            self.blobs[name] = blob.read()
+            self.uploads.append(name)
+            return _ok_response()
+        content = self.blobs.get(dict(parse_qsl(data))["id"])
+        if content is None:
+            return _response(status=404)
+        response = _response(content=content)
+        response.iter_content.side_effect = lambda size: iter_chunks(content, size)
+        return response
+
+
+class HubClientUploadTest(unittest.TestCase):
+    """
+    Test cases for the batched upload workers
+    """
+
+    def make_client(self, **kwargs) -> Client:
+        client = _mock_client(**kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_upload_wait(self) -> None:
+        """Test upload_hub(wait=True) returns once the item is sent"""
+        client = self.make_client(num_workers=1)
+        res = client.upload_hub("owner", "conv_0", json.dumps({"name": "alice"}))
+        self.assertEqual(res["status"], "completed")
+
+        args, kwargs = client.session.post.call_args
+        self.assertEqual(args[0], "http://hub.test/api/upload")
+        sent = json.loads(kwargs["data"])
+        self.assertEqual(sent["Owner"], "owner")
+        self.assertEqual(sent["Bucket"], "alice")
+        self.assertEqual(sent["ID"], "conv_0")
+
+    def test_many_uploads_no_wait(self) -> None:
+        """Test queued uploads are all sent by concurrent workers"""
+        client = self.make_client(num_workers=3, batch_size=8, batch_wait_ms=5)
+        for i in range(50):
+            client.upload_hub("owner", f"conv_{i}", "msg", bucket="b", wait=False)
+        client.wait_for_upload_queue()
+
+        ids = {json.loads(c.kwargs["data"])["ID"] for c in client.session.post.call_args_list}
+        self.assertEqual(ids, {f"conv_{i}" for i in range(50)})
+
+    def test_bulk_endpoint(self) -> None:
+        """Test batches go to the bulk endpoint and every item event is set"""
+        client = self.make_client(num_workers=1, batch_size=10, batch_wait_ms=200, bulk_endpoint="/api/uploadBatch")
+        tasks = [_UploadTask("owner", "b", f"conv_{i}", "msg") for i in range(5)]
+        for task in tasks:
+            client.upload_queue.put(task)
+        client.wait_for_upload_queue()
+
+        self.assertTrue(all(t.event.is_set() for t in tasks))
+        args, kwargs = client.session.post.call_args_list[0]
+        self.assertEqual(args[0], "http://hub.test/api/uploadBatch")
+        self.assertEqual(len(json.loads(kwargs["data"])), 5)
+
+    def test_retry_then_success(self) -> None:
+        """Test a failed post is retried with backoff"""
+        client = self.make_client(num_workers=1, max_retries=3, retry_backoff=0.01)
+        client.session.post.side_effect = [requests.ConnectionError("down"), _ok_response()]
+        res = client.upload_hub("owner", "conv_0", "msg", bucket="b")
+        self.assertEqual(res["status"], "completed")
+        self.assertEqual(client.session.post.call_count, 2)
+
+    def test_on_ack(self) -> None:
+        """Test the acknowledgement callback runs only for uploads the hub accepted"""
+        client = self.make_client(num_workers=1, max_retries=0)
+        acked = []
+        client.upload_hub("owner", "conv_0", "msg", bucket="b", on_ack=lambda: acked.append(0))
+        client.session.post.side_effect = requests.ConnectionError("down")
+        self.assertIsNone(client.upload_hub("owner", "conv_1", "msg", bucket="b", on_ack=lambda: acked.append(1)))
+        self.assertEqual(acked, [0])
+
+    def test_retry_keeps_conversation_order(self) -> None:
+        """Test the uploads of a conversation reach the hub in order when one is retried"""
+        client = self.make_client(num_workers=4, batch_size=4, batch_wait_ms=1, max_retries=3, retry_backoff=0.05)
+        sent = []
+        failed = set()
+
+        def post(url, data=None, headers=None, timeout=None):
+            item = json.loads(data)["ID"]
+            if item in ("conv_1", "other_0") and item not in failed:
+                failed.add(item)
+                raise requests.ConnectionError("down")
+            sent.append(item)
+            return _ok_response()
+
+        client.session.post.side_effect = post
+        for i in range(9):
+            client.upload_hub("owner", f"conv_{i}", "msg", bucket="b", wait=False)
+            client.upload_hub("owner", f"other_{i}", "msg", bucket="b", wait=False)
+        self.assertEqual(client.upload_hub("owner", "conv_9", "msg", bucket="b")["status"], "completed")
+        self.assertEqual(client.upload_hub("owner", "other_9", "msg", bucket="b")["status"], "completed")
+
+        for prefix in ("conv", "other"):
+            order = [item for item in sent if item.startswith(prefix + "_")]
+            self.assertEqual(order, [f"{prefix}_{i}" for i in range(10)])
+
+    def test_pending_uploads(self) -> None:
+        """Test uploads count as pending per conversation until the hub acknowledges them"""
+        client = self.make_client(num_workers=2)
+        sending = threading.Event()
+        release = threading.Event()
+
+        def post(*args, **kwargs):
+            sending.set()
+            release.wait(5)
+            return _ok_response()
+
+        client.session.post.side_effect = post
+        client.upload_hub("owner", "conv_0", "msg", bucket="b", wait=False)
+        client.upload_hub("owner", "conv_1", "msg", bucket="b", wait=False)
+        sending.wait(5)
+        self.assertEqual(client.pending_uploads("owner", "conv"), 2)
+        self.assertEqual(client.pending_uploads("owner", "other"), 0)
+        release.set()
+        client.wait_for_upload_queue()
+        self.assertEqual(client.pending_uploads("owner", "conv"), 0)
+
+    def test_failure_releases_waiter(self) -> None:
+        """Test wait=True returns None instead of hanging when retries run out"""
+        client = self.make_client(num_workers=1, max_retries=1, retry_backoff=0.01)
+        client.session.post.side_effect = requests.ConnectionError("down")
+        self.assertIsNone(client.upload_hub("owner", "conv_0", "msg", bucket="b"))
+
+
+class UploadSpoolTest(unittest.TestCase):
+    """
+    Test cases for the durable upload spool
+    """
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "spool.db")
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_append_ack_compact(self) -> None:
+        """Test acknowledged entries are removed by compaction"""
+        spool = UploadSpool(self.path)
+        first = spool.append("owner", "b", "conv_0", "msg0")
+        spool.append("owner", "b", "conv_1", {"name": "alice"}, digest="d1")
+        spool.ack([first])
+        self.assertEqual(spool.pending_count(), 1)
+        self.assertEqual(spool.compact(), 1)
+        pending = spool.pending()
+        self.assertEqual(pending[0][3], "conv_1")
+        self.assertEqual(pending[0][4], {"name": "alice"})
+        self.assertEqual(pending[0][6], "d1")
+        # 2 is FULL, appends are synced before they return
+        self.assertEqual(spool._conn.execute("PRAGMA synchronous").fetchone()[0], 2)
+        spool.close()
+
+    def test_replay_after_restart(self) -> None:
+        """Test uploads left in the spool are sent by the next client"""
+        client = _mock_client(num_workers=1, spool_path=self.path, max_retries=0, retry_backoff=60)
+        client.session.post.side_effect = requests.ConnectionError("down")
+        res = client.upload_hub("owner", "conv_0", "msg", bucket="b")
+        self.assertEqual(res["status"], "spooled")
+        client.close()
+
+        client = _mock_client(num_workers=1, spool_path=self.path)
+        client.wait_for_upload_queue()
+        self.assertEqual(client.spool.pending_count(), 0)
+        client.close()
+
+
+class HubCacheTest(unittest.TestCase):
+    """
+    Test cases for the read-through hub cache
+    """
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cache.db")
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_lru_eviction(self) -> None:
+        """Test least recently used entries are evicted over budget"""
+        cache = HubCache(self.path, max_bytes=10)
+        cache.put("a", b"1234")
+        cache.put("b", b"1234")
+        cache.get("a")
+        cache.put("c", b"1234")
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.size_bytes, 8)
+        cache.close()
+
+    def test_etag_revalidation(self) -> None:
+        """Test a 304 answer serves the cached conversation"""
+        client = _mock_client(num_workers=1, cache_path=self.path)
+        self.addCleanup(client.close)
+        client.session.post.return_value = _response(content=b'["m0", "m1"]', headers={"ETag": "v1"})
+        self.assertEqual(client.get_conversation("owner", "conv"), ["m0", "m1"])
+
+        client.session.post.return_value = _response(status=304)
+        self.assertEqual(client.get_conversation("owner", "conv"), ["m0", "m1"])
+        self.assertEqual(client.session.post.call_args.kwargs["headers"]["If-None-Match"], "v1")
+
+        client.session.post.side_effect = requests.ConnectionError("down")
+        self.assertEqual(client.get_conversation("owner", "conv"), ["m0", "m1"])
+
+    def test_count_probe(self) -> None:
+        """Test a conversation without validators is revalidated by probing the next index"""
+        client = _mock_client(num_workers=1, cache_path=self.path)
+        self.addCleanup(client.close)
+        client.session.post.return_value = _response(content=b'["m0", "m1"]')
+        client.get_conversation("owner", "conv")
+
+        client.session.post.return_value = _response(status=404)
+        self.assertEqual(client.get_conversation("owner", "conv"), ["m0", "m1"])
+        probe = client.session.post.call_args
+        self.assertEqual(probe.args[0], "http://hub.test/api/download")
+        self.assertIn("id=conv_2", probe.kwargs["data"])
+
+    def test_upload_invalidates(self) -> None:
+        """Test an acknowledged upload drops the cached conversation"""
+        client = _mock_client(num_workers=1, cache_path=self.path, cache_max_age=3600)
+        self.addCleanup(client.close)
+        client.session.post.return_value = _response(content=b'["m0"]')
+        client.get_conversation("owner", "conv")
+        client.session.post.return_value = _ok_response()
+        client.upload_hub("owner", "conv_1", "m1", bucket="b")
+        self.assertIsNone(client.cache.get(HubCache.conversation_key("owner", "conv")))
+
+
+class UploadLedgerTest(unittest.TestCase):
+    """
+    Test cases for the content-hash ledger of acknowledged uploads
+    """
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "ledger.db")
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_skip_acknowledged(self) -> None:
+        """Test an unchanged payload is not sent again, also by the next client"""
+        client = _mock_client(num_workers=1, ledger_path=self.path)
+        self.assertEqual(client.upload_hub("owner", "conv_0", "msg", bucket="b")["status"], "completed")
+        self.assertEqual(client.upload_hub("owner", "conv_0", "msg", bucket="b")["status"], "skipped")
+        self.assertEqual(client.upload_hub("owner", "conv_0", "msg", bucket="other")["status"], "completed")
+        self.assertEqual(client.upload_hub("owner", "conv_0", "changed", bucket="b")["status"], "completed")
+        self.assertEqual(client.session.post.call_count, 3)
+        client.close()
+
+        client = _mock_client(num_workers=1, ledger_path=self.path)
+        self.assertEqual(client.upload_hub("owner", "conv_0", "changed", bucket="b")["status"], "skipped")
+        self.assertEqual(client.upload_hub("owner", "conv_0", {"b": 1, "a": 2}, bucket="b")["status"], "completed")
+        self.assertEqual(client.upload_hub("owner", "conv_0", {"a": 2, "b": 1}, bucket="b")["status"], "skipped")
+        self.assertEqual(client.session.post.call_count, 1)
+        client.close()
+
+    def test_failed_upload_not_recorded(self) -> None:
+        """Test an upload the hub did not acknowledge is sent again"""
+        client = _mock_client(num_workers=1, ledger_path=self.path, max_retries=0)
+        self.addCleanup(client.close)
+        client.session.post.side_effect = requests.ConnectionError("down")
+        self.assertIsNone(client.upload_hub("owner", "conv_0", "msg", bucket="b"))
+        self.assertEqual(len(client.ledger), 0)
+
+        client.session.post.side_effect = None
+        self.assertEqual(client.upload_hub("owner", "conv_0", "msg", bucket="b")["status"], "completed")
+        self.assertEqual(len(client.ledger), 1)
+
+    def test_pending_change_not_skipped(self) -> None:
+        """Test the acknowledged payload is sent again while a newer one is in flight"""
+        ledger = UploadLedger(self.path)
+        ledger.record([("owner", "b", "conv_0", "old")])
+        client = _mock_client(num_workers=1, ledger_path=self.path, max_retries=0)
+        self.addCleanup(client.close)
+        client.session.post.side_effect = requests.ConnectionError("down")
+        client.upload_hub("owner", "conv_0", "new", bucket="b")
+        self.assertIsNone(client.ledger.get("owner", "b", "conv_0"))
+        ledger.close()
+
+
+class ChunkedTransferTest(unittest.TestCase):
+    """
+    Test cases for compressed, chunked and streamed blob transfers
+    """
+
+    def make_client(self, **kwargs) -> Client:
+        kwargs.setdefault("max_retries", 0)
+        client = _mock_client(num_workers=1, **kwargs)
+        self.addCleanup(client.close)
+        self.hub = _FakeHub()
+        client.session.post.side_effect = self.hub.post
+        return client
+
+    def test_chunked_roundtrip(self) -> None:
+        """Test a large blob is uploaded in compressed parts and read back"""
+        client = self.make_client(chunk_size=10, compression="gzip")
+        blob = bytes(range(95))
+        self.assertEqual(client.upload_hub_data("owner", "snap", blob), {"ok": True})
+        self.assertEqual(len(self.hub.uploads), 11)
+        self.assertEqual(self.hub.uploads[-1], "snap")
+        self.assertEqual(parse_manifest(self.hub.blobs["snap"])["parts"], 10)
+        self.assertEqual(gzip.decompress(self.hub.blobs["snap.part000000"]), blob[:10])
+
+        self.assertEqual(client.download_hub("owner", "snap"), blob)
+        chunks = list(client.download_hub_stream("owner", "snap", chunk_size=7))
+        self.assertEqual(b"".join(chunks), blob)
+        self.assertTrue(all(len(chunk) <= 7 for chunk in chunks))
+
+        client.upload_hub_data("owner", "small", io.BytesIO(b"tiny"))
+        self.assertEqual(self.hub.blobs["small"], b"tiny")
+        self.assertEqual(b"".join(client.download_hub_stream("owner", "small")), b"tiny")
+
+    def test_single_part_compressed(self) -> None:
+        """Test a blob uploaded in one part is compressed too, with its codec in a header"""
+        for chunk_size in (0, 1024 * 1024):
+            client = self.make_client(chunk_size=chunk_size, compression="gzip")
+            blob = b"hello membase " * 500
+            client.upload_hub_data("owner", "snap", blob)
+            stored = self.hub.blobs["snap"]
+            self.assertTrue(stored.startswith(BLOB_HEADER_PREFIX + b"gzip\n"))
+            self.assertEqual(gzip.decompress(stored[len(BLOB_HEADER_PREFIX) + 5:]), blob)
+            self.assertLess(len(stored), len(blob))
+
+            self.assertEqual(client.download_hub("owner", "snap"), blob)
+            chunks = list(client.download_hub_stream("owner", "snap", chunk_size=100))
+            self.assertEqual(b"".join(chunks), blob)
+            self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+
+        # a blob that happens to start like a header is still read back as is
+        tricky = BLOB_HEADER_PREFIX + b"gzip\nnot compressed"
+        client.upload_hub_data("owner", "tricky", tricky)
+        self.assertEqual(client.download_hub("owner", "tricky"), tricky)
+        self.assertEqual(b"".join(client.download_hub_stream("owner", "tricky", chunk_size=4)), tricky)
+
+    def test_resume_upload(self) -> None:
+        """Test uploading a blob again only sends the parts the hub did not acknowledge"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        client = self.make_client(chunk_size=10, ledger_path=os.path.join(tmp.name, "ledger.db"))
+        blob = os.urandom(50)
+
+        def flaky(url, **kwargs):
+            if len(self.hub.uploads) == 3:
+                raise requests.ConnectionError("down")
+            return self.hub.post(url, **kwargs)
+
+        client.session.post.side_effect = flaky
+        self.assertIsNone(client.upload_hub_data("owner", "snap", blob))
+        client.session.post.side_effect = self.hub.post
+        self.assertIsNotNone(client.upload_hub_data("owner", "snap", blob))
+        self.assertEqual(self.hub.uploads[3:], ["snap.part000003", "snap.part000004", "snap"])
+        self.assertEqual(client.download_hub("owner", "snap"), blob)
+
+    def test_stream_resume(self) -> None:
+        """Test a download cut off midway continues where it stopped"""
+        client = self.make_client(max_retries=1, retry_backoff=0.01)
+        self.hub.blobs["blob"] = blob = os.urandom(100)
+
+        def cut_off(size):
+            yield blob[:40]
+            raise requests.ConnectionError("reset")
+
+        first = _response(content=blob)
+        first.iter_content.side_effect = cut_off
+        responses = [first]
+        client.session.post.side_effect = lambda url, **kwargs: (
+            responses.pop() if responses else self.hub.post(url, **kwargs)
+        )
+        self.assertEqual(b"".join(client.download_hub_stream("owner", "blob", chunk_size=16)), blob)
+        self.assertEqual(client.session.post.call_args.kwargs["headers"]["Range"], "bytes=40-")
+
+    def test_compressed_requests(self) -> None:
+        """Test large upload bodies are sent with Content-Encoding when enabled"""
+        client = self.make_client(compression="gzip", compress_requests=True)
+        client.session.post.side_effect = None
+        client.upload_hub("owner", "conv_0", "x" * 4096, bucket="b")
+        call = client.session.post.call_args
+        self.assertEqual(call.kwargs["headers"]["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(call.kwargs["data"]))["Message"], "x" * 4096)
+
+
+class HubResilienceTest(unittest.TestCase):
+    """
+    Test cases for timeouts, read retries, the circuit breaker and hedged reads
+    """
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cache.db")
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def make_client(self, **kwargs) -> Client:
+        client = _mock_client(num_workers=1, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_breaker(self) -> None:
+        """Test the circuit opens after repeated failures and closes after a good trial"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_retry_budget(self) -> None:
+        """Test retries stop once the budget is spent and resume with new requests"""
+        budget = RetryBudget(ratio=0.5, reserve=1)
+        self.assertTrue(budget.try_retry())
+        self.assertFalse(budget.try_retry())
+        budget.record_request()
+        budget.record_request()
+        self.assertTrue(budget.try_retry())
+
+    def test_timeouts_and_read_retry(self) -> None:
+        """Test requests carry timeouts and a failed read is retried"""
+        client = self.make_client(connect_timeout=1, read_timeout=2, max_retries=1, retry_backoff=0.01)
+        client.session.post.side_effect = [_response(status=503), _response(content=b"blob")]
+        self.assertEqual(client.download_hub("owner", "f"), b"blob")
+        self.assertEqual(client.session.post.call_args.kwargs["timeout"], (1, 2))
+
+    def test_open_circuit_serves_cache(self) -> None:
+        """Test reads fail fast and are served from cache while the circuit is open"""
+        client = self.make_client(cache_path=self.path, breaker_failures=2, breaker_reset=60, max_retries=0)
+        client.session.post.return_value = _response(content=b'["m0"]', headers={"ETag": "v1"})
+        client.get_conversation("owner", "conv")
+
+        client.session.post.side_effect = requests.ConnectionError("down")
+        for _ in range(2):
+            self.assertEqual(client.get_conversation("owner", "conv"), ["m0"])
+        calls = client.session.post.call_count
+        self.assertEqual(client.get_conversation("owner", "conv"), ["m0"])
+        self.assertIsNone(client.download_hub("owner", "f"))
+        self.assertEqual(client.session.post.call_count, calls)
+
+    def test_hedged_read(self) -> None:
+        """Test a slow read is raced by a duplicate and the first answer wins"""
+        client = self.make_client(hedge_after_ms=20)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        responses = [_response(content=b"fast"), _response(content=b"slow")]
+
+        def post(url, **kwargs):
+            response = responses.pop()
+            if response.content == b"slow":
+                release.wait(5)
+            return response
+
+        client.session.post.side_effect = post
+        start = time.monotonic()
+        self.assertEqual(client.download_hub("owner", "f"), b"fast")
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(client.session.post.call_count, 2)
+
+
+class AsyncClientTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Test cases for the asyncio hub client
+    """
+
+    async def test_requests(self) -> None:
+        """Test each call hits the matching hub endpoint"""
+        seen = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            seen.append(request.url.path)
+            if request.url.path == "/api/conversation":
+                form = dict(x.split("=") for x in request.content.decode().split("&"))
+                if "id" in form:
+                    return httpx.Response(200, json=["m0", "m1"])
+                return httpx.Response(200, json=["conv"])
+            if request.url.path == "/api/download":
+                return httpx.Response(200, content=b"blob")
+            return httpx.Response(200, json={"ok": True})
+
+        client = AsyncClient("http://hub.test", transport=httpx.MockTransport(handler))
+        self.assertEqual(await client.list_conversations("owner"), ["conv"])
+        self.assertEqual(await client.get_conversation("owner", "conv"), ["m0", "m1"])
+        self.assertEqual(await client.download_hub("owner", "f"), b"blob")
+        self.assertEqual((await client.upload_hub("owner", "conv_0", "msg", bucket="b"))["status"], "completed")
+        self.assertEqual(await client.upload_hub_data("owner", "f", b"data"), {"ok": True})
+        await client.aclose()
+        self.assertEqual(seen, ["/api/conversation", "/api/conversation", "/api/download", "/api/upload", "/api/uploadData"])
+
+    def test_new_loop_closes_previous_client(self) -> None:
+        """Test the http client of a previous event loop is closed, not leaked"""
+        client = AsyncClient("http://hub.test", transport=httpx.MockTransport(lambda r: httpx.Response(200, content=b"x")))
+        asyncio.run(client.download_hub("owner", "f"))
+        first = client._http
+
+        async def second_loop():
+            await client.download_hub("owner", "f")
+            await asyncio.sleep(0)
+            await client.aclose()
+
+        asyncio.run(second_loop())
+        self.assertIsNot(client._http, first)
+        self.assertTrue(first.is_closed)
+
+    async def test_upload_retries(self) -> None:
+        """Test a 5xx upload is retried and a 4xx is not"""
+        statuses = [503, 200]
+        client = AsyncClient(
+            "http://hub.test", max_retries=3, retry_backoff=0.01,
+            transport=httpx.MockTransport(lambda r: httpx.Response(statuses.pop(0), json={})),
+        )
+        self.assertEqual((await client.upload_hub("owner", "conv_0", "msg", bucket="b"))["status"], "completed")
+
+        statuses = [400, 200]
+        self.assertIsNone(await client.upload_hub("owner", "conv_0", "msg", bucket="b"))
+        await client.aclose()
+
+    async def test_open_circuit(self) -> None:
+        """Test requests fail fast once the hub failed repeatedly"""
+        seen = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            seen.append(request)
+            return httpx.Response(503)
+
+        client = AsyncClient(
+            "http://hub.test", max_retries=0, breaker=CircuitBreaker(2, 60),
+            transport=httpx.MockTransport(handler),
+        )
+        for _ in range(3):
+            self.assertIsNone(await client.download_hub("owner", "f"))
+        self.assertEqual(len(seen), 2)
+        with self.assertRaises(AsyncHubUnavailableError):
+            await client._post("/api/download", data={})
+        await client.aclose()
+
+    async def test_upload_ledger(self) -> None:
+        """Test an acknowledged payload is skipped"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        ledger = UploadLedger(os.path.join(tmp.name, "ledger.db"))
+        self.addCleanup(ledger.close)
+        seen = []
+        client = AsyncClient(
+            "http://hub.test", ledger=ledger,
+            transport=httpx.MockTransport(lambda r: seen.append(r) or httpx.Response(200, json={})),
+        )
+        self.assertEqual((await client.upload_hub("owner", "conv_0", "msg", bucket="b"))["status"], "completed")
+        self.assertEqual((await client.upload_hub("owner", "conv_0", "msg", bucket="b"))["status"], "skipped")
+        self.assertEqual(len(seen), 1)
+        await client.aclose()
+
+    async def test_chunked_roundtrip(self) -> None:
+        """Test a large blob is uploaded in parts and streamed back"""
+        blobs = {}
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.path == "/api/uploadData":
+                # one part of the multipart body per upload, name and payload are what matter here
+                body = request.content
+                name = body.split(b'filename="', 1)[1].split(b'"', 1)[0].decode()
+                payload = body.split(b"\r\n\r\n", 2)[2].rsplit(b"\r\n--", 1)[0]
+                blobs[name] = payload
+                return httpx.Response(200, json={"ok": True})
+            form = dict(parse_qsl(request.content.decode()))
+            if form["id"] not in blobs:
+                return httpx.Response(404)
+            return httpx.Response(200, content=blobs[form["id"]])
+
+        client = AsyncClient(
+            "http://hub.test", chunk_size=10, compression="gzip", max_retries=0,
+            transport=httpx.MockTransport(handler),
+        )
+        blob = bytes(range(95))
+        self.assertEqual(await client.upload_hub_data("owner", "snap", blob), {"ok": True})
+        self.assertEqual(len(blobs), 11)
+        self.assertEqual(await client.download_hub("owner", "snap"), blob)
+        chunks = [chunk async for chunk in client.download_hub_stream("owner", "snap", chunk_size=7)]
+        self.assertEqual(b"".join(chunks), blob)
+
+        # a single part is compressed behind a header naming the codec
+        small = b"hello membase " * 500
+        client.chunk_size = 1024 * 1024
+        await client.upload_hub_data("owner", "small", small)
+        self.assertTrue(blobs["small"].startswith(BLOB_HEADER_PREFIX + b"gzip\n"))
+        self.assertEqual(await client.download_hub("owner", "small"), small)
+        chunks = [chunk async for chunk in client.download_hub_stream("owner", "small", chunk_size=100)]
+        self.assertEqual(b"".join(chunks), small)
+        await client.aclose()
+
+
+if __name__ == "__main__":
+    unittest.main()
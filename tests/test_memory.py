@@ -4,12 +4,22 @@ Unit tests for memory classes and functions
 """
 
 import os
+import tempfile
+import threading
 import unittest
-from unittest.mock import patch, MagicMock
+import zlib
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
 
 from membase.memory.message import Message
 from membase.memory.buffered_memory import BufferedMemory
-from membase.memory.serialize import serialize
+from membase.memory.windowed_memory import WindowedMemory
+from membase.memory.persistent_memory import PersistentMemory
+from membase.memory.lock import RWLock
+from membase.memory.recall import RecallIndex
+from membase.memory.context import ContextBuilder, TokenCounter
+from membase.memory.serialize import serialize, deserialize, get_codec, msgpack
 
 
 class BufferedMemoryTest(unittest.TestCase):
@@ -153,5 +163,494 @@ class BufferedMemoryTest(unittest.TestCase):
         self.assertEqual(agent_messages[0].content, "Response from agent")
 
 
+class MessageTest(unittest.TestCase):
+    """
+    Test cases for Message
+    """
+
+    def test_from_dicts(self) -> None:
+        """Test bulk deserialization round-trips and keeps ids"""
+        messages = [
+            Message("user", {"text": f"m{i}"}, role="user", metadata={"i": i})
+            for i in range(3)
+        ]
+        loaded = Message.from_dicts([m.to_dict() for m in messages])
+        self.assertEqual(loaded, messages)
+        self.assertEqual(Message.from_dict(messages[0].to_dict()), messages[0])
+
+    def test_from_dicts_invalid_role(self) -> None:
+        """Test bulk deserialization still validates the role"""
+        data = Message("user", "hi", role="user").to_dict()
+        data["role"] = "robot"
+        with self.assertRaises(ValueError):
+            Message.from_dicts([data])
+
+    def test_slots(self) -> None:
+        """Test messages carry no instance dict"""
+        msg = Message("user", "hi", role="user")
+        self.assertFalse(hasattr(msg, "__dict__"))
+        # non-serializable content is still converted to string
+        msg.content = object()
+        self.assertIsInstance(msg.content, str)
+
+
+class RWLockTest(unittest.TestCase):
+    """
+    Test cases for the readers-writer lock
+    """
+
+    def test_readers_share_writer_excludes(self) -> None:
+        """Test readers run together and a writer waits for them"""
+        lock = RWLock()
+        entered = threading.Barrier(2, timeout=5)
+        order = []
+
+        def reader():
+            with lock.read():
+                # both readers must be inside at once to pass the barrier
+                entered.wait()
+                order.append("read")
+
+        readers = [threading.Thread(target=reader) for _ in range(2)]
+        for t in readers:
+            t.start()
+        for t in readers:
+            t.join()
+
+        with lock.write():
+            # reentrant, and a writer can read
+            with lock.write(), lock.read():
+                order.append("write")
+        self.assertEqual(order, ["read", "read", "write"])
+
+
+class QueryTest(unittest.TestCase):
+    """
+    Test cases for the indexed memory query
+    """
+
+    def make_messages(self) -> list:
+        messages = []
+        for i in range(10):
+            role = "assistant" if i % 2 else "user"
+            msg = Message(role, f"message {i}", role=role, metadata={"type": "trade" if i % 3 == 0 else "chat"})
+            msg.timestamp = f"2025-01-01 00:00:{i:02d}"
+            messages.append(msg)
+        return messages
+
+    def check_queries(self, memory: BufferedMemory) -> None:
+        contents = lambda res: [m.content for m in res]
+        self.assertEqual(contents(memory.query(role="assistant", limit=2)), ["message 1", "message 3"])
+        self.assertEqual(
+            contents(memory.query(role="user", since="2025-01-01 00:00:04", until="2025-01-01 00:00:08")),
+            ["message 4", "message 6"],
+        )
+        self.assertEqual(contents(memory.query(metadata={"type": "trade"}, newest_first=True, limit=2)), ["message 9", "message 6"])
+        self.assertEqual(contents(memory.query(name="user", metadata={"type": "trade"})), ["message 0", "message 6"])
+        self.assertEqual(contents(memory.query(limit=1)), ["message 0"])
+        self.assertEqual(memory.query(role="system"), [])
+
+    def test_query(self) -> None:
+        """Test role, name, time range and metadata conditions combine"""
+        memory = BufferedMemory(index_metadata_keys=["type"])
+        memory.add(self.make_messages())
+        self.check_queries(memory)
+        with self.assertRaises(ValueError):
+            memory.query(metadata={"other": 1})
+
+    def test_query_after_delete(self) -> None:
+        """Test the indexes follow deletes"""
+        memory = BufferedMemory(index_metadata_keys=["type"])
+        memory.add(self.make_messages())
+        memory.delete(1)
+        self.assertEqual([m.content for m in memory.query(role="assistant", limit=1)], ["message 3"])
+
+    def test_query_windowed(self) -> None:
+        """Test spilled messages are found and paged back in"""
+        memory = WindowedMemory(window_size=3, index_metadata_keys=["type"])
+        memory.add(self.make_messages())
+        self.check_queries(memory)
+        memory.delete(9)
+        self.assertEqual([m.content for m in memory.query(role="assistant", newest_first=True, limit=1)], ["message 7"])
+
+
+class SerializeTest(unittest.TestCase):
+    """
+    Test cases for the serializer codecs
+    """
+
+    def setUp(self) -> None:
+        self.messages = [
+            Message("user", {"text": f"m{i}"}, role="user", metadata={"i": i})
+            for i in range(3)
+        ]
+
+    def test_codecs_roundtrip(self) -> None:
+        """Test every available codec round-trips messages"""
+        names = ["json", "orjson"] + (["msgpack"] if msgpack is not None else [])
+        for name in names:
+            codec = get_codec(name)
+            self.assertEqual(codec.loads(codec.dumps(self.messages)), self.messages)
+        # the default codec stays JSON compatible
+        self.assertEqual(get_codec("json").loads(serialize(self.messages)), self.messages)
+        self.assertEqual(deserialize(serialize({"big": 2 ** 70})), {"big": 2 ** 70})
+
+    def test_unknown_codec(self) -> None:
+        """Test an unknown serializer name raises"""
+        with self.assertRaises(ValueError):
+            get_codec("pickle")
+
+    @unittest.skipUnless(msgpack is not None, "msgpack is not installed")
+    def test_export_msgpack(self) -> None:
+        """Test a .msgpack export is binary and loads back"""
+        memory = BufferedMemory()
+        memory.add(self.messages)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "memory.msgpack")
+            memory.export(file_path=path)
+            with open(path, "rb") as f:
+                self.assertFalse(f.read(1).startswith(b"["))
+            loaded = BufferedMemory()
+            loaded.load(path)
+            self.assertEqual(
+                [(m.id, m.content) for m in loaded.get()],
+                [(m.id, m.content) for m in self.messages],
+            )
+
+
+class WindowedMemoryTest(unittest.TestCase):
+    """
+    Test cases for WindowedMemory
+    """
+
+    def setUp(self) -> None:
+        self.memory = WindowedMemory(window_size=4)
+        self.messages = [Message("user", f"message {i}", role="user") for i in range(10)]
+        self.memory.add(self.messages)
+
+    def test_window_bounded(self) -> None:
+        """Test only the window stays resident while all messages are readable"""
+        self.assertEqual(self.memory.resident_size, 4)
+        self.assertEqual(self.memory.size(), 10)
+        self.assertEqual(self.memory.get(recent_n=3), self.messages[-3:])
+        self.assertEqual(
+            [m.content for m in self.memory.get(recent_n=6)],
+            [m.content for m in self.messages[-6:]],
+        )
+        self.assertEqual(
+            [m.content for m in self.memory.get()],
+            [m.content for m in self.messages],
+        )
+
+    def test_duplicate_spilled(self) -> None:
+        """Test a spilled message is still detected as duplicate"""
+        self.memory.add(self.messages[0])
+        self.assertEqual(self.memory.size(), 10)
+
+    def test_get_range(self) -> None:
+        """Test a page spanning spilled and resident messages"""
+        contents = lambda res: [m.content for m in res]
+        self.assertEqual(contents(self.memory.get_range(4, 4)), [f"message {i}" for i in range(4, 8)])
+        self.assertEqual(contents(self.memory.get_range(8)), ["message 8", "message 9"])
+        self.assertEqual(self.memory.get_range(20, 5), [])
+        self.assertEqual(self.memory.get_range(0, 10), self.memory.get())
+        with self.assertRaises(ValueError):
+            self.memory.get_range(-1)
+
+    def test_delete(self) -> None:
+        """Test deleting resident and spilled messages"""
+        self.memory.delete(9)
+        self.memory.delete(0)
+        self.assertEqual(
+            [m.content for m in self.memory.get()],
+            [f"message {i}" for i in range(1, 9)],
+        )
+        self.assertEqual(self.memory.resident_size, 4)
+
+    def test_spill_to_hub(self) -> None:
+        """Test only acknowledged messages spill to hub and the window can be rewritten"""
+        hub = {}
+
+        def upload(owner, memory_id, msg, on_ack=None):
+            hub[memory_id] = msg.encode("utf-8")
+            # the upload of message 1 is never acknowledged
+            if memory_id != "conv_1":
+                on_ack()
+
+        downloaded = []
+
+        def download(owner, filename):
+            downloaded.append(filename)
+            return hub.get(filename)
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch("membase.memory.buffered_memory.hub_client.upload_hub", side_effect=upload), \
+                patch("membase.memory.windowed_memory.hub_client.download_hub", side_effect=download):
+            memory = WindowedMemory(
+                conversation_id="conv", auto_upload_to_hub=True, window_size=2, spill_to="hub", spill_dir=tmp,
+            )
+            for message in self.messages[:6]:
+                memory.add(message)
+            self.assertEqual(memory.resident_size, 2)
+            self.assertEqual([m.content for m in memory.get()], [f"message {i}" for i in range(6)])
+            self.assertEqual(sorted(downloaded), ["conv_0", "conv_2", "conv_3"])
+
+            # a replacement reusing the id of a message on hub stays local
+            summary = Message.from_dict(self.messages[0].to_dict())
+            summary.content = "summary"
+            self.assertTrue(memory.replace_range(0, 2, [summary]))
+            memory.delete(2)
+            self.assertEqual(
+                [m.content for m in memory.get()], ["summary", "message 2", "message 4", "message 5"]
+            )
+            self.assertEqual(memory.resident_size, 2)
+
+            del hub["conv_2"]
+            with self.assertRaises(KeyError):
+                memory.get()
+
+
+class PersistentMemoryTest(unittest.TestCase):
+    """
+    Test cases for PersistentMemory
+    """
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.messages = [Message("user", f"message {i}", role="user") for i in range(10)]
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def open(self) -> PersistentMemory:
+        memory = PersistentMemory(conversation_id="conv", storage_dir=self.tmp.name)
+        self.addCleanup(memory.close)
+        return memory
+
+    def test_reopen(self) -> None:
+        """Test messages survive a reopen and the tail is read alone"""
+        memory = self.open()
+        memory.add(self.messages)
+        memory.close()
+
+        memory = self.open()
+        self.assertEqual(memory.size(), 10)
+        self.assertEqual([m.content for m in memory.get(recent_n=2)], ["message 8", "message 9"])
+        # duplicates are still detected after reopening
+        memory.add(self.messages[0])
+        self.assertEqual(memory.size(), 10)
+        self.assertEqual([m.content for m in memory.query(role="user", newest_first=True, limit=1)], ["message 9"])
+
+    def test_get_range(self) -> None:
+        """Test a page is read from the log"""
+        memory = self.open()
+        memory.add(self.messages)
+        self.assertEqual([m.content for m in memory.get_range(3, 2)], ["message 3", "message 4"])
+        self.assertEqual(len(memory.get_range(8, 5)), 2)
+
+    def test_clear_keeps_conversation(self) -> None:
+        """Test a cleared log keeps its conversation id and files, and new messages survive a reopen"""
+        memory = self.open()
+        memory.add(self.messages)
+        memory.clear()
+        self.assertEqual(memory.info()["conversation_id"], "conv")
+        memory.add(Message("user", "after clear", role="user"))
+        # uploaded after the hub indexes used before the clear
+        self.assertEqual(memory.hub_size(), 11)
+        memory.close()
+
+        memory = self.open()
+        self.assertEqual([m.content for m in memory.get()], ["after clear"])
+        self.assertEqual(memory.hub_size(), 11)
+
+    def test_delete(self) -> None:
+        """Test deleting rewrites the log"""
+        memory = self.open()
+        memory.add(self.messages)
+        memory.delete([0, 5])
+        memory.add(Message("user", "message 10", role="user"))
+        memory.close()
+
+        memory = self.open()
+        contents = [m.content for m in memory.get()]
+        self.assertEqual(len(contents), 9)
+        self.assertNotIn("message 5", contents)
+        self.assertEqual(contents[-1], "message 10")
+
+    def test_info(self) -> None:
+        """Test the conversation metadata survives a delete and a reopen"""
+        for i, message in enumerate(self.messages):
+            message.timestamp = f"2024-01-01 00:00:{i:02d}"
+        memory = self.open()
+        memory.add(self.messages)
+        memory.delete(9)
+        memory.close()
+
+        info = self.open().info()
+        self.assertEqual(info["message_count"], 9)
+        self.assertEqual(info["created_at"], "2024-01-01 00:00:00")
+        self.assertEqual(info["updated_at"], "2024-01-01 00:00:08")
+        self.assertEqual(info["last_message_id"], self.messages[8].id)
+
+    def test_torn_append(self) -> None:
+        """Test an index entry without its record is dropped on open"""
+        memory = self.open()
+        memory.add(self.messages[:3])
+        memory.close()
+        with open(memory._log.index_path, "ab") as f:
+            f.write(b"\xff" * 12)
+
+        memory = self.open()
+        self.assertEqual(memory.size(), 3)
+
+
+class BagOfWords(EmbeddingFunction[Documents]):
+    """Deterministic embedding, so recall tests need no model download"""
+
+    def __init__(self) -> None:
+        pass
+
+    @staticmethod
+    def name() -> str:
+        return "bag_of_words"
+
+    def __call__(self, input: Documents) -> Embeddings:
+        embeddings = []
+        for text in input:
+            vector = [0.0] * 64
+            for word in text.lower().split():
+                vector[zlib.crc32(word.encode()) % 64] += 1.0
+            embeddings.append(vector)
+        return embeddings
+
+
+class RecallTest(unittest.TestCase):
+    """
+    Test cases for recall through a RecallIndex
+    """
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.recall_index = RecallIndex("test", self.tmp.name, BagOfWords())
+        self.messages = [
+            Message("user", "my cat is called tom", role="user"),
+            Message("user", "stock prices rose today", role="user"),
+            Message("user", "what is the weather", role="user"),
+        ]
+
+    def test_recall(self) -> None:
+        """Test the relevant message is recalled and deleted ones are not"""
+        memory = BufferedMemory(recall_index=self.recall_index)
+        memory.add(self.messages)
+        self.assertEqual([m.content for m in memory.recall("cat tom", k=1)], ["my cat is called tom"])
+        memory.delete(0)
+        self.assertNotIn("my cat is called tom", [m.content for m in memory.recall("cat tom", k=3)])
+
+    def test_recall_spilled(self) -> None:
+        """Test messages older than the window are recalled"""
+        memory = WindowedMemory(window_size=1, spill_dir=self.tmp.name, recall_index=self.recall_index)
+        memory.add(self.messages)
+        self.assertEqual([m.content for m in memory.recall("stock prices", k=1)], ["stock prices rose today"])
+
+    def test_recall_scoped_to_conversation(self) -> None:
+        """Test recall only returns messages of its own conversation"""
+        first = BufferedMemory(conversation_id="a", recall_index=self.recall_index)
+        second = BufferedMemory(conversation_id="b", recall_index=self.recall_index)
+        first.add(self.messages[0])
+        second.add(self.messages[1])
+        self.assertEqual([m.content for m in second.recall("cat tom", k=5)], ["stock prices rose today"])
+
+    def test_no_recall_index(self) -> None:
+        """Test recall without an index is an error"""
+        with self.assertRaises(ValueError):
+            BufferedMemory().recall("cat")
+
+
+class ContextBuilderTest(unittest.TestCase):
+    """
+    Test cases for token-budgeted context assembly
+    """
+
+    def setUp(self) -> None:
+        self.counter = TokenCounter()
+        self.messages = [Message("user", f"message {i} " + "word " * 40, role="user") for i in range(10)]
+        self.memory = BufferedMemory(index_metadata_keys=["type"])
+        self.memory.add(self.messages)
+        self.cost = self.counter.count(self.messages[0])
+
+    def test_recent(self) -> None:
+        """Test the latest messages fitting the budget are kept in order"""
+        builder = ContextBuilder(counter=self.counter, truncate=False)
+        context = builder.build(self.memory, self.cost * 3 + self.cost // 2)
+        self.assertEqual([m.id for m in context], [m.id for m in self.messages[-3:]])
+
+    def test_truncate(self) -> None:
+        """Test the oldest message is cut to the remaining budget"""
+        builder = ContextBuilder(counter=self.counter)
+        context = builder.build(self.memory, self.cost * 3 + self.cost // 2)
+        self.assertEqual(len(context), 4)
+        self.assertTrue(context[0].content.startswith("…"))
+        self.assertLessEqual(self.counter.count_text(context[0].content), self.cost // 2)
+        self.assertFalse(self.messages[6].content.startswith("…"))
+
+    def test_counts_cached(self) -> None:
+        """Test each message is tokenized once across builds"""
+        counter = TokenCounter()
+        builder = ContextBuilder(counter=counter)
+        with patch.object(counter, "count_text", wraps=counter.count_text) as count_text:
+            builder.build(self.memory, 10_000)
+            builder.build(self.memory, 10_000)
+        self.assertEqual(count_text.call_count, len(self.messages))
+
+    def test_summary(self) -> None:
+        """Test the latest summary is followed by the messages after it"""
+        summary = Message("system", "summary of the conversation", role="system", metadata={"type": "summary"})
+        later = [Message("user", f"later {i}", role="user") for i in range(2)]
+        self.memory.add([summary] + later)
+        context = ContextBuilder("summary", counter=self.counter).build(self.memory, 10_000)
+        self.assertEqual([m.content for m in context], [summary.content, "later 0", "later 1"])
+
+    def test_relevance(self) -> None:
+        """Test an old relevant message is added before the recent ones"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = BufferedMemory(recall_index=RecallIndex("test", tmp, BagOfWords()))
+            memory.add([Message("user", "my cat is called tom", role="user")] + self.messages)
+            builder = ContextBuilder("relevance", counter=self.counter, truncate=False)
+            context = builder.build(memory, self.cost * 4, query="what is my cat called")
+        self.assertEqual(context[0].content, "my cat is called tom")
+        self.assertEqual(context[-1].id, self.messages[-1].id)
+
+    def test_unknown_strategy(self) -> None:
+        """Test an unknown strategy name is rejected"""
+        with self.assertRaises(ValueError):
+            ContextBuilder("oldest")
+
+
+class BufferedMemoryAsyncTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Test cases for the awaitable BufferedMemory variants
+    """
+
+    async def test_add_async(self) -> None:
+        """Test add_async uploads every new message through the async client"""
+        memory = BufferedMemory(conversation_id="conv", membase_account="acc", auto_upload_to_hub=True)
+        messages = [Message("user", f"m{i}", role="user") for i in range(3)]
+        with patch(
+            "membase.memory.buffered_memory.async_hub_client.upload_hub",
+            new_callable=AsyncMock,
+        ) as upload:
+            await memory.add_async(messages)
+            await memory.add_async(messages[0])
+
+        self.assertEqual(memory.get(), messages)
+        self.assertEqual(
+            [c.args[1] for c in upload.call_args_list],
+            ["conv_0", "conv_1", "conv_2"],
+        )
+        # handed to the spooled background workers, not posted in the request
+        self.assertTrue(all(c.kwargs["wait"] is False for c in upload.call_args_list))
+
+
 if __name__ == "__main__":
     unittest.main()
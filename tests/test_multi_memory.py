@@ -1,10 +1,23 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 import uuid
+from unittest.mock import patch
 
+from membase.memory.serialize import serialize
+
+from membase.memory.buffered_memory import BufferedMemory
 from membase.memory.multi_memory import MultiMemory
+from membase.memory.compaction import Compactor, downsample, summarize
 from membase.memory.message import Message
 
+from tests.test_memory import BagOfWords
+
 class TestMultiMemory(unittest.TestCase):
     def setUp(self):
         """Set up test fixtures before each test method."""
@@ -157,6 +170,494 @@ class TestMultiMemory(unittest.TestCase):
         for msg in user_messages:
             self.assertEqual(msg.role, "user")
             self.assertEqual(msg.name, "test_user")
+    def test_sync_from_hub(self):
+        """Test incremental sync only downloads indices past the cursor"""
+        remote = {
+            f"conv_{i}": serialize(Message(content=f"message {i}", role="user", name="test_user")).encode()
+            for i in range(3)
+        }
+        requested = []
+
+        def download(owner, filename):
+            requested.append(filename)
+            return remote.get(filename)
+
+        memory = MultiMemory(membase_account="test_account")
+        with patch("membase.memory.multi_memory.hub_client.download_hub", side_effect=download):
+            loaded = memory.sync_from_hub("conv")
+            self.assertEqual([m.content for m in loaded], ["message 0", "message 1", "message 2"])
+            self.assertEqual(memory.sync_cursor("conv"), 3)
+
+            remote["conv_3"] = serialize(Message(content="message 3", role="user", name="test_user")).encode()
+            requested.clear()
+            loaded = memory.sync_from_hub("conv")
+
+        self.assertEqual([m.content for m in loaded], ["message 3"])
+        self.assertEqual(requested, ["conv_3", "conv_4"])
+        self.assertEqual(memory.size("conv"), 4)
+    def _remote_hub(self, conversations):
+        """Patch the hub client to serve the given {conversation_id: [contents]}"""
+        def get_conversation(owner, conv_id):
+            return [
+                serialize(Message(content=c, role="user", name="test_user"))
+                for c in conversations[conv_id]
+            ]
+        list_patch = patch(
+            "membase.memory.multi_memory.hub_client.list_conversations",
+            return_value=list(conversations),
+        )
+        get_patch = patch(
+            "membase.memory.multi_memory.hub_client.get_conversation",
+            side_effect=get_conversation,
+        )
+        return list_patch, get_patch
+
+    def test_parallel_preload(self):
+        """Test preload loads every conversation and reports progress"""
+        conversations = {f"conv{i}": [f"message {j}" for j in range(i + 1)] for i in range(10)}
+        list_patch, get_patch = self._remote_hub(conversations)
+        progress = []
+        with list_patch, get_patch:
+            memory = MultiMemory(
+                membase_account="test_account",
+                preload_from_hub=True,
+                preload_workers=4,
+                preload_callback=lambda conv_id, done, total: progress.append((done, total)),
+            )
+            metrics = memory.load_all_from_hub()
+
+        self.assertEqual(memory.size(conversation_id="conv9"), 10)
+        self.assertEqual(metrics["conversations"], 10)
+        self.assertEqual(metrics["messages"], 55)
+        self.assertEqual(sorted(progress), [(i, 10) for i in range(1, 11)])
+
+    def test_lazy_load(self):
+        """Test lazy mode lists conversations and loads them on first access"""
+        list_patch, get_patch = self._remote_hub({"conv1": ["a", "b"], "conv2": ["c"]})
+        with list_patch, get_patch as get_conversation:
+            memory = MultiMemory(membase_account="test_account", lazy_load=True)
+            self.assertEqual(sorted(memory.get_all_conversations()), ["conv1", "conv2"])
+            get_conversation.assert_not_called()
+
+            self.assertEqual([m.content for m in memory.get("conv1")], ["a", "b"])
+            memory.get("conv1")
+            get_conversation.assert_called_once_with("test_account", "conv1")
+
+    def test_concurrent_add(self):
+        """Test threads adding to shared and separate conversations lose nothing"""
+        memory = MultiMemory(membase_account="test_account", num_shards=4)
+
+        def work(worker):
+            for i in range(200):
+                memory.add(Message("user", f"{worker}-{i}", role="user"), "shared")
+                memory.add(Message("user", f"{worker}-{i}", role="user"), f"conv{worker}")
+                memory.get("shared", recent_n=5)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(work, range(8)))
+
+        self.assertEqual(memory.size("shared"), 1600)
+        self.assertEqual(len(memory.get_all_conversations()), 9)
+        shared = memory.get_memory("shared")
+        # map and index stay consistent with the message list
+        self.assertEqual(sorted(shared._message_map.values()), list(range(1600)))
+        self.assertEqual(len(shared.query(role="user")), 1600)
+
+    def test_storage_dir(self):
+        """Test conversations in the storage dir are reopened on startup"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account", storage_dir=tmp)
+            memory.add(Message("user", "hello", role="user"), "conv/1")
+            memory.add(Message("user", "world", role="user"), "conv2")
+
+            reopened = MultiMemory(membase_account="test_account", storage_dir=tmp)
+            self.assertEqual(sorted(reopened.get_all_conversations()), ["conv/1", "conv2"])
+            self.assertEqual([m.content for m in reopened.get("conv/1")], ["hello"])
+            for m in (memory, reopened):
+                for conv in m.get_all_conversations():
+                    m.get_memory(conv).close()
+
+    def test_storage_dir_skips_preload(self):
+        """Test conversations reopened from the storage dir are not preloaded from hub again"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account", storage_dir=tmp)
+            memory.add(Message("user", "hello", role="user"), "local")
+            memory.get_memory("local").close()
+
+            list_patch, get_patch = self._remote_hub({"local": ["hello"], "remote": ["world"]})
+            with list_patch, get_patch as get_conversation:
+                reopened = MultiMemory(membase_account="test_account", storage_dir=tmp, preload_from_hub=True)
+            get_conversation.assert_called_once_with("test_account", "remote")
+            self.assertEqual([m.content for m in reopened.get("local")], ["hello"])
+            self.assertEqual([m.content for m in reopened.get("remote")], ["world"])
+            for conv in reopened.get_all_conversations():
+                reopened.get_memory(conv).close()
+
+    def test_hibernate_lru(self):
+        """Test least recently used conversations hibernate and rehydrate on access"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account", max_resident=2, hibernate_dir=tmp)
+            for conv in ("a", "b", "c"):
+                memory.add([Message("user", f"{conv}{i}", role="user") for i in range(3)], conv)
+
+            stats = memory.memory_stats()
+            self.assertEqual(stats["resident_conversations"], 2)
+            self.assertEqual(stats["hibernated_conversations"], 1)
+            self.assertEqual(sorted(memory.get_all_conversations()), ["a", "b", "c"])
+            self.assertEqual(memory.size("a"), 3)
+            self.assertEqual(memory.size(), 9)
+
+            self.assertEqual([m.content for m in memory.get("a")], ["a0", "a1", "a2"])
+            stats = memory.memory_stats()
+            self.assertEqual(stats["rehydrations"], 1)
+            self.assertEqual(stats["evictions"], 2)
+            self.assertEqual(stats["resident_conversations"], 2)
+            # "b" was the least recently used after "a" came back
+            self.assertIn("b", memory._hibernated)
+
+    def test_hibernate_message_budget(self):
+        """Test the resident message budget is enforced"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account", max_resident_messages=5, hibernate_dir=tmp)
+            for conv in ("a", "b", "c"):
+                memory.add([Message("user", f"{conv}{i}", role="user") for i in range(3)], conv)
+                memory.get_memory(conv)
+            self.assertLessEqual(memory.memory_stats()["resident_messages"], 5)
+            self.assertEqual(memory.size(), 9)
+
+    def test_hibernate_idle(self):
+        """Test idle conversations are hibernated by evict_idle"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account", idle_ttl=60, hibernate_dir=tmp)
+            memory.add(Message("user", "hello", role="user"), "a")
+            self.assertEqual(memory.evict_idle(), 0)
+            memory._last_access["a"] -= 120
+            self.assertEqual(memory.evict_idle(), 1)
+            self.assertEqual(memory.memory_stats()["resident_messages"], 0)
+            self.assertEqual([m.content for m in memory.get("a")], ["hello"])
+
+    def test_async_hydrates_off_loop(self):
+        """Test add_async and get_memory_async rehydrate outside the event loop thread"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account", max_resident=1, hibernate_dir=tmp)
+            memory.add(Message("user", "a0", role="user"), "a")
+            memory.add(Message("user", "b0", role="user"), "b")
+            threads = []
+            hydrate = memory._hydrate
+
+            def record(conversation_id):
+                threads.append(threading.current_thread())
+                hydrate(conversation_id)
+
+            with patch.object(memory, "_hydrate", side_effect=record):
+                asyncio.run(memory.add_async(Message("user", "a1", role="user"), "a"))
+                asyncio.run(memory.get_memory_async("b"))
+            self.assertEqual(len(threads), 2)
+            self.assertNotIn(threading.main_thread(), threads)
+            self.assertEqual([m.content for m in memory.get("a")], ["a0", "a1"])
+
+    def test_sync_hibernated(self):
+        """Test syncing a hibernated conversation appends after its history"""
+        remote = {"c1_3": serialize(Message(content="m3-from-hub", role="user", name="test_user")).encode()}
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account", max_resident=1, hibernate_dir=tmp)
+            memory.add([Message("user", f"m{i}", role="user") for i in range(3)], "c1")
+            memory.add(Message("user", "other", role="user"), "c2")
+            self.assertIn("c1", memory._hibernated)
+
+            with patch("membase.memory.multi_memory.hub_client.download_hub",
+                       side_effect=lambda owner, filename: remote.get(filename)):
+                loaded = memory.sync_from_hub("c1")
+            self.assertEqual([m.content for m in loaded], ["m3-from-hub"])
+            self.assertEqual([m.content for m in memory.get("c1")], ["m0", "m1", "m2", "m3-from-hub"])
+
+            memory.get_memory("c2")
+            self.assertIn("c1", memory._hibernated)
+            remote["c1_4"] = serialize(Message(content="m4-from-hub", role="user", name="test_user")).encode()
+            with patch("membase.memory.multi_memory.async_hub_client.download_hub",
+                       side_effect=lambda owner, filename: remote.get(filename)):
+                loaded = asyncio.run(memory.sync_from_hub_async("c1"))
+            self.assertEqual([m.content for m in loaded], ["m4-from-hub"])
+            self.assertEqual(
+                [m.content for m in memory.get("c1")], ["m0", "m1", "m2", "m3-from-hub", "m4-from-hub"]
+            )
+
+    def test_add_during_hibernation(self):
+        """Test an add arriving while its conversation is being exported lands in the rehydrated conversation"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account", idle_ttl=3600, hibernate_dir=tmp)
+            memory.add(Message("user", "before", role="user"), "a")
+            exporting = threading.Event()
+            release = threading.Event()
+            export = BufferedMemory.export
+
+            def slow_export(self, *args, **kwargs):
+                exporting.set()
+                release.wait(5)
+                return export(self, *args, **kwargs)
+
+            with patch.object(BufferedMemory, "export", slow_export):
+                hibernating = threading.Thread(target=memory._hibernate, args=("a",))
+                hibernating.start()
+                exporting.wait(5)
+                adding = threading.Thread(target=memory.add, args=(Message("user", "during", role="user"), "a"))
+                adding.start()
+                time.sleep(0.1)
+                release.set()
+                hibernating.join()
+                adding.join()
+
+            self.assertEqual([m.content for m in memory.get("a")], ["before", "during"])
+            self.assertEqual(memory.memory_stats()["rehydrations"], 1)
+
+    def test_hibernate_to_hub_waits_for_uploads(self):
+        """Test a conversation with uploads in flight is not dropped for hub, but kept for a later pass"""
+        memory = MultiMemory(membase_account="test_account", auto_upload_to_hub=True, idle_ttl=3600, hibernate_to="hub")
+        with patch("membase.memory.buffered_memory.hub_client.upload_hub"):
+            memory.add(Message("user", "hello", role="user"), "a")
+        with patch("membase.memory.multi_memory.hub_client.pending_uploads", return_value=1):
+            self.assertFalse(memory._hibernate("a"))
+        self.assertIsNotNone(memory._lookup("a"))
+        self.assertIn("a", memory._last_access)
+        with patch("membase.memory.multi_memory.hub_client.pending_uploads", return_value=0):
+            self.assertTrue(memory._hibernate("a"))
+        self.assertIn("a", memory._hibernated)
+
+    def test_hibernate_concurrent_add(self):
+        """Test adds racing hibernation and rehydration land in the conversation, never in a dropped copy"""
+        for storage in (False, True):
+            with tempfile.TemporaryDirectory() as tmp:
+                kwargs = {"storage_dir": os.path.join(tmp, "logs")} if storage else {}
+                # every access hibernates the other conversations
+                memory = MultiMemory(membase_account="test_account", idle_ttl=0, hibernate_dir=tmp, **kwargs)
+                done = threading.Event()
+
+                def add(conv):
+                    for i in range(100):
+                        memory.add(Message("user", f"{conv}{i}", role="user"), conv)
+
+                def evict():
+                    while not done.is_set():
+                        memory.evict_idle()
+
+                evictor = threading.Thread(target=evict)
+                evictor.start()
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    list(executor.map(add, ["a", "b", "c", "d"]))
+                done.set()
+                evictor.join()
+
+                for conv in ("a", "b", "c", "d"):
+                    self.assertEqual([m.content for m in memory.get(conv)], [f"{conv}{i}" for i in range(100)])
+                resident = memory._all_memories()
+                self.assertEqual(
+                    memory.memory_stats()["resident_messages"],
+                    sum(m.size() for m in resident.values()),
+                )
+                if storage:
+                    for m in resident.values():
+                        m.close()
+
+    def test_list_conversation_infos(self):
+        """Test conversations are listed from their metadata, sorted and paged"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account", max_resident=1, hibernate_dir=tmp)
+            for n, conv in enumerate(("a", "b", "c")):
+                messages = [Message("user", f"{conv}{i}", role="user") for i in range(n + 1)]
+                for i, message in enumerate(messages):
+                    message.timestamp = f"2024-01-0{3 - n} 00:00:0{i}"
+                memory.add(messages, conv)
+            self.assertEqual(memory.memory_stats()["hibernated_conversations"], 2)
+
+            total, infos = memory.list_conversation_infos()
+            self.assertEqual(total, 3)
+            self.assertEqual([info["conversation_id"] for info in infos], ["a", "b", "c"])
+            self.assertEqual(infos[2]["message_count"], 3)
+            self.assertEqual(infos[2]["created_at"], "2024-01-01 00:00:00")
+            self.assertEqual(infos[2]["updated_at"], "2024-01-01 00:00:02")
+
+            total, infos = memory.list_conversation_infos(offset=1, limit=1, sort_by="message_count")
+            self.assertEqual(total, 3)
+            self.assertEqual([info["conversation_id"] for info in infos], ["b"])
+            # listing loads nothing back
+            self.assertEqual(memory.memory_stats()["rehydrations"], 0)
+            self.assertTrue(memory.has_conversation("a"))
+            self.assertIsNone(memory.conversation_info("missing"))
+
+    def test_list_conversation_infos_ordered_index(self):
+        """Test listing reads the page and the changed conversations, not all of them"""
+        memory = MultiMemory(membase_account="test_account")
+        for n in range(20):
+            message = Message("user", f"m{n}", role="user")
+            message.timestamp = f"2024-01-01 00:00:{n:02d}"
+            memory.add(message, f"conv{n:02d}")
+        total, infos = memory.list_conversation_infos(limit=2)
+        self.assertEqual(total, 20)
+        self.assertEqual([info["conversation_id"] for info in infos], ["conv19", "conv18"])
+
+        message = Message("user", "late", role="user")
+        message.timestamp = "2024-01-02 00:00:00"
+        memory.add(message, "conv03")
+        with patch.object(memory, "conversation_info", wraps=memory.conversation_info) as info:
+            total, infos = memory.list_conversation_infos(limit=2)
+            # conv03 refreshed, then the two of the page
+            self.assertEqual(info.call_count, 3)
+        self.assertEqual(total, 20)
+        self.assertEqual([info["conversation_id"] for info in infos], ["conv03", "conv19"])
+
+        total, infos = memory.list_conversation_infos(offset=18, sort_by="message_count", descending=False)
+        self.assertEqual([info["conversation_id"] for info in infos], ["conv19", "conv03"])
+        memory.clear()
+        self.assertEqual(memory.list_conversation_infos(), (0, []))
+
+    def test_recall(self):
+        """Test recall survives hibernation without re-embedding"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(
+                membase_account="test_account",
+                max_resident=1,
+                hibernate_dir=tmp,
+                recall_dir=tmp,
+                recall_embedding_function=BagOfWords(),
+            )
+            memory.add([Message("user", "my cat is called tom", role="user"),
+                        Message("user", "stock prices rose today", role="user")], "a")
+            memory.add(Message("user", "the cat of b", role="user"), "b")
+            self.assertIn("a", memory._hibernated)
+
+            recalled = memory.recall("cat tom", k=1, conversation_id="a")
+            self.assertEqual([m.content for m in recalled], ["my cat is called tom"])
+            self.assertEqual(memory._recall_index._kb.collection.count(), 3)
+
+    def test_compact_downsample(self):
+        """Test old messages are downsampled and kept raw in the cold store"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account")
+            memory.add([Message("user", str(i), role="user") for i in range(100)], "c")
+            compactor = Compactor(memory, tmp, policy=downsample(every=10), keep_recent=20, batch_size=40)
+            self.addCleanup(compactor.close)
+
+            self.assertEqual(compactor.compact("c"), 80)
+            self.assertEqual(compactor.compact("c"), 0)
+            contents = [m.content for m in memory.get("c")]
+            self.assertEqual(contents[:5], ["0", "10", "20", "30", "39"])
+            self.assertEqual(contents[-20:], [str(i) for i in range(80, 100)])
+            self.assertEqual(memory.get_memory("c").hub_size(), 100)
+
+            raw = compactor.raw_messages("c", memory.get("c")[5])
+            self.assertEqual([m.content for m in raw], [str(i) for i in range(40, 80)])
+
+    def test_compact_all_prefixes(self):
+        """Test compact_all only compacts the conversations opted in by id or prefix"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account")
+            for conv in ("snapshot_a", "chat", "pinned"):
+                memory.add([Message("user", f"{conv}{i}", role="user") for i in range(20)], conv)
+
+            self.assertEqual(Compactor(memory, tmp, keep_recent=2, batch_size=8).compact_all(), {})
+            compactor = Compactor(memory, tmp, keep_recent=2, batch_size=8, conversations=["pinned"], prefixes=["snapshot_"])
+            self.addCleanup(compactor.close)
+            self.assertEqual(compactor.compact_all(), {"pinned": 16, "snapshot_a": 16})
+            self.assertEqual(memory.size("chat"), 20)
+
+    def test_compact_hub_index(self):
+        """Test messages added after compaction keep their hub index"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account", auto_upload_to_hub=True)
+            with patch("membase.memory.buffered_memory.hub_client.upload_hub") as upload:
+                memory.add([Message("user", str(i), role="user") for i in range(10)], "c")
+                compactor = Compactor(memory, tmp, policy=summarize(lambda ms: "summary"), keep_recent=2, batch_size=8)
+                self.addCleanup(compactor.close)
+                self.assertEqual(compactor.compact("c"), 8)
+                memory.add(Message("user", "10", role="user"), "c")
+            self.assertEqual(upload.call_args[0][1], "c_10")
+            self.assertEqual(upload.call_count, 11)
+            self.assertEqual(memory.sync_cursor("c"), 11)
+            self.assertEqual(memory.get("c")[0].metadata["type"], "summary")
+
+    def test_compact_resume(self):
+        """Test a pass interrupted before the replace is finished by the next one"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account")
+            memory.add([Message("user", str(i), role="user") for i in range(10)], "c")
+            compactor = Compactor(memory, tmp, keep_recent=2, batch_size=8)
+            self.addCleanup(compactor.close)
+            hot = memory.get_memory("c")
+            with patch.object(hot, "replace_range", return_value=False):
+                self.assertEqual(compactor.compact("c"), 0)
+            self.assertEqual(compactor.compact("c"), 8)
+            self.assertEqual(compactor._cold_store("c").size(), 8)
+
+    def test_compact_windowed_hub(self):
+        """Test a windowed conversation spilling to hub is compacted"""
+        hub = {}
+
+        def upload(owner, memory_id, msg, on_ack=None):
+            hub[memory_id] = msg.encode("utf-8")
+            on_ack()
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch("membase.memory.buffered_memory.hub_client.upload_hub", side_effect=upload), \
+                patch("membase.memory.windowed_memory.hub_client.download_hub",
+                      side_effect=lambda owner, filename: hub.get(filename)):
+            memory = MultiMemory(
+                membase_account="test_account", auto_upload_to_hub=True,
+                window_size=4, spill_to="hub", spill_dir=os.path.join(tmp, "spill"),
+            )
+            for i in range(20):
+                memory.add(Message("user", str(i), role="user"), "c")
+            compactor = Compactor(
+                memory, os.path.join(tmp, "cold"), policy=downsample(every=5), keep_recent=4, batch_size=8,
+                conversations=["c"],
+            )
+            self.addCleanup(compactor.close)
+
+            self.assertEqual(compactor.compact_all(), {"c": 16})
+            contents = [m.content for m in memory.get("c")]
+            self.assertEqual(contents, ["0", "5", "7", "8", "13", "15", "16", "17", "18", "19"])
+
+    def test_compact_unsupported(self):
+        """Test a conversation that cannot be rewritten is reported once, then skipped"""
+        with tempfile.TemporaryDirectory() as tmp:
+            memory = MultiMemory(membase_account="test_account")
+            memory.add([Message("user", str(i), role="user") for i in range(10)], "c")
+            compactor = Compactor(memory, tmp, keep_recent=2, batch_size=8, conversations=["c"])
+            self.addCleanup(compactor.close)
+            hot = memory.get_memory("c")
+            with patch.object(hot, "replace_range", side_effect=NotImplementedError("read only")) as replace:
+                with self.assertLogs("membase.memory.compaction", level="WARNING"):
+                    self.assertEqual(compactor.compact_all(), {})
+                self.assertEqual(compactor.compact_all(), {})
+            self.assertEqual(replace.call_count, 1)
+
+    def test_compact_persistent(self):
+        """Test the hub offset of a compacted conversation survives a reopen"""
+        with tempfile.TemporaryDirectory() as tmp:
+            storage_dir = os.path.join(tmp, "hot")
+            memory = MultiMemory(membase_account="test_account", storage_dir=storage_dir)
+            memory.add([Message("user", str(i), role="user") for i in range(10)], "c")
+            compactor = Compactor(memory, os.path.join(tmp, "cold"), keep_recent=2, batch_size=8)
+            self.addCleanup(compactor.close)
+            self.assertEqual(compactor.compact("c"), 8)
+            memory.get_memory("c").close()
+
+            reopened = MultiMemory(membase_account="test_account", storage_dir=storage_dir)
+            self.assertEqual(reopened.size("c"), 4)
+            self.assertEqual(reopened.get_memory("c").hub_size(), 10)
+            reopened.get_memory("c").close()
+
+    def test_concurrent_get_memory(self):
+        """Test racing first accesses create one memory per conversation"""
+        memory = MultiMemory(membase_account="test_account")
+        barrier = threading.Barrier(8)
+
+        def first_access(_):
+            barrier.wait()
+            return memory.get_memory("conv")
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            instances = list(executor.map(first_access, range(8)))
+        self.assertTrue(all(m is instances[0] for m in instances))
 
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file